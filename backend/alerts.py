@@ -0,0 +1,317 @@
+import re
+import time
+import logging
+import operator
+import threading
+from collections import deque
+
+import numpy as np
+
+from config import ALERT_CONFIG, ALERT_RULES
+
+logger = logging.getLogger("SNMP-Alerts")
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+RULE_TYPES = ('threshold', 'rate', 'flapping')
+
+
+def _parse(value):
+    try:
+        return float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def metric_pattern(metric):
+    """'if*_Status' -> wyrażenie dopasowujące ifN_Status; N staje się instancją alertu"""
+    return re.compile('^' + re.escape(metric).replace(r'\*', r'(\d+(?:\.\d+)*)') + '$')
+
+
+class RuleState:
+    """Stan jednej reguły dla wszystkich serii (urządzenie, instancja) w tablicach numpy"""
+
+    def __init__(self, rule, capacity=64):
+        self.rule = rule
+        self.rows = {}
+        self.keys = []
+        self._index = []
+        self._values = []
+        self._times = []
+
+        self.value = np.full(capacity, np.nan)
+        self.time = np.full(capacity, np.nan)
+        self.prev_value = np.full(capacity, np.nan)
+        self.prev_time = np.full(capacity, np.nan)
+        self.pending_since = np.full(capacity, np.nan)
+        self.flap_score = np.zeros(capacity)
+        self.flap_time = np.full(capacity, np.nan)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _grow(self):
+        for name in ('value', 'time', 'prev_value', 'prev_time', 'pending_since', 'flap_time'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.full(len(array), np.nan)]))
+        self.flap_score = np.concatenate([self.flap_score, np.zeros(len(self.flap_score))])
+        self.active = np.concatenate([self.active, np.zeros(len(self.active), dtype=bool)])
+
+    def row(self, key):
+        index = self.rows.get(key)
+        if index is None:
+            index = len(self.keys)
+            if index == len(self.value):
+                self._grow()
+            self.rows[key] = index
+            self.keys.append(key)
+        return index
+
+    def stage(self, index, value, timestamp):
+        self._index.append(index)
+        self._values.append(value)
+        self._times.append(timestamp)
+
+    def apply(self):
+        """Przenosi odczyty z bufora do tablic; zwraca maskę serii z nowym odczytem"""
+        updated = np.zeros(len(self.keys), dtype=bool)
+        if not self._index:
+            return updated
+        index = np.array(self._index, dtype=np.intp)
+        values = np.array(self._values)
+        times = np.array(self._times)
+        self._index, self._values, self._times = [], [], []
+        # Kolejne odczyty tej samej serii przed oceną - przy przypisaniu wygrywa ostatni
+        self.prev_value[index] = self.value[index]
+        self.prev_time[index] = self.time[index]
+        self.value[index] = values
+        self.time[index] = times
+        updated[index] = True
+        return updated
+
+
+class AlertEngine:
+    """Przyrostowy silnik reguł alarmowych dla całego inwentarza.
+
+    Odczyty są tylko buforowane w update() (kilka operacji na słowniku na
+    pole), a evaluate() sprawdza wszystkie serie reguły naraz operacjami na
+    tablicach numpy.  Aktywny alert jest jeden na (reguła, urządzenie,
+    instancja) - kolejne spełnienia warunku go nie powielają.
+
+    Typy reguł:
+      threshold - wartość spełnia warunek (op, value),
+      rate      - zmiana wartości na sekundę spełnia warunek,
+      flapping  - liczba zmian wartości w oknie 'window' s >= 'changes'.
+    Opcjonalne 'for' wymaga, by warunek trwał tyle sekund przed alarmem.
+    """
+
+    def __init__(self, rules=None, on_event=None, **options):
+        self.options = dict(ALERT_CONFIG, **options)
+        self.on_event = on_event
+        self.rules = []
+        self.states = []
+        self._patterns = []
+        self._matches = {}
+        self._active = {}
+        self.events = deque(maxlen=self.options['recent_events'])
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.stats = {
+            "samples": 0,
+            "evaluations": 0,
+            "fired": 0,
+            "resolved": 0,
+            "last_eval_ms": 0.0,
+        }
+        for rule in (ALERT_RULES if rules is None else rules):
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        rule = dict({'type': 'threshold', 'op': '>', 'for': 0, 'severity': 'warning'}, **rule)
+        if rule['type'] not in RULE_TYPES:
+            raise ValueError(f"Nieznany typ reguły {rule['type']}: {rule['name']}")
+        if rule['type'] == 'flapping':
+            rule.setdefault('window', 300)
+            rule.setdefault('changes', 4)
+        elif rule['op'] not in OPERATORS:
+            raise ValueError(f"Nieznany operator {rule['op']}: {rule['name']}")
+        with self._lock:
+            self.rules.append(rule)
+            self.states.append(RuleState(rule))
+            self._patterns.append(metric_pattern(rule['metric']))
+            self._matches.clear()
+
+    def _rules_for(self, key):
+        """Reguły pasujące do pola odczytu - wynik zapamiętywany per nazwa pola"""
+        matches = self._matches.get(key)
+        if matches is None:
+            matches = []
+            for number, pattern in enumerate(self._patterns):
+                match = pattern.match(key)
+                if match:
+                    matches.append((number, match.group(1) if match.groups() else ''))
+            self._matches[key] = matches
+        return matches
+
+    def update(self, device, data, timestamp=None):
+        """Rejestruje odczyt urządzenia; warunki są sprawdzane w evaluate()"""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self.stats["samples"] += 1
+            for key, value in data.items():
+                matches = self._rules_for(key)
+                if not matches:
+                    continue
+                number = _parse(value)
+                if number is None:
+                    continue
+                for rule_number, instance in matches:
+                    state = self.states[rule_number]
+                    state.stage(state.row((device, instance)), number, timestamp)
+
+    def _condition(self, state, updated, now):
+        rule = state.rule
+        count = len(state)
+        value = state.value[:count]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if rule['type'] == 'threshold':
+                return OPERATORS[rule['op']](value, rule['value'])
+
+            if rule['type'] == 'rate':
+                rate = (value - state.prev_value[:count]) / (state.time[:count] - state.prev_time[:count])
+                return OPERATORS[rule['op']](rate, rule['value'])
+
+            # flapping: licznik zmian wygaszany wykładniczo ze stałą czasową okna
+            score = state.flap_score[:count]
+            last = state.flap_time[:count]
+            elapsed = np.where(np.isnan(last), 0.0, now - last)
+            score *= np.exp(-elapsed / rule['window'])
+            changed = updated & (value != state.prev_value[:count]) & ~np.isnan(state.prev_value[:count])
+            score += changed
+            last[:] = now
+            return score >= rule['changes']
+
+    def evaluate(self, now=None):
+        """Ocena wszystkich reguł dla wszystkich serii; zwraca listę nowych zdarzeń"""
+        now = now or time.time()
+        started = time.perf_counter()
+        events = []
+        with self._lock:
+            for state in self.states:
+                count = len(state)
+                if not count:
+                    continue
+                rule = state.rule
+                updated = state.apply()
+                condition = self._condition(state, updated, now)
+
+                # Seria bez świeżego odczytu (urządzenie nie odpowiada) nie utrzymuje alarmu
+                condition &= (now - state.time[:count]) <= self.options['stale_after']
+
+                pending = state.pending_since[:count]
+                pending[:] = np.where(condition, np.where(np.isnan(pending), now, pending), np.nan)
+                firing = condition & (now - pending >= rule['for'])
+
+                active = state.active[:count]
+                for index in np.flatnonzero(firing & ~active):
+                    events.append(self._fire(state, index, now))
+                for index in np.flatnonzero(active & ~firing):
+                    events.append(self._resolve(state, index, now))
+                active[:] = firing
+
+            self.stats["evaluations"] += 1
+            self.stats["last_eval_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self.events.extend(events)
+
+        if self.on_event:
+            for event in events:
+                try:
+                    self.on_event(event)
+                except Exception as e:
+                    logger.error(f"Błąd obsługi alertu {event['rule']}: {e}")
+        return events
+
+    def _alert_key(self, state, index):
+        device, instance = state.keys[index]
+        return state.rule['name'], device, instance
+
+    def _fire(self, state, index, now):
+        rule = state.rule
+        name, device, instance = self._alert_key(state, index)
+        alert = {
+            "rule": name,
+            "device": device,
+            "instance": instance,
+            "metric": rule['metric'].replace('*', instance),
+            "severity": rule['severity'],
+            "value": float(state.value[index]),
+            "since": float(state.pending_since[index]),
+            "fired_at": now,
+        }
+        self._active[(name, device, instance)] = alert
+        self.stats["fired"] += 1
+        logger.warning(f"Alarm {name} na {device} {alert['metric']}={alert['value']:g}")
+        return dict(alert, state="firing")
+
+    def _resolve(self, state, index, now):
+        key = self._alert_key(state, index)
+        alert = self._active.pop(key, None) or dict(zip(("rule", "device", "instance"), key))
+        self.stats["resolved"] += 1
+        logger.info(f"Koniec alarmu {key[0]} na {key[1]}")
+        return dict(alert, state="resolved", resolved_at=now)
+
+    def active(self, device=None):
+        with self._lock:
+            alerts = list(self._active.values())
+        return [dict(a) for a in alerts if device is None or a["device"] == device]
+
+    def recent(self, limit=100, device=None):
+        with self._lock:
+            events = [e for e in self.events if device is None or e["device"] == device]
+        return events[-limit:]
+
+    def forget(self, device):
+        """Kończy alarmy urządzenia usuniętego z inwentarza (serie pozostają nieaktywne)"""
+        with self._lock:
+            for key in [k for k in self._active if k[1] == device]:
+                del self._active[key]
+            for state in self.states:
+                for (name, instance), index in state.rows.items():
+                    if name == device:
+                        state.active[index] = False
+                        state.time[index] = np.nan
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats,
+                        rules=len(self.rules),
+                        series=sum(len(s) for s in self.states),
+                        active=len(self._active))
+
+    # Ocena cykliczna w wątku tła
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="alert-engine")
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.options['interval']):
+            try:
+                self.evaluate()
+            except Exception as e:
+                logger.error(f"Błąd oceny reguł alarmowych: {e}")
+
+    def stop(self):
+        self._stop.set()
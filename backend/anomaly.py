@@ -0,0 +1,399 @@
+import math
+import time
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from alerts import metric_pattern
+from export import escape_tag
+from config import ANOMALY_CONFIG
+
+logger = logging.getLogger("SNMP-Anomaly")
+
+MEASUREMENT = "snmp_anomaly"
+
+# Przedziały doby wzorca sezonowego (godziny)
+TOD_BUCKETS = 24
+
+# Tablice serii i ich wartości początkowe
+ARRAYS = {
+    'raw': np.nan,          # ostatnia wartość odczytu (dla metryk ':rate' - licznik)
+    'raw_time': np.nan,
+    'observed': np.nan,     # ostatnia oceniana wartość (wartość albo zmiana na sekundę)
+    'seen': np.nan,         # czas ostatniej aktualizacji wzorca
+    'mean': np.nan,
+    'var': 0.0,
+    'count': 0.0,
+    'expected': np.nan,
+    'std': np.nan,
+    'score': np.nan,
+    'since': np.nan,
+    'anomalous': False,
+    'is_rate': False,
+}
+TOD_ARRAYS = {'tod_mean': np.nan, 'tod_var': 0.0, 'tod_count': 0.0}
+
+
+def _parse(value):
+    try:
+        return float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_metrics(spec):
+    """'cpuUsage,if*_ErrIn:rate' -> [(wyrażenie, czy zmiana na sekundę)]"""
+    metrics = []
+    for item in spec.split(','):
+        metric, _, kind = item.strip().partition(':')
+        if not metric:
+            continue
+        if kind not in ('', 'rate'):
+            raise ValueError(f"Nieznany rodzaj metryki anomalii {item.strip()}")
+        metrics.append((metric_pattern(metric), kind == 'rate'))
+    return metrics
+
+
+def _ewm_update(mean, var, count, observed, alpha, limit):
+    """Krok EWMA średniej i wariancji; po rozgrzaniu odchylenie jest obcinane do 'limit',
+    żeby pojedyncza anomalia nie przesuwała wzorca (trwała zmiana poziomu przesuwa go stopniowo)
+    """
+    first = count == 0
+    diff = np.where(first, 0.0, observed - mean)
+    diff = np.where(np.isnan(limit), diff, np.clip(diff, -limit, limit))
+    increment = alpha * diff
+    return (np.where(first, observed, mean + increment),
+            np.where(first, 0.0, (1 - alpha) * (var + diff * increment)))
+
+
+class AnomalyDetector:
+    """Kroczące wzorce serii (urządzenie, metryka) i wykrywanie odchyleń.
+
+    Każda seria ma wykładniczo ważoną średnią i wariancję (zanik z czasem
+    połowicznym 'halflife', więc nieregularne odstępy odczytów są
+    uwzględniane), a opcjonalnie także osobny wzorzec dla każdej godziny
+    doby.  update() tylko buforuje odczyty; evaluate(), raz na cykl odpytań,
+    ocenia i aktualizuje wszystkie serie naraz operacjami na tablicach numpy
+    - koszt na serię jest stały niezależnie od rozmiaru floty.  Anomalia
+    zaczyna się przy |z| >= 'threshold', a kończy przy |z| < 'clear'.
+    Wyniki serii trafiają do export(lines) w formacie line protocol.
+    """
+
+    def __init__(self, on_event=None, export=None, capacity=256, **options):
+        self.options = dict(ANOMALY_CONFIG, **options)
+        if self.options['write'] not in ('all', 'anomalies', 'none'):
+            raise ValueError(f"Nieznany tryb zapisu anomalii: {self.options['write']}")
+        self.on_event = on_event
+        self.export = export
+        self.metrics_spec = parse_metrics(self.options['metrics'])
+        self.rows = {}
+        self.keys = []
+        self._prefixes = []
+        self._device_rows = {}
+        self._free = []
+        self._released = []
+        self._kinds = {}
+        self._index = []
+        self._values = []
+        self._times = []
+        self._active = {}
+        self.events = deque(maxlen=self.options['recent_events'])
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self._fills = dict(ARRAYS, **(TOD_ARRAYS if self.options['seasonal'] else {}))
+        for name, fill in self._fills.items():
+            shape = (capacity, TOD_BUCKETS) if name in TOD_ARRAYS else capacity
+            setattr(self, name, np.full(shape, fill))
+
+        self.stats = {
+            "samples": 0,
+            "evaluations": 0,
+            "scored": 0,
+            "started": 0,
+            "ended": 0,
+            "last_eval_ms": 0.0,
+        }
+
+    # Serie
+
+    def _kind(self, key):
+        """None dla pól bez wzorca, inaczej czy metryka jest zmianą licznika - wynik per nazwa pola"""
+        kind = self._kinds.get(key, ())
+        if kind == ():
+            kind = next((rate for pattern, rate in self.metrics_spec if pattern.match(key)), None)
+            self._kinds[key] = kind
+        return kind
+
+    def _grow(self):
+        for name, fill in self._fills.items():
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.full(array.shape, fill)]))
+
+    def _row(self, device, metric, rate):
+        key = (device, metric)
+        index = self.rows.get(key)
+        if index is None:
+            if self._free:
+                index = self._free.pop()
+                self.keys[index] = key
+                self._prefixes[index] = None
+            else:
+                index = len(self.keys)
+                if index == len(self.mean):
+                    self._grow()
+                self.keys.append(key)
+                self._prefixes.append(None)
+            self.rows[key] = index
+            self.is_rate[index] = rate
+            self._device_rows.setdefault(device, set()).add(index)
+        return index
+
+    def update(self, device, data, timestamp=None):
+        """Rejestruje odczyt urządzenia; wzorce są aktualizowane w evaluate()"""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self.stats["samples"] += 1
+            for key, value in data.items():
+                rate = self._kind(key)
+                if rate is None:
+                    continue
+                number = _parse(value)
+                if number is None:
+                    continue
+                self._index.append(self._row(device, key, rate))
+                self._values.append(number)
+                self._times.append(timestamp)
+
+    def forget(self, device):
+        """Usuwa serie urządzenia; wiersze są używane ponownie po najbliższej ocenie"""
+        with self._lock:
+            for index in self._device_rows.pop(device, ()):
+                del self.rows[self.keys[index]]
+                self._active.pop(self.keys[index], None)
+                for name, fill in self._fills.items():
+                    getattr(self, name)[index] = fill
+                self._released.append(index)
+
+    # Ocena
+
+    def _take(self):
+        """Bufor odczytów jako tablice - ostatni odczyt każdej serii z cyklu"""
+        index = np.array(self._index, dtype=np.intp)
+        values = np.array(self._values)
+        times = np.array(self._times)
+        self._index, self._values, self._times = [], [], []
+        if self._released:
+            # Odczyty urządzeń usuniętych po buforowaniu
+            keep = ~np.isin(index, self._released)
+            index, values, times = index[keep], values[keep], times[keep]
+            self._free.extend(self._released)
+            self._released = []
+        if index.size:
+            last = len(index) - 1 - np.unique(index[::-1], return_index=True)[1]
+            index, values, times = index[last], values[last], times[last]
+        return index, values, times
+
+    def _observe(self, index, values, times):
+        """Wartości oceniane: odczyt albo zmiana licznika na sekundę (NaN po restarcie licznika)"""
+        observed = values
+        rate = self.is_rate[index]
+        if rate.any():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                change = (values - self.raw[index]) / (times - self.raw_time[index])
+            change = np.where(np.isfinite(change) & (change >= 0), change, np.nan)
+            observed = np.where(rate, change, values)
+        self.raw[index] = values
+        self.raw_time[index] = times
+        return observed
+
+    def _score(self, index, observed, times, now):
+        options = self.options
+        count = self.count[index]
+        mean, var = self.mean[index], self.var[index]
+        dt = np.nan_to_num(times - self.seen[index], nan=0.0).clip(min=0.0)
+        # Na początku zwykła średnia z dotychczasowych odczytów - sam zanik EWMA zostawiłby wzorzec przy pierwszym odczycie
+        alpha = np.maximum(-np.expm1(-dt * math.log(2) / options['halflife']), 1.0 / (count + 1))
+
+        expected, variance = mean, var
+        if options['seasonal']:
+            # Godzina doby czasu lokalnego serwera
+            offset = time.localtime(now).tm_gmtoff
+            bucket = ((times + offset) // (86400 / TOD_BUCKETS)).astype(np.intp) % TOD_BUCKETS
+            tod_count = self.tod_count[index, bucket]
+            tod_mean, tod_var = self.tod_mean[index, bucket], self.tod_var[index, bucket]
+            seasonal = tod_count >= options['warmup']
+            expected = np.where(seasonal, tod_mean, mean)
+            variance = np.where(seasonal, tod_var, var)
+
+        std = np.maximum(np.sqrt(variance), np.maximum(options['min_std'], options['min_std_ratio'] * np.abs(expected)))
+        ready = count >= options['warmup']
+        with np.errstate(invalid='ignore'):
+            score = np.where(ready, (observed - expected) / std, np.nan)
+        limit = np.where(ready, options['threshold'] * std, np.nan)
+
+        self.mean[index], self.var[index] = _ewm_update(mean, var, count, observed, alpha, limit)
+        self.count[index] = count + 1
+        self.seen[index] = times
+        if options['seasonal']:
+            # Przedział godzinowy dostaje 1/24 czasu - zanik liczony w czasie tego przedziału
+            tod_alpha = np.maximum(-np.expm1(-dt * math.log(2) * TOD_BUCKETS / options['seasonal_halflife']),
+                                   1.0 / (tod_count + 1))
+            self.tod_mean[index, bucket], self.tod_var[index, bucket] = _ewm_update(
+                tod_mean, tod_var, tod_count, observed, tod_alpha, limit)
+            self.tod_count[index, bucket] = tod_count + 1
+
+        self.observed[index] = observed
+        self.expected[index] = expected
+        self.std[index] = std
+        self.score[index] = score
+        return score, ready
+
+    def evaluate(self, now=None):
+        """Ocena buforowanych odczytów wszystkich serii; zwraca listę zdarzeń (początek/koniec anomalii)"""
+        now = now or time.time()
+        started = time.perf_counter()
+        events, lines = [], []
+        with self._lock:
+            index, values, times = self._take()
+            observed = self._observe(index, values, times)
+            valid = ~np.isnan(observed)
+            index, observed, times = index[valid], observed[valid], times[valid]
+
+            if index.size:
+                score, ready = self._score(index, observed, times, now)
+                active = self.anomalous[index]
+                magnitude = np.abs(np.nan_to_num(score, nan=0.0))
+                firing = ready & np.where(active, magnitude >= self.options['clear'],
+                                          magnitude >= self.options['threshold'])
+                self.anomalous[index] = firing
+                for row in index[firing & ~active]:
+                    events.append(self._start(row))
+                for row in index[active & ~firing]:
+                    events.append(self._end(row, now))
+                if self.options['write'] != 'none':
+                    written = firing if self.options['write'] == 'anomalies' else ready
+                    lines = self._lines(index[written], times[written])
+                self.stats["scored"] += int(ready.sum())
+
+            # Seria bez świeżego odczytu (urządzenie nie odpowiada) nie utrzymuje anomalii
+            count = len(self.keys)
+            stale = self.anomalous[:count] & (now - self.seen[:count] > self.options['stale_after'])
+            for row in np.flatnonzero(stale):
+                self.anomalous[row] = False
+                events.append(self._end(row, now))
+
+            self.stats["evaluations"] += 1
+            self.stats["last_eval_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self.events.extend(events)
+
+        if lines and self.export:
+            self.export(lines)
+        if self.on_event:
+            for event in events:
+                try:
+                    self.on_event(event)
+                except Exception as e:
+                    logger.error(f"Błąd obsługi anomalii {event['metric']}: {e}")
+        return events
+
+    def _lines(self, rows, times):
+        """Line protocol wyników; prefiks z tagami serii jest budowany raz"""
+        lines = []
+        for row, timestamp, score, expected, std, active in zip(
+                rows.tolist(), (times * 1000).astype(np.int64).tolist(), self.score[rows].tolist(),
+                self.expected[rows].tolist(), self.std[rows].tolist(), self.anomalous[rows].tolist()):
+            prefix = self._prefixes[row]
+            if prefix is None:
+                device, metric = self.keys[row]
+                prefix = self._prefixes[row] = f"{MEASUREMENT},device={escape_tag(device)},oid={escape_tag(metric)}"
+            lines.append(f"{prefix} score={score:.4g},expected={expected:.6g},std={std:.6g},"
+                         f"anomaly={int(active)}i {timestamp}")
+        return lines
+
+    def _anomaly(self, row):
+        device, metric = self.keys[row]
+        return {
+            "device": device,
+            "metric": metric,
+            "value": float(self.observed[row]),
+            "expected": float(self.expected[row]),
+            "std": float(self.std[row]),
+            "score": round(float(self.score[row]), 2),
+        }
+
+    def _start(self, row):
+        anomaly = dict(self._anomaly(row), since=float(self.seen[row]))
+        self.since[row] = self.seen[row]
+        self._active[self.keys[row]] = anomaly
+        self.stats["started"] += 1
+        logger.warning(f"Anomalia {anomaly['metric']} na {anomaly['device']}: {anomaly['value']:g} "
+                       f"(oczekiwano {anomaly['expected']:g} ± {anomaly['std']:.3g}, z={anomaly['score']})")
+        return dict(anomaly, state="started")
+
+    def _end(self, row, now):
+        key = self.keys[row]
+        anomaly = self._active.pop(key, None) or {"device": key[0], "metric": key[1]}
+        self.since[row] = np.nan
+        self.stats["ended"] += 1
+        logger.info(f"Koniec anomalii {key[1]} na {key[0]}")
+        return dict(anomaly, state="ended", ended_at=now)
+
+    # Odczyt
+
+    def active(self, device=None):
+        with self._lock:
+            anomalies = list(self._active.values())
+        return [dict(a) for a in anomalies if device is None or a["device"] == device]
+
+    def recent(self, limit=100, device=None):
+        with self._lock:
+            events = [e for e in self.events if device is None or e["device"] == device]
+        return events[-limit:]
+
+    def series(self, device):
+        """Wzorce serii urządzenia: ostatnia wartość, oczekiwana, odchylenie i z-score"""
+        with self._lock:
+            rows = sorted(self._device_rows.get(device, ()), key=lambda row: self.keys[row][1])
+            return {self.keys[row][1]: {
+                "value": _finite(self.observed[row]),
+                "expected": _finite(self.expected[row]),
+                "std": _finite(self.std[row]),
+                "score": _finite(self.score[row]),
+                "samples": int(self.count[row]),
+                "anomaly": bool(self.anomalous[row]),
+            } for row in rows}
+
+    def metrics(self):
+        with self._lock:
+            series = len(self.rows)
+            return dict(self.stats,
+                        series=series,
+                        active=len(self._active),
+                        eval_us_per_series=round(self.stats["last_eval_ms"] * 1000 / series, 3) if series else 0.0)
+
+    # Ocena cykliczna w wątku tła
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="anomaly-detector")
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.options['interval']):
+            try:
+                self.evaluate()
+            except Exception as e:
+                logger.error(f"Błąd oceny anomalii: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def _finite(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
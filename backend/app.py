@@ -18,7 +18,7 @@ vendor_dir = os.path.join(base_dir, 'vendor')
 if os.path.exists(vendor_dir):
     sys.path.insert(0, vendor_dir)
 
-from flask import Flask, jsonify, render_template, send_file
+from flask import Flask, jsonify, render_template, send_file, request, Response
 from flask_cors import CORS
 from datetime import datetime
 import json
@@ -29,9 +29,25 @@ import logging
 from influxdb import InfluxDBClient
 from io import BytesIO
 from snmp_scan import SNMPManager
-from config import SNMP_CONFIG
-from export import export_to_influxdb
-from report import create_report
+from poller import AsyncPoller
+from sharded_poller import ShardedPoller
+from history import query_history, parse_history_args, to_rows
+from bulk_export import BulkExporter, parse_export_args, FORMATS
+from history_cache import HistoryCache
+from rates import CounterRateCalculator
+from sample_store import LatestSampleStore, has_errors
+from recent_history import RecentHistoryStore
+from retention import RetentionManager
+from inventory import Inventory
+from config import (SNMP_CONFIG, POLLER_CONFIG, REPORT_CONFIG, TRAP_CONFIG, RECENT_HISTORY_CONFIG,
+                    RETENTION_CONFIG, ANOMALY_CONFIG, HISTORY_CACHE_CONFIG)
+from export import export_to_influxdb, get_writer, numeric_fields
+from compression import get_compressor
+from prometheus import MetricsExposition, stage_seconds, influx_write_seconds, observe_stage, CONTENT_TYPE
+from report import create_report, create_multi_report, ReportCache
+from traps import TrapReceiver
+from alerts import AlertEngine
+from anomaly import AnomalyDetector
 
 # Logowanie
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +58,31 @@ CORS(app)
 
 snmp_manager = SNMPManager()
 
+# Inwentarz z INVENTORY_PATH (albo config.DEVICES); zmiany plików są stosowane bez restartu
+inventory = Inventory()
+inventory.load()
+
+# Ostatnie odczyty urządzeń - endpointy HTTP czytają stąd zamiast odpytywać SNMP
+latest_samples = LatestSampleStore(stale_after=3 * POLLER_CONFIG['interval'])
+DEFAULT_DEVICE = inventory.devices()[0]['name'] if len(inventory) else SNMP_CONFIG['host']
+report_cache = ReportCache()
+SSE_HEARTBEAT = 15
+
+# Ostatnia godzina odczytów w pamięci - historia i raporty bez zapytań do InfluxDB
+recent_history = RecentHistoryStore() if RECENT_HISTORY_CONFIG['enabled'] else None
+
+# Treść /metrics: bloki wartości urządzeń aktualizowane przy każdym odczycie
+metrics_exposition = MetricsExposition()
+
+# Reguły alarmowe (config.ALERT_RULES) oceniane cyklicznie dla całego inwentarza
+alert_engine = AlertEngine()
+
+# Kroczące wzorce metryk (EWMA) oceniane raz na cykl odpytań; wyniki trafiają do snmp_anomaly w InfluxDB
+anomaly_detector = AnomalyDetector(export=lambda lines: get_writer().write(lines)) if ANOMALY_CONFIG['enabled'] else None
+
+# Przepływności interfejsów liczone przy każdym odczycie i zapisywane obok liczników
+rate_calculator = CounterRateCalculator()
+
 # Połączenie z InfluxDB
 influx_client = InfluxDBClient(
     host=SNMP_CONFIG['influx_host'],
@@ -54,93 +95,384 @@ try:
 except Exception as e:
     logger.warning(f"Ostrzeżenie InfluxDB: {e}")
 
+# Surowe odczyty przez RETENTION_RAW, starsze zakresy z poziomów 1m/1h (konfigurowane w wątku tła)
+retention = RetentionManager(influx_client, SNMP_CONFIG['influx_db']) if RETENTION_CONFIG['enabled'] else None
+bulk_exporter = BulkExporter(influx_client, SNMP_CONFIG['influx_db'], retention=retention)
+
+# Wyniki zapytań historii współdzielone przez dashboardy i raporty w obrębie okresu pollera
+history_cache = HistoryCache(influx_client, SNMP_CONFIG['influx_db'], recent=recent_history,
+                             retention=retention) if HISTORY_CACHE_CONFIG['enabled'] else None
+
+def load_history(**params):
+    """(historia, status pamięci podręcznej) - przez history_cache, gdy jest włączony"""
+    if history_cache:
+        return history_cache.query(**params)
+    return query_history(influx_client, SNMP_CONFIG['influx_db'], recent=recent_history,
+                         retention=retention, **params), 'off'
+
+def handle_poll_result(device, data, state):
+    # data - świeży wynik odpytanej grupy OID, state - pełny stan urządzenia (wszystkie grupy)
+    started = time.perf_counter()
+    try:
+        if not has_errors(data):
+            data.update(rate_calculator.process(device, data))
+            state = dict(state, **rate_calculator.latest(device))
+        sample = latest_samples.publish(device, state)
+        metrics_exposition.update_device(device, numeric_fields(state), sample.ok)
+
+        if not has_errors(data) and data:
+            alert_engine.update(device, data)
+            if anomaly_detector:
+                anomaly_detector.update(device, data)
+            if recent_history:
+                recent_history.append(device, data)
+            export_to_influxdb(data, device=device)
+            logger.debug(f"Zapisano dane {device}: CPU={data.get('cpuUsage')}%")
+    except Exception as e:
+        logger.error(f"Błąd monitoringu: {e}")
+    observe_stage('export', time.perf_counter() - started)
+
+if POLLER_CONFIG['workers'] > 1:
+    # Inwentarz podzielony między procesy - każdy z własnym silnikiem SNMP
+    poller = ShardedPoller(inventory.devices(), on_result=handle_poll_result)
+else:
+    poller = AsyncPoller(inventory.devices(), on_result=handle_poll_result)
+
+def handle_trap_event(event):
+    # Stan z powiadomienia trafia od razu do odbiorców, a poller potwierdza go pełnym odczytem
+    device, fields = event["device"], event["fields"]
+    try:
+        if fields:
+            sample = latest_samples.get(device)
+            sample = latest_samples.publish(device, dict(sample.data if sample else {}, **fields))
+            metrics_exposition.update_device(device, numeric_fields(sample.data), sample.ok)
+            alert_engine.update(device, fields)
+            if recent_history:
+                recent_history.append(device, fields)
+            export_to_influxdb(fields, device=device)
+        poller.trigger(device)
+        logger.info(f"Powiadomienie {event['trap']} od {device}")
+    except Exception as e:
+        logger.error(f"Błąd obsługi powiadomienia: {e}")
+
+trap_receiver = TrapReceiver(inventory.devices(), on_event=handle_trap_event)
+
+def handle_inventory_change(added, changed, removed):
+    # Poller dostaje tylko różnicę - pozostałe urządzenia zachowują harmonogram i stan
+    poller.update_devices(added=added, changed=changed, removed=removed)
+    trap_receiver.set_devices(inventory.devices())
+    for device in removed:
+        latest_samples.forget(device)
+        metrics_exposition.forget_device(device)
+        rate_calculator.forget(device)
+        alert_engine.forget(device)
+        if anomaly_detector:
+            anomaly_detector.forget(device)
+        if recent_history:
+            recent_history.forget(device)
+        if get_compressor():
+            get_compressor().forget(device)
+
+inventory.on_change = handle_inventory_change
+
 def background_monitoring():
     time.sleep(5)
-    logger.info("Uruchamianie monitoringu w tle")
-    
-    while True:
-        try:
-            data = snmp_manager.get_snmp_data()
-            error_found = any("Error" in str(val) or "Exception" in str(val) for val in data.values())
-            
-            if not error_found and data:
-                export_to_influxdb(data)
-                logger.debug(f"Zapisano dane: CPU={data.get('cpuUsage')}%")
-        except Exception as e:
-            logger.error(f"Błąd monitoringu: {e}")
-        
-        time.sleep(10)
+    logger.info(f"Uruchamianie monitoringu w tle ({len(inventory)} urządzeń)")
+    poller.run_forever()
 
 if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
     monitor_thread = threading.Thread(target=background_monitoring, daemon=True)
     monitor_thread.start()
+    alert_engine.start()
+    inventory.start()
+    if anomaly_detector:
+        anomaly_detector.start()
+    if retention:
+        retention.start()
+    if TRAP_CONFIG['enabled']:
+        try:
+            trap_receiver.start()
+        except OSError as e:
+            logger.error(f"Nie można uruchomić odbiornika powiadomień na porcie {TRAP_CONFIG['port']}: {e}")
 
 
-def get_history_data(hours=1):
+def get_history_data(hours=1, device=None, points=None):
     try:
-        influx_client.switch_database(SNMP_CONFIG['influx_db'])
-        cpu_query = f"SELECT value FROM snmp_metrics WHERE oid = 'cpuUsage' AND time > now() - {hours}h"
-        ram_query = f"SELECT value FROM snmp_metrics WHERE oid = 'ramUsage' AND time > now() - {hours}h"
-        
-        cpu_res = list(influx_client.query(cpu_query).get_points())
-        ram_res = list(influx_client.query(ram_query).get_points())
-
-        history = []
-        for i, cpu_point in enumerate(cpu_res):
-            ram_val = 0
-            if i < len(ram_res):
-                ram_val = ram_res[i]['value']
-            
-            item = {
-                'timestamp': cpu_point['time'],
-                'data': { 'cpuUsage': cpu_point['value'], 'ramUsage': ram_val }
-            }
-            history.append(item)
-        return history
+        end = int(time.time())
+        history, _ = load_history(start=end - hours * 3600, end=end, points=points or hours * 360,
+                                  agg='mean', device=device)
+        return to_rows(history)
     except Exception as e:
         logger.error(f"Błąd historii DB: {str(e)}")
         return []
 
 
+def get_latest_sample(device=None):
+    device = device or DEFAULT_DEVICE
+    sample = latest_samples.get(device)
+    if sample is None and device == SNMP_CONFIG['host']:
+        # Poller w tle jeszcze nie zdążył - jednorazowe odpytanie na żywo
+        sample = latest_samples.publish(device, snmp_manager.get_snmp_data())
+    return sample
+
+def sample_response(sample):
+    """Odpowiedź z gotowej migawki z obsługą If-None-Match"""
+    response = Response(sample.body, mimetype='application/json')
+    response.set_etag(sample.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Sample-Updated'] = f"{sample.updated_at:.3f}"
+    response.headers['X-Sample-Age'] = f"{latest_samples.age(sample):.1f}"
+    response.headers['X-Sample-Stale'] = str(latest_samples.is_stale(sample)).lower()
+    return response.make_conditional(request)
+
 @app.route('/')
 def home():
-    return jsonify(snmp_manager.get_snmp_data())
+    return get_snmp_data_endpoint()
 
 @app.route('/snmp')
 def get_snmp_data_endpoint():
-    return jsonify(snmp_manager.get_snmp_data())
+    sample = get_latest_sample(request.args.get('device'))
+    if sample is None:
+        return jsonify({"error": "Brak danych dla urządzenia"}), 404
+    return sample_response(sample)
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/stream')
+def stream_samples():
+    """Strumień SSE: pełna migawka po połączeniu, potem tylko zmienione pola"""
+    device = request.args.get('device') or DEFAULT_DEVICE
+    all_devices = device == '*'
+    if not all_devices:
+        get_latest_sample(device)
+    # Subskrypcja przed migawką - zmiana w międzyczasie przyjdzie najwyżej dwa razy
+    subscription = latest_samples.subscribe(None if all_devices else [device])
+
+    def generate():
+        try:
+            if all_devices:
+                snapshot = {name: sample.data for name, sample in latest_samples.devices().items()}
+            else:
+                sample = latest_samples.get(device)
+                snapshot = sample.data if sample else {}
+            yield "retry: 5000\n" + sse_event('snapshot', snapshot)
+
+            while True:
+                changes = subscription.get(timeout=SSE_HEARTBEAT)
+                if not changes:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_event('update', changes if all_devices else changes.get(device, {}))
+        finally:
+            latest_samples.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/api/history')
 def get_history_api():
     try:
-        history = get_history_data(hours=24)
-        return jsonify(history)
+        params = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        history, cache_status = load_history(**params)
+        response = jsonify(history)
+        response.headers['X-History-Cache'] = cache_status
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/devices')
 def get_devices():
-    return jsonify(snmp_manager.get_devices())
+    samples = latest_samples.devices()
+    devices = {}
+    for device in inventory.devices(tag=request.args.get('tag')):
+        # Ukrywamy hasła w odpowiedzi API; OID profilu zastępuje jego nazwa
+        safe_config = {k: v for k, v in device.items() if 'password' not in k and 'key' not in k and k != 'oids'}
+        sample = samples.get(device['name'])
+        info = latest_samples.metadata(sample) if sample else {"status": "unknown"}
+        info["config"] = safe_config
+        interfaces = poller.discovery.interfaces(device['name'])
+        if interfaces:
+            info["interfaces"] = interfaces
+        devices[device['name']] = info
+    return jsonify(devices)
 
 @app.route('/api/status')
 def get_status():
-    return jsonify({"status": "running", "timestamp": datetime.now().isoformat()})
+    return jsonify({
+        "status": "running",
+        "timestamp": datetime.now().isoformat(),
+        "poller": poller.stats.snapshot(),
+        "stream_subscribers": latest_samples.subscriber_count(),
+        "influx_writer": get_writer().metrics(),
+        "compression": get_compressor().metrics() if get_compressor() else None,
+        "usm_cache": poller.usm_cache.metrics(),
+        "report_cache": report_cache.metrics(),
+        "traps": trap_receiver.metrics(),
+        "alerts": alert_engine.metrics(),
+        "anomalies": anomaly_detector.metrics() if anomaly_detector else None,
+        "recent_history": recent_history.metrics() if recent_history else None,
+        "retention": retention.metrics() if retention else None,
+        "bulk_export": bulk_exporter.metrics(),
+        "history_cache": history_cache.metrics() if history_cache else None,
+        "inventory": inventory.metrics()
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Metryki urządzeń i samego monitora w formacie tekstowym Prometheusa"""
+    body = metrics_exposition.render(
+        sections={
+            "poller": poller.stats.snapshot(),
+            "influx_writer": get_writer().metrics(),
+            "compression": get_compressor().metrics() if get_compressor() else {},
+            "usm_cache": poller.usm_cache.metrics(),
+            "report_cache": report_cache.metrics(),
+            "traps": trap_receiver.metrics(),
+            "alerts": alert_engine.metrics(),
+            "anomalies": anomaly_detector.metrics() if anomaly_detector else {},
+            "recent_history": recent_history.metrics() if recent_history else {},
+            "retention": retention.metrics() if retention else {},
+            "bulk_export": bulk_exporter.metrics(),
+            "history_cache": history_cache.metrics() if history_cache else {},
+            "inventory": inventory.metrics(),
+            "stream": {"subscribers": latest_samples.subscriber_count()},
+        },
+        device_counts=poller.stats.device_counts(),
+        histograms=(stage_seconds.render(*poller.stats.stage_snapshots()), influx_write_seconds.render()),
+    )
+    return Response(body, content_type=CONTENT_TYPE)
+
+def parse_limit(args, maximum, default=100):
+    """Parametr 'limit' list zdarzeń: liczba dodatnia, obcinana do pojemności bufora zdarzeń"""
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise ValueError(f"Niepoprawny limit: {args.get('limit')}")
+    if limit < 1:
+        raise ValueError("Limit musi być dodatni")
+    return min(limit, maximum)
+
+@app.route('/api/alerts')
+def get_alerts():
+    device = request.args.get('device')
+    try:
+        limit = parse_limit(request.args, alert_engine.options['recent_events'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "active": alert_engine.active(device=device),
+        "events": alert_engine.recent(limit=limit, device=device),
+    })
+
+@app.route('/api/anomalies')
+def get_anomalies():
+    if not anomaly_detector:
+        return jsonify({"error": "Wykrywanie anomalii jest wyłączone"}), 404
+    device = request.args.get('device')
+    try:
+        limit = parse_limit(request.args, anomaly_detector.options['recent_events'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = {
+        "active": anomaly_detector.active(device=device),
+        "events": anomaly_detector.recent(limit=limit, device=device),
+    }
+    if device:
+        response["series"] = anomaly_detector.series(device)
+    return jsonify(response)
+
+@app.route('/api/traps')
+def get_traps():
+    try:
+        limit = parse_limit(request.args, trap_receiver.options['recent_events'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(trap_receiver.events(limit=limit, device=request.args.get('device')))
+
+def build_report(device, hours):
+    # Historia agregowana w InfluxDB do rozdzielczości wykresu; bez urządzenia - domyślne,
+    # bo historia bez filtra urządzenia to średnia całego inwentarza
+    device = device or DEFAULT_DEVICE
+    points = REPORT_CONFIG['points']
+    if device == '*':
+        devices = []
+        for d in inventory.devices():
+            sample = latest_samples.get(d['name'])
+            devices.append({
+                "name": d['name'],
+                "data": sample.data if sample else {},
+                "history": get_history_data(hours=hours, device=d['name'], points=points),
+            })
+        return create_multi_report(devices)
+
+    sample = get_latest_sample(device)
+    data = sample.data if sample else {}
+    return create_report(data, get_history_data(hours=hours, device=device, points=points))
+
+def parse_report_hours(args):
+    """Parametr 'hours' raportu PDF: liczba całkowita dodatnia"""
+    try:
+        hours = int(args.get('hours', REPORT_CONFIG['hours']))
+    except ValueError:
+        raise ValueError(f"Niepoprawna liczba godzin: {args.get('hours')}")
+    if hours < 1:
+        raise ValueError("Liczba godzin musi być dodatnia")
+    return hours
 
 @app.route('/export/report/pdf')
 def export_pdf_report():
     try:
-        data = snmp_manager.get_snmp_data()
-        history = get_history_data(hours=1)
-        
-        filename = f"raport_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        pdf_bytes = create_report(data, history)
-        
+        hours = parse_report_hours(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        device = request.args.get('device')
+        key = report_cache.key(device or DEFAULT_DEVICE, hours)
+        pdf_bytes = report_cache.get(key)
+        cache_status = 'hit'
+        if pdf_bytes is None:
+            cache_status = 'miss'
+            pdf_bytes = build_report(device, hours)
+            report_cache.put(key, pdf_bytes)
+
+        prefix = 'raport_zbiorczy' if device == '*' else 'raport'
+        filename = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         buffer = BytesIO(pdf_bytes)
         buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+        response = send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+        response.headers['X-Report-Cache'] = cache_status
+        return response
     except Exception as e:
         logger.error(f"Błąd PDF: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/export/metrics')
+def export_metrics():
+    """Historia w CSV lub NDJSON, strumieniowo (gzip, gdy klient go akceptuje)"""
+    try:
+        params = parse_export_args(request.args)
+        if request.args.get('tag'):
+            tagged = [d['name'] for d in inventory.devices(request.args['tag'])]
+            params["devices"] = [d for d in params["devices"] if d in tagged] if params["devices"] else tagged
+            if not params["devices"]:
+                return jsonify({"error": f"Brak urządzeń z tagiem {request.args['tag']}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    export_format = params.pop("format")
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    filename = f"snmp_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    headers = {'Content-Disposition': f'attachment; filename={filename}', 'X-Accel-Buffering': 'no'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(bulk_exporter.stream(export_format, compress, **params),
+                    mimetype=FORMATS[export_format], headers=headers)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
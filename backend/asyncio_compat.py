@@ -0,0 +1,10 @@
+"""Nakładki asyncio wymagane przez vendorowany pysnmp 4.4 (importować przed pysnmp.*.asyncio)"""
+import types
+import asyncio
+
+# Python 3.11+ nie ma asyncio.coroutine, z którego korzysta vendorowany pysnmp
+if not hasattr(asyncio, 'coroutine'):
+    asyncio.coroutine = types.coroutine
+# pysnmp porównuje wersję Pythona jako napisy ('10' < '4') i sięga po asyncio.async
+if not hasattr(asyncio, 'async'):
+    setattr(asyncio, 'async', asyncio.ensure_future)
@@ -0,0 +1,1505 @@
+"""Benchmarki wydajności backendu (uruchamiane ręcznie: python benchmark.py <nazwa>)"""
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+import statistics
+import http.server
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+vendor_dir = os.path.join(base_dir, 'vendor')
+if os.path.exists(vendor_dir) and vendor_dir not in sys.path:
+    sys.path.insert(0, vendor_dir)
+
+from config import SNMP_CONFIG, OIDS, DEVICES, POLL_GROUPS
+
+
+def start_local_agent(port, count=1, data_dir=None, options=()):
+    """Uruchamia lokalnego agenta snmp_agent.py w osobnym procesie"""
+    extra = (['--data-dir', data_dir] if data_dir else []) + list(options)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(base_dir, 'snmp_agent.py'), '--port', str(port), '--count', str(count)] + extra,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    proc.stdout.readline()
+    return proc
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<28} mediana={statistics.median(samples) * 1000:8.1f} ms  "
+          f"p95={p95 * 1000:8.1f} ms  n={len(samples)}")
+
+
+def legacy_poll(config):
+    """Dawna ścieżka: nowy SnmpEngine i osobne zapytanie GET dla każdego OID"""
+    from pysnmp.hlapi import (getCmd, SnmpEngine, UsmUserData, UdpTransportTarget, ContextData,
+                              ObjectType, ObjectIdentity, usmHMACMD5AuthProtocol, usmDESPrivProtocol)
+    results = {}
+    for key, oid in OIDS.items():
+        error_indication, error_status, _, var_binds = next(getCmd(
+            SnmpEngine(),
+            UsmUserData(config['username'], config['auth_key'], config['priv_key'],
+                        authProtocol=usmHMACMD5AuthProtocol, privProtocol=usmDESPrivProtocol),
+            UdpTransportTarget((config['host'], config['port']), timeout=1.0, retries=1),
+            ContextData(contextName=config['context_name']),
+            ObjectType(ObjectIdentity(oid))
+        ))
+        results[key] = str(error_indication or error_status or var_binds[0][1])
+    return results
+
+
+def bench_poll(args):
+    """Porównanie czasu odpytania urządzenia: per-OID vs jeden PDU na trwałym silniku"""
+    from snmp_scan import SNMPManager
+
+    config = dict(SNMP_CONFIG)
+    agent = None
+    # Wartości zmieniające się między odczytami porównujemy tylko na agencie ze stałymi wartościami
+    compared = list(OIDS)
+    if args.local:
+        config.update(host='127.0.0.1', port=args.port)
+        agent = start_local_agent(args.port, options=['--static'])
+    else:
+        compared = [key for key in POLL_GROUPS['inventory']['keys'] if key in OIDS]
+
+    try:
+        SNMP_CONFIG.update(host=config['host'], port=config['port'])
+        manager = SNMPManager()
+        manager.get_snmp_data()
+
+        batched, legacy = [], []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            data = manager.get_snmp_data()
+            batched.append(time.perf_counter() - start)
+        for _ in range(max(1, args.rounds // 10)):
+            start = time.perf_counter()
+            legacy_data = legacy_poll(config)
+            legacy.append(time.perf_counter() - start)
+
+        mismatched = [key for key in compared if data.get(key) != legacy_data.get(key)]
+        print(f"Urządzenie {config['host']}:{config['port']}, {len(OIDS)} OID")
+        report('per-OID (nowy silnik)', legacy)
+        report('batch GET (trwały silnik)', batched)
+        print(f"Przyspieszenie: x{statistics.median(legacy) / statistics.median(batched):.1f}")
+        if mismatched:
+            print(f"REGRESJA: wyniki obu ścieżek różnią się ({', '.join(mismatched)})")
+            sys.exit(1)
+    finally:
+        if agent:
+            agent.terminate()
+
+
+def local_devices(port, count):
+    """Inwentarz symulowanych urządzeń na kolejnych portach lokalnego agenta"""
+    return [
+        dict(DEVICES[0], name=f"sim-{i}", host='127.0.0.1', port=port + i, context_name='router')
+        for i in range(count)
+    ]
+
+
+def bench_load(args):
+    """Test obciążeniowy pollera asynchronicznego na N symulowanych agentach"""
+    import asyncio
+    from poller import AsyncPoller
+
+    agent = start_local_agent(args.port, args.devices)
+    try:
+        poller = AsyncPoller(local_devices(args.port, args.devices),
+                             concurrency=args.concurrency, timeout=2.0, retries=1)
+
+        async def run():
+            await poller.poll_once()
+            samples = []
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                results = await poller.poll_once()
+                samples.append(time.perf_counter() - start)
+            return samples, results
+
+        samples, results = asyncio.run(run())
+        ok = sum(1 for data in results.values() if data.get('sysName') == 'RTR-Main-01')
+        print(f"{args.devices} urządzeń, współbieżność {args.concurrency}, poprawnych odpowiedzi: {ok}")
+        report('cykl odpytania', samples)
+        print(f"Przepustowość: {args.devices / statistics.median(samples):.1f} urządzeń/s")
+        print(f"Statystyki pollera: {poller.stats.snapshot()}")
+    finally:
+        agent.terminate()
+
+
+class FakeInfluxHandler(http.server.BaseHTTPRequestHandler):
+    """Udaje endpoint /write InfluxDB 1.x; przy server.down odpowiada błędem 503"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.down:
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.server.requests += 1
+        self.server.points += body.count(b'\n') + (0 if body.endswith(b'\n') else 1)
+        if self.server.lines is not None:
+            self.server.lines.extend(body.decode('utf-8').splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def do_GET(self):
+        """/query z chunked=true: punkty serii server.series co 10 s w zakresie czasu zapytania"""
+        import re
+        import json
+        from urllib.parse import urlparse, parse_qs
+        params = parse_qs(urlparse(self.path).query)
+        match = re.search(r'time >= (\d+)s AND time < (\d+)s', params.get('q', [''])[0])
+        chunk_size = int(params.get('chunk_size', ['10000'])[0])
+        self.server.queries += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        if not match:
+            self.wfile.write(b'{"results":[{"statement_id":0}]}\n')
+            return
+
+        def send(values, partial):
+            series = {"name": "snmp_metrics", "columns": ["time", "value", "device", "oid"], "values": values}
+            result = dict({"statement_id": 0, "series": [series]}, **({"partial": True} if partial else {}))
+            self.wfile.write(json.dumps({"results": [result]}).encode() + b'\n')
+
+        start, end = int(match.group(1)), int(match.group(2))
+        values = []
+        for t in range(-(-start // 10) * 10, end, 10):
+            for i, (device, oid) in enumerate(self.server.series):
+                values.append([t, (t // 10 + i) % 1000, device, oid])
+                if len(values) == chunk_size:
+                    send(values, True)
+                    values = []
+        send(values, False)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_influx(series=(), keep_lines=False):
+    """Atrapa InfluxDB w wątku tła; z keep_lines zapisane linie trafiają do server.lines"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeInfluxHandler)
+    server.down, server.requests, server.points = False, 0, 0
+    server.lines = [] if keep_lines else None
+    server.series, server.queries = list(series), 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_writer(args):
+    """Zapis punktów przez InfluxWriter do lokalnej atrapy InfluxDB, z symulowaną awarią bazy"""
+    import tempfile
+    from export import InfluxWriter
+
+    server = start_fake_influx()
+    spool = os.path.join(tempfile.mkdtemp(), 'influx.lp')
+    writer = InfluxWriter('127.0.0.1', server.server_address[1], 'snmp_data',
+                          spool_path=spool, flush_interval=0.2, retry_backoff=0.01, max_retries=1)
+    sample = {key: str(i) for i, key in enumerate(OIDS)}
+
+    try:
+        start = time.perf_counter()
+        for i in range(args.devices):
+            writer.write_data(sample, device=f"sim-{i}")
+        writer.flush()
+        elapsed = time.perf_counter() - start
+        print(f"{server.points} punktów w {server.requests} żądaniach HTTP, {elapsed * 1000:.1f} ms "
+              f"({server.points / elapsed:.0f} punktów/s)")
+
+        server.down = True
+        for i in range(args.devices):
+            writer.write_data(sample, device=f"sim-{i}")
+        writer.flush()
+        print(f"Awaria bazy: w spoolu {writer.metrics()['points_spooled']} punktów "
+              f"({writer.spool_size()} B)")
+
+        server.down = False
+        writer.write_data(sample, device="sim-0")
+        writer.flush()
+        print(f"Po powrocie bazy: dosłano {writer.metrics()['points_replayed']} punktów, "
+              f"łącznie zapisano {server.points}")
+        print(f"Metryki writera: {writer.metrics()}")
+    finally:
+        server.shutdown()
+
+
+def write_synthetic_iftable(path, rows):
+    """Generuje nagranie snmprec z tabelą ifTable/ifXTable o zadanej liczbie wierszy"""
+    from discovery import NAME_COLUMNS, COUNTER_COLUMNS
+    lines = ["1.3.6.1.2.1.1.3.0|67|123456", "1.3.6.1.2.1.31.1.5.0|67|100"]
+    types = {"Descr": 4, "Name": 4, "Status": 2, "In": 65, "Out": 65, "ErrIn": 65, "ErrOut": 65,
+             "HCIn": 70, "HCOut": 70}
+    for column, oid in dict(NAME_COLUMNS, **COUNTER_COLUMNS).items():
+        for i in range(1, rows + 1):
+            value = f"GigabitEthernet1/0/{i}" if types[column] == 4 else (1 if column == "Status" else i * 1000)
+            lines.append(f"{oid}.{i}|{types[column]}|{value}")
+    lines.sort(key=lambda line: [int(x) for x in line.split('|')[0].split('.')])
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def bench_discovery(args):
+    """Odkrywanie interfejsów (GETBULK) i odczyt kolumn liczników na nagraniach snmprec"""
+    import asyncio
+    import shutil
+    import tempfile
+    from poller import AsyncPoller
+    from discovery import COUNTER_COLUMNS
+
+    data_dir = tempfile.mkdtemp()
+    recorded = os.path.join(base_dir, '..', 'snmpsim', 'data', 'recorded')
+    for name in ('linux-full-walk', 'winxp-full-walk'):
+        shutil.copy(os.path.join(recorded, f"{name}.snmprec"), data_dir)
+    for rows in (48, 500):
+        write_synthetic_iftable(os.path.join(data_dir, f"synthetic-{rows}.snmprec"), rows)
+
+    agent = start_local_agent(args.port, 1, data_dir)
+    try:
+        for context in ('linux-full-walk', 'winxp-full-walk', 'synthetic-48', 'synthetic-500'):
+            device = dict(DEVICES[0], name=context, host='127.0.0.1', port=args.port,
+                          context_name=context, discovery=True, timeout=5.0)
+
+            for repetitions in (10, 25, 50):
+                poller = AsyncPoller([device], max_repetitions=repetitions)
+
+                async def run():
+                    discovery, counters = [], []
+                    for _ in range(args.rounds):
+                        start = time.perf_counter()
+                        entry = await poller.discovery.discover(device)
+                        discovery.append(time.perf_counter() - start)
+                    for _ in range(args.rounds):
+                        start = time.perf_counter()
+                        await poller.discovery.poll(device, {})
+                        counters.append(time.perf_counter() - start)
+                    return entry, discovery, counters
+
+                entry, discovery, counters = asyncio.run(run())
+                print(f"{context}: {len(entry['interfaces'])} interfejsów, max-repetitions={repetitions}")
+                report('  odkrywanie (GETBULK)', discovery)
+                report('  liczniki (GETBULK)', counters)
+
+            # Dla porównania: GET z jawnymi OID instancji wszystkich liczników
+            instance_oids = {f"if{index}_{column}": f"{oid}.{index}"
+                             for index in entry['interfaces'] for column, oid in COUNTER_COLUMNS.items()}
+            poller = AsyncPoller([dict(device, discovery=False)])
+
+            async def run_get():
+                samples = []
+                for _ in range(args.rounds):
+                    start = time.perf_counter()
+                    await poller.poll_device(device, instance_oids)
+                    samples.append(time.perf_counter() - start)
+                return samples
+
+            report(f'  liczniki (GET, {len(instance_oids)} OID)', asyncio.run(run_get()))
+    finally:
+        agent.terminate()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def bench_usm(args):
+    """Pierwszy cykl odpytania N urządzeń bez pamięci USM i z pamięcią wczytaną z dysku (restart)"""
+    import asyncio
+    import shutil
+    import tempfile
+    from poller import AsyncPoller
+    from usm_cache import UsmKeyCache
+
+    cache_dir = tempfile.mkdtemp()
+    agent = start_local_agent(args.port, args.devices)
+    try:
+        for label, path in (('bez pamięci', None), ('pierwsze uruchomienie', cache_dir),
+                            ('po restarcie', cache_dir)):
+            cache = UsmKeyCache(path=os.path.join(path, 'usm.json') if path else None, persist=bool(path),
+                                persist_engines=bool(path))
+            poller = AsyncPoller(local_devices(args.port, args.devices), usm_cache=cache,
+                                 concurrency=args.concurrency, timeout=2.0, retries=1)
+
+            async def run():
+                poller._ensure_engine()
+                sent = [0]
+                send_pdu = poller.engine.msgAndPduDsp.sendPdu
+
+                def counting_send_pdu(*a, **kw):
+                    sent[0] += 1
+                    return send_pdu(*a, **kw)
+                poller.engine.msgAndPduDsp.sendPdu = counting_send_pdu
+
+                start = time.perf_counter()
+                results = await poller.poll_once()
+                return time.perf_counter() - start, sent[0], results
+
+            elapsed, sent, results = asyncio.run(run())
+            ok = sum(1 for data in results.values() if data.get('sysName') == 'RTR-Main-01')
+            cache.save()
+            print(f"{label:22} pierwszy cykl {elapsed * 1000:8.1f} ms  wysłanych PDU {sent:5d}  "
+                  f"poprawnych {ok}/{args.devices}")
+            print(f"{'':22} {cache.metrics()}")
+    finally:
+        agent.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def synthetic_report_devices(count, points):
+    """Urządzenia z odczytem i historią w formacie history.to_rows()"""
+    from datetime import datetime, timezone
+    end = int(time.time())
+    devices = []
+    for n in range(count):
+        history = [{
+            'timestamp': datetime.fromtimestamp(end - (points - i) * 60, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'data': {'cpuUsage': (i * 7 + n) % 100, 'ramUsage': 2e8 + ((i + n) % 30) * 1e6},
+        } for i in range(points)]
+        data = {'sysName': f'SW-{n:03d}', 'sysDescr': 'Cisco IOS Software', 'cpuUsage': str(n % 100),
+                'ramUsage': '268435456', 'if1_Name': 'Gi0/1', 'if1_Status': '1', 'if2_Name': 'Gi0/2', 'if2_Status': '2'}
+        devices.append({'name': f'sim-{n}', 'data': data, 'history': history})
+    return devices
+
+
+def legacy_chart(data, metric, title, ylabel, color):
+    """Dawna ścieżka: globalny stan pyplot i plik PNG w katalogu tymczasowym"""
+    import tempfile
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from report import chart_series
+
+    x_axis, y_axis = chart_series(data, metric)
+    plt.figure(figsize=(10, 4))
+    plt.plot(x_axis, y_axis, label=title, color=color, linewidth=2, marker='o', markersize=4)
+    plt.title(title)
+    plt.xlabel('Czas')
+    plt.ylabel(ylabel)
+    plt.grid(True, linestyle='--', alpha=0.5)
+    plt.legend()
+    if metric == 'cpu':
+        plt.ylim(0, 100)
+    plt.xticks(ticks=range(0, len(x_axis), max(1, len(x_axis) // 8)), rotation=45)
+    plt.tight_layout()
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix='.png')
+    os.close(tmp_fd)
+    plt.savefig(tmp_path, format='png', dpi=100)
+    plt.close()
+    return tmp_path
+
+
+def legacy_device_report(device):
+    from report import NetworkReport, write_device_report, pdf_bytes
+    pdf = NetworkReport()
+    pdf.add_page()
+    write_device_report(pdf, device['data'], device['history'], charts=[None, None])
+    pdf.add_page()
+    for metric, title, ylabel, color in (('cpu', 'Obciazenie CPU', '%', 'red'), ('ram', 'Zuzycie RAM', 'MB', 'blue')):
+        path = legacy_chart(device['history'], metric, title, ylabel, color)
+        pdf.image(path, x=10, w=190)
+        os.remove(path)
+    return pdf_bytes(pdf)
+
+
+def bench_report(args):
+    """Raport PDF dla N urządzeń: dawne wykresy (pyplot + PNG) vs Figure w pamięci, pula procesów i pamięć raportów"""
+    from concurrent.futures import ThreadPoolExecutor
+    from report import create_multi_report, get_pool, ReportCache, render_charts
+    from config import REPORT_CONFIG
+
+    devices = synthetic_report_devices(args.devices, REPORT_CONFIG['points'])
+
+    # Dawna ścieżka jest wolna - mierzymy próbkę urządzeń i ekstrapolujemy
+    sample = devices[:min(len(devices), 5)]
+    legacy_device_report(sample[0])
+    start = time.perf_counter()
+    for device in sample:
+        legacy_device_report(device)
+    legacy = (time.perf_counter() - start) / len(sample)
+    print(f"{'dawne wykresy (pyplot+PNG)':<28} {legacy * 1000:8.1f} ms/urządzenie, "
+          f"~{legacy * len(devices):.1f} s dla {len(devices)} urządzeń")
+
+    render_charts(devices[0]['history'])
+    with ThreadPoolExecutor(max_workers=1) as in_process:
+        start = time.perf_counter()
+        body = create_multi_report(devices, pool=in_process)
+        elapsed = time.perf_counter() - start
+    print(f"{'Figure w pamięci, 1 proces':<28} {elapsed * 1000 / len(devices):8.1f} ms/urządzenie, "
+          f"{elapsed:.1f} s dla {len(devices)} urządzeń ({len(body) / 1e6:.1f} MB)")
+
+    workers = REPORT_CONFIG['workers']
+    pool = get_pool()
+    list(pool.map(render_charts, [devices[0]['history']] * workers))
+    start = time.perf_counter()
+    create_multi_report(devices, pool=pool)
+    elapsed = time.perf_counter() - start
+    print(f"{f'pula {workers} procesów':<28} {elapsed * 1000 / len(devices):8.1f} ms/urządzenie, "
+          f"{elapsed:.1f} s dla {len(devices)} urządzeń")
+
+    cache = ReportCache()
+    key = cache.key('*', 1)
+    cache.put(key, body)
+    start = time.perf_counter()
+    cache.get(key)
+    print(f"{'ponowne pobranie (pamięć)':<28} {(time.perf_counter() - start) * 1000:8.3f} ms")
+
+
+def encode_link_trap(if_index, down=True, request_id=1, community='public'):
+    """Zakodowany trap v2c linkDown/linkUp, jak wysyła go agent"""
+    from pyasn1.codec.ber import encoder
+    from pysnmp.proto import api
+    from traps import SNMP_TRAP_OID, LINK_DOWN, LINK_UP, IF_INDEX, IF_OPER_STATUS
+
+    p_mod = api.protoModules[api.protoVersion2c]
+    pdu = p_mod.SNMPv2TrapPDU()
+    p_mod.apiTrapPDU.setDefaults(pdu)
+    p_mod.apiPDU.setRequestID(pdu, request_id)
+    p_mod.apiPDU.setVarBinds(pdu, [
+        ((1, 3, 6, 1, 2, 1, 1, 3, 0), p_mod.TimeTicks(12345)),
+        (SNMP_TRAP_OID, p_mod.ObjectIdentifier(LINK_DOWN if down else LINK_UP)),
+        (IF_INDEX + (if_index,), p_mod.Integer(if_index)),
+        (IF_OPER_STATUS + (if_index,), p_mod.Integer(2 if down else 1)),
+    ])
+    msg = p_mod.Message()
+    p_mod.apiMessage.setDefaults(msg)
+    p_mod.apiMessage.setCommunity(msg, community)
+    p_mod.apiMessage.setPDU(msg, pdu)
+    return encoder.encode(msg)
+
+
+def bench_traps(args):
+    """Przepustowość odbiornika powiadomień: strumień trapów v2c z lokalnego nadawcy i informy v3"""
+    import socket
+    from traps import TrapReceiver
+    from pysnmp.hlapi import (sendNotification, SnmpEngine, UdpTransportTarget, ContextData,
+                              NotificationType, ObjectIdentity, Integer, usmHMACMD5AuthProtocol, usmDESPrivProtocol)
+    from usm_cache import get_usm_cache
+
+    latencies = []
+    receiver = TrapReceiver(DEVICES, on_event=lambda e: latencies.append(time.time() - e["received_at"]),
+                            host='127.0.0.1', port=args.port)
+    receiver.start()
+    try:
+        datagrams = [encode_link_trap(1 + i % 2, down=i % 2 == 0, request_id=i) for i in range(1000)]
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        total = args.rate * args.duration
+        start = time.perf_counter()
+        for i in range(total):
+            # Stałe tempo wysyłki: paczka co 10 ms
+            if i % max(1, args.rate // 100) == 0:
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sender.sendto(datagrams[i % len(datagrams)], ('127.0.0.1', args.port))
+        sent_in = time.perf_counter() - start
+
+        deadline = time.time() + 10
+        while receiver.metrics()["events"] + receiver.metrics()["dropped"] < receiver.metrics()["received"] \
+                and time.time() < deadline:
+            time.sleep(0.05)
+        processed_in = time.perf_counter() - start
+        stats = receiver.metrics()
+        print(f"wysłano {total} trapów v2c w {sent_in:.2f} s ({total / sent_in:.0f}/s)")
+        print(f"odebrano {stats['received']}, przetworzono {stats['events']} "
+              f"({stats['events'] / processed_in:.0f}/s), odrzucono {stats['dropped']}")
+        if latencies:
+            report('opóźnienie trap -> zdarzenie', latencies)
+
+        # Informy v3 - potwierdzenie wymaga poprawnego USM po stronie odbiornika
+        device = DEVICES[0]
+        cache = get_usm_cache()
+        engine = SnmpEngine()
+        user = cache.user_data(device['username'], device['auth_key'], device['priv_key'],
+                               usmHMACMD5AuthProtocol, usmDESPrivProtocol)
+        acked, samples = 0, []
+        for i in range(min(args.rounds, 20)):
+            start = time.perf_counter()
+            error_indication, error_status, _, _ = next(sendNotification(
+                engine, user, UdpTransportTarget(('127.0.0.1', args.port), timeout=1.0, retries=1),
+                ContextData(), 'inform',
+                NotificationType(ObjectIdentity('1.3.6.1.6.3.1.1.5.3')).addVarBinds(
+                    ('1.3.6.1.2.1.2.2.1.1.1', Integer(1)), ('1.3.6.1.2.1.2.2.1.8.1', Integer(2))),
+                lookupMib=False
+            ))
+            samples.append(time.perf_counter() - start)
+            if not error_indication and not error_status:
+                acked += 1
+        report(f'inform v3 ({acked}/{len(samples)} potw.)', samples)
+    finally:
+        receiver.stop()
+
+
+def bench_alerts(args):
+    """Koszt oceny reguł alarmowych w funkcji wielkości inwentarza (50 interfejsów na urządzenie)"""
+    import random
+    import logging
+    from alerts import AlertEngine
+
+    logging.getLogger("SNMP-Alerts").setLevel(logging.ERROR)
+    interfaces = 50
+    for devices in sorted({10, 100, args.devices, 200}):
+        engine = AlertEngine()
+        fleet = []
+        for d in range(devices):
+            data = {'cpuUsage': '50', 'sysUpTime': '1000'}
+            for i in range(1, interfaces + 1):
+                data.update({f'if{i}_Status': '1', f'if{i}_In': '0', f'if{i}_Out': '0',
+                             f'if{i}_ErrIn': '0', f'if{i}_ErrOut': '0', f'if{i}_InBps': '0'})
+            fleet.append((f'dev{d}', data))
+
+        now = time.time()
+        update_times, eval_times = [], []
+        for cycle in range(args.rounds):
+            now += 10
+            for name, data in fleet:
+                # Kilka procent interfejsów zmienia stan w każdym cyklu
+                for i in random.sample(range(1, interfaces + 1), 2):
+                    data[f'if{i}_Status'] = '2' if data[f'if{i}_Status'] == '1' else '1'
+                data['cpuUsage'] = str(random.randint(0, 100))
+            start = time.perf_counter()
+            for name, data in fleet:
+                engine.update(name, data, now)
+            update_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            engine.evaluate(now)
+            eval_times.append(time.perf_counter() - start)
+
+        metrics = engine.metrics()
+        label = f'{devices} urz. / {devices * interfaces} interf.'
+        print(f"{label:<28} serii {metrics['series']}, aktywnych alertów {metrics['active']}")
+        report('  update() całego cyklu', update_times)
+        report('  evaluate()', eval_times)
+
+
+def bench_anomaly(args):
+    """Wzorce EWMA: koszt cyklu na serię w funkcji wielkości floty i wykrywalność wstrzykniętych skoków"""
+    import random
+    import logging
+    from anomaly import AnomalyDetector
+
+    logging.getLogger("SNMP-Anomaly").setLevel(logging.ERROR)
+    interfaces = 8
+    warmup, cycles = 30, max(args.rounds, 60)
+    for devices in sorted({10, 100, args.devices, 1000}):
+        rng = random.Random(args.seed)
+        lines = []
+        detector = AnomalyDetector(export=lines.extend, warmup=warmup, interval=10)
+        fleet = []
+        for d in range(devices):
+            base = {'cpuUsage': rng.uniform(5, 80), 'ramUsage': rng.uniform(20, 80)}
+            for i in range(1, interfaces + 1):
+                base[f'if{i}_InBps'] = rng.lognormvariate(13, 2)
+                base[f'if{i}_OutBps'] = rng.lognormvariate(13, 2)
+            fleet.append((f'dev{d}', base, {f'if{i}_Err{direction}': 0 for i in range(1, interfaces + 1)
+                                            for direction in ('In', 'Out')}))
+
+        now = time.time()
+        update_times, eval_times = [], []
+        injected, detected, false_starts = set(), set(), 0
+        for cycle in range(cycles):
+            now += 10
+            spike = cycle >= warmup + 10 and cycle % 10 == 0
+            for name, base, errors in fleet:
+                data = {key: f"{max(0.0, rng.gauss(value, value * 0.05)):.2f}" for key, value in base.items()}
+                for key in errors:
+                    errors[key] += rng.random() < 0.1
+                data.update({key: str(value) for key, value in errors.items()})
+                if spike and rng.random() < 0.01:
+                    # Skok obciążenia CPU o 30 punktów na jeden cykl
+                    data['cpuUsage'] = f"{min(100.0, base['cpuUsage'] + 30):.2f}"
+                    injected.add((name, cycle))
+                base['_data'] = data
+            start = time.perf_counter()
+            for name, base, _ in fleet:
+                detector.update(name, base.pop('_data'), now)
+            update_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            events = detector.evaluate(now)
+            eval_times.append(time.perf_counter() - start)
+            for event in events:
+                if event['state'] != 'started':
+                    continue
+                if (event['device'], cycle) in injected and event['metric'] == 'cpuUsage':
+                    detected.add((event['device'], cycle))
+                else:
+                    false_starts += 1
+
+        series = len(detector.rows)
+        print(f"{devices} urz. / {series} serii: wykryto {len(detected)}/{len(injected)} skoków CPU, "
+              f"fałszywych anomalii {false_starts} na {series * (cycles - warmup)} ocen, "
+              f"{statistics.median(eval_times) * 1e6 / series:.2f} µs/serię")
+        report('  update() całego cyklu', update_times)
+        report('  evaluate()', eval_times)
+
+
+def bench_compression(args):
+    """Kompresja zapisu: liczba punktów i bajtów line protocol przed i po, błąd odtworzenia historii"""
+    import random
+    from compression import WriteCompressor, fill_gaps, fill_mode, lookback
+    from export import build_lines
+
+    rng = random.Random(args.seed)
+    interfaces, interval, hours = 8, 10, 6
+    cycles = hours * 3600 // interval
+    start = 1700000000
+    # Jedno urządzenie traci łączność na 30 minut - przerwa musi zostać widoczna w historii
+    outage = range(cycles // 2, cycles // 2 + 1800 // interval)
+    compressor = WriteCompressor()
+    fleet = []
+    for d in range(args.devices):
+        ram_total = rng.choice([4, 8, 16, 32]) * 1048576
+        fleet.append({
+            'name': f'dev{d}', 'uptime': rng.randrange(10 ** 8), 'ramTotal': ram_total,
+            'ramFree': ram_total * rng.uniform(0.2, 0.8), 'cpu': rng.uniform(5, 60),
+            'status': [1] * interfaces, 'errors': [[0, 0] for _ in range(interfaces)],
+            'counters': [[rng.randrange(2 ** 40), rng.randrange(2 ** 40)] for _ in range(interfaces)],
+            'rates': [rng.lognormvariate(13, 2) for _ in range(interfaces)],
+        })
+
+    raw_points = raw_bytes = out_points = out_bytes = 0
+    sampled = {}          # {(urządzenie, pole): [(czas, wartość surowa)]} dla kilku urządzeń
+    written = {}          # {(urządzenie, pole): {czas: wartość zapisana}}
+    filter_times = []
+    for cycle in range(cycles):
+        now = start + cycle * interval
+        batch = []
+        for device in fleet:
+            if device['name'] == 'dev0' and cycle in outage:
+                continue
+            device['uptime'] += interval * 100
+            device['ramFree'] = min(device['ramTotal'], max(0.0, device['ramFree'] * rng.gauss(1, 0.002)))
+            device['cpu'] = min(100.0, max(0.0, device['cpu'] + 0.2 * (30 - device['cpu']) * 0.05 + rng.gauss(0, 1.5)))
+            data = {
+                'sysUpTime': str(device['uptime']), 'ramTotal': str(device['ramTotal']),
+                'ramFree': str(int(device['ramFree'])),
+                'ramUsage': f"{100 * (1 - device['ramFree'] / device['ramTotal']):.2f}",
+                'cpuUsage': f"{device['cpu']:.2f}",
+            }
+            for i in range(interfaces):
+                if rng.random() < 0.0005:
+                    device['status'][i] = 3 - device['status'][i]
+                for direction in range(2):
+                    device['errors'][i][direction] += rng.random() < 0.01
+                    rate = max(0.0, rng.gauss(device['rates'][i], device['rates'][i] * 0.2)) if device['status'][i] == 1 else 0
+                    device['counters'][i][direction] += int(rate * interval / 8)
+                n = i + 1
+                data.update({
+                    f'if{n}_Status': str(device['status'][i]),
+                    f'if{n}_In': str(device['counters'][i][0]), f'if{n}_Out': str(device['counters'][i][1]),
+                    f'if{n}_ErrIn': str(device['errors'][i][0]), f'if{n}_ErrOut': str(device['errors'][i][1]),
+                })
+            batch.append((device['name'], data))
+
+        started = time.perf_counter()
+        results = [(name, compressor.filter(name, data, now)) for name, data in batch]
+        filter_times.append(time.perf_counter() - started)
+
+        for (name, data), (_, result) in zip(batch, results):
+            lines = build_lines(data, name, now)
+            raw_points += len(lines)
+            raw_bytes += sum(len(line) + 1 for line in lines)
+            for timestamp, fields in result.items():
+                lines = build_lines(fields, name, timestamp)
+                out_points += len(lines)
+                out_bytes += sum(len(line) + 1 for line in lines)
+            if name in ('dev0', 'dev1', 'dev2'):
+                for key, value in data.items():
+                    sampled.setdefault((name, key), []).append((now, float(value)))
+                for timestamp, fields in result.items():
+                    for key, value in fields.items():
+                        written.setdefault((name, key), {})[timestamp] = float(value)
+
+    # Odtworzenie historii z zapisanych punktów w rozdzielczości odczytów
+    end = start + cycles * interval
+    hold = lookback([key for _, key in sampled], interval)
+    errors, gaps = {}, 0
+    for (name, key), samples in sampled.items():
+        mode = fill_mode(key)
+        if mode is None:
+            continue
+        points = sorted(written.get((name, key), {}).items())
+        times, values = fill_gaps([t for t, _ in points], {key: [v for _, v in points]}, start, end, interval, hold)
+        rebuilt = dict(zip(times, values[key]))
+        rule = compressor.rule(key)
+        entry = errors.setdefault(rule['metric'], [0.0, 0])
+        for t, value in samples:
+            if t > points[-1][0]:
+                # Za ostatnim zapisanym punktem swingdoor nie zna jeszcze kierunku odcinka
+                continue
+            if rebuilt.get(t) is None:
+                entry[1] += 1
+                continue
+            error = abs(rebuilt[t] - value)
+            if rule['percent']:
+                error = 100 * error / max(abs(value), 1e-9)
+            entry[0] = max(entry[0], error)
+        if name == 'dev0':
+            silent = [t for t in times if (t - start) // interval in outage and t - start >= (outage[0] + hold // interval) * interval]
+            gaps += len(silent)
+
+    stats = compressor.metrics()
+    fields = raw_points // max(1, cycles * len(fleet))
+    print(f"{len(fleet)} urz. x {fields} pól, {hours} h co {interval} s (heartbeat {compressor.options['heartbeat']:.0f} s)")
+    print(f"  punkty:  {raw_points:>10} -> {out_points:>10}  ({100 * (1 - out_points / raw_points):.1f}% mniej)")
+    print(f"  bajty:   {raw_bytes:>10} -> {out_bytes:>10}  ({100 * (1 - out_bytes / raw_bytes):.1f}% mniej)")
+    print(f"  pola z regułą: {stats['points_in']} -> {stats['points_out']} (ratio {stats['ratio']}, "
+          f"heartbeatów {stats['heartbeats']})")
+    for rule in compressor.rules:
+        error, missing = errors.get(rule['metric'], (0.0, 0))
+        tolerance = f"{rule['percent']:g}%" if rule['percent'] else f"{rule['absolute']:g}"
+        unit = '%' if rule['percent'] else ''
+        print(f"  {rule['metric']:<12} {rule['mode']:<10} tolerancja {tolerance:<6} maks. błąd odtworzenia "
+              f"{error:.4g}{unit}, brakujących odczytów {missing}")
+    print(f"  przerwa dev0 (30 min): {'widoczna' if not gaps else f'zasłonięta w {gaps} przedziałach'}")
+    report('  filter() całego cyklu', filter_times)
+
+
+def ber_corpus():
+    """ScopedPDU wszystkich obsługiwanych kształtów: typy PDU, typy wartości, wartości graniczne"""
+    from pysnmp.proto import rfc1902, rfc1905
+    from pysnmp.proto.api import v2c
+    from pysnmp.proto.mpmod.rfc3412 import ScopedPDU
+
+    values = [
+        rfc1902.Integer32(0), rfc1902.Integer32(-1), rfc1902.Integer32(127), rfc1902.Integer32(128),
+        rfc1902.Integer32(-128), rfc1902.Integer32(-129), rfc1902.Integer32(-2 ** 31), rfc1902.Integer32(2 ** 31 - 1),
+        rfc1902.Counter32(0), rfc1902.Counter32(2 ** 32 - 1), rfc1902.Gauge32(1000),
+        rfc1902.Unsigned32(2 ** 31), rfc1902.TimeTicks(123456), rfc1902.Counter64(2 ** 64 - 1),
+        rfc1902.OctetString(''), rfc1902.OctetString('GigabitEthernet0/1'),
+        rfc1902.OctetString(b'\x00\xff' * 200), rfc1902.IpAddress('10.0.0.1'), rfc1902.Opaque(b'\x9f\x78\x04'),
+        rfc1902.ObjectIdentifier((1, 3, 6, 1, 4, 1, 9, 1, 1208)), rfc1902.ObjectIdentifier((2, 999, 2 ** 40)),
+        rfc1902.Null(''), rfc1905.noSuchObject, rfc1905.noSuchInstance, rfc1905.endOfMibView,
+    ]
+    var_binds = [((1, 3, 6, 1, 2, 1, 2, 2, 1, 10, i), value) for i, value in enumerate(values)]
+    requests = [((1, 3, 6, 1, 2, 1, 1, i, 0), rfc1902.Null('')) for i in range(1, 8)]
+    pdus = [
+        (v2c.GetRequestPDU(), requests),
+        (v2c.GetNextRequestPDU(), requests),
+        (v2c.GetBulkRequestPDU(), requests),
+        (v2c.SetRequestPDU(), var_binds[:5]),
+        (v2c.ResponsePDU(), var_binds),
+        (v2c.ResponsePDU(), var_binds * 8),          # długie pola - wielobajtowe długości BER
+        (v2c.ResponsePDU(), []),
+        (v2c.ReportPDU(), [((1, 3, 6, 1, 6, 3, 15, 1, 1, 4, 0), rfc1902.Counter32(7))]),
+        (v2c.InformRequestPDU(), var_binds[:3]),
+        (v2c.TrapPDU(), var_binds[:3]),
+    ]
+    corpus = []
+    for request_id, (pdu, binds) in enumerate(pdus):
+        v2c.apiPDU.setDefaults(pdu)
+        v2c.apiPDU.setRequestID(pdu, request_id * 100003 - 7)
+        if isinstance(pdu, v2c.GetBulkRequestPDU):
+            v2c.apiBulkPDU.setNonRepeaters(pdu, 1)
+            v2c.apiBulkPDU.setMaxRepetitions(pdu, 25)
+        elif binds:
+            v2c.apiPDU.setErrorStatus(pdu, request_id % 3)
+            v2c.apiPDU.setErrorIndex(pdu, request_id % 2)
+        v2c.apiPDU.setVarBinds(pdu, binds)
+        scoped_pdu = ScopedPDU()
+        scoped_pdu.setComponentByPosition(0, b'\x80\x00\x4f\xb8\x05\x7f\x00\x00\x01')
+        scoped_pdu.setComponentByPosition(1, 'router' if request_id % 2 else '')
+        scoped_pdu.setComponentByPosition(2)
+        scoped_pdu.getComponentByPosition(2).setComponentByType(pdu.tagSet, pdu)
+        corpus.append(scoped_pdu)
+    return corpus
+
+
+def bench_ber(args):
+    """Zgodność szybkiego kodera BER z pyasn1 (bajt w bajt) i porównanie czasów"""
+    from pyasn1.codec.ber import decoder, encoder
+    from pyasn1.error import PyAsn1Error
+    from pysnmp.proto.mpmod.rfc3412 import ScopedPDU
+    import ber_codec
+
+    errors = []
+    corpus = ber_corpus()
+    for number, scoped_pdu in enumerate(corpus):
+        substrate = encoder.encode(scoped_pdu)
+        if ber_codec.encoder.encode(scoped_pdu) != substrate:
+            errors.append(f"#{number}: kodowanie różni się od pyasn1")
+        expected, _ = decoder.decode(substrate, asn1Spec=ScopedPDU())
+        decoded, rest = ber_codec.decoder.decode(substrate + b'\x00' * 4, asn1Spec=ScopedPDU())
+        if rest != b'\x00' * 4:
+            errors.append(f"#{number}: błędna reszta po PDU")
+        if encoder.encode(decoded) != substrate or ber_codec.encoder.encode(decoded) != substrate:
+            errors.append(f"#{number}: zdekodowane PDU nie koduje się do tych samych bajtów")
+        if decoded.prettyPrint() != expected.prettyPrint():
+            errors.append(f"#{number}: drzewo różni się od dekodera pyasn1")
+    if ber_codec.stats["fallback"]:
+        errors.append(f"{ber_codec.stats['fallback']} wiadomości korpusu poszło przez pyasn1")
+
+    # Uszkodzone wiadomości: szybka ścieżka oddaje je pyasn1, który zgłasza błąd
+    substrate = encoder.encode(corpus[4])
+    for number, broken in enumerate([substrate[:-3], substrate[:40], b'\x30\x80' + substrate[2:], b'\x04\x00']):
+        try:
+            ber_codec.decoder.decode(broken, asn1Spec=ScopedPDU())
+            errors.append(f"uszkodzona wiadomość #{number} zdekodowana bez błędu")
+        except PyAsn1Error:
+            pass
+
+    print(f"Korpus: {len(corpus)} ScopedPDU, statystyki kodera: {ber_codec.metrics()}")
+    scoped_pdu = corpus[4]
+    substrate = encoder.encode(scoped_pdu)
+    rounds = max(args.rounds, 200)
+    timings = {}
+    for name, call in [
+        ('decode pyasn1', lambda: decoder.decode(substrate, asn1Spec=ScopedPDU())),
+        ('decode szybki', lambda: ber_codec.decoder.decode(substrate, asn1Spec=ScopedPDU())),
+        ('encode pyasn1', lambda: encoder.encode(scoped_pdu)),
+        ('encode szybki', lambda: ber_codec.encoder.encode(scoped_pdu)),
+    ]:
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - start)
+        timings[name] = statistics.median(samples)
+        report(f"{name} ({len(substrate)} B)", samples)
+    print(f"Przyspieszenie: decode x{timings['decode pyasn1'] / timings['decode szybki']:.1f}, "
+          f"encode x{timings['encode pyasn1'] / timings['encode szybki']:.1f}")
+
+    if errors:
+        print("NIEZGODNOŚĆ: " + "; ".join(errors))
+        sys.exit(1)
+    print("OK - wyniki zgodne z pyasn1")
+
+
+def bench_shards(args):
+    """Skalowanie przepustowości pollera z liczbą procesów (ShardedPoller) na lokalnych agentach"""
+    from sharded_poller import ShardedPoller
+
+    max_workers = args.workers or os.cpu_count() or 1
+    # Osobny proces agenta na każdy shard, żeby symulator nie był wąskim gardłem
+    per_agent = -(-args.devices // max_workers)
+    agents = [start_local_agent(args.port + i * per_agent, min(per_agent, args.devices - i * per_agent))
+              for i in range(max_workers) if i * per_agent < args.devices]
+    devices = local_devices(args.port, args.devices)
+    print(f"{args.devices} urządzeń, {len(agents)} procesów agenta, {os.cpu_count()} CPU, "
+          f"pomiar {args.duration} s na konfigurację")
+    try:
+        baseline = None
+        for workers in range(1, max_workers + 1):
+            results = []
+            lock = threading.Lock()
+
+            def on_result(name, data, state):
+                with lock:
+                    results.append(state.get('sysName') == 'RTR-Main-01')
+
+            # interval=0 - każdy shard odpytuje swoje urządzenia bez przerw (pełne obciążenie)
+            poller = ShardedPoller(devices, on_result=on_result, workers=workers,
+                                   interval=0, jitter=0, timeout=2.0, retries=1)
+            poller.start()
+            try:
+                time.sleep(2)  # rozgrzewka: silniki, wykrywanie engineID
+                with lock:
+                    results.clear()
+                time.sleep(args.duration)
+                with lock:
+                    count, ok = len(results), sum(results)
+                snapshot = poller.stats.snapshot()
+            finally:
+                poller.stop()
+            rate = count / args.duration
+            baseline = baseline or rate
+            print(f"{workers} proc.: {rate:8.1f} odpytań/s  x{rate / baseline:.2f}  "
+                  f"poprawnych {ok}/{count}, shardy {snapshot['shards']}")
+    finally:
+        for agent in agents:
+            agent.terminate()
+
+
+def bench_scheduler(args):
+    """Harmonogram odpytań na wirtualnym zegarze: narzut kopca i efekt wyłącznika dla martwych urządzeń"""
+    import heapq
+    import logging
+    from scheduler import PollScheduler
+    from config import POLLER_CONFIG
+
+    logging.getLogger("SNMP-Scheduler").setLevel(logging.ERROR)
+    devices = args.devices
+    dead = {f"dev-{i}" for i in range(0, devices, 10)}                    # co dziesiąte nie odpowiada
+    timeout_cost = POLLER_CONFIG['timeout'] * (POLLER_CONFIG['retries'] + 1)
+    horizon = 3600.0
+    print(f"{devices} urządzeń ({len(dead)} niedostępnych), grupy: default co 10 s, inventory co 3600 s, "
+          f"symulacja {horizon:.0f} s")
+
+    for label, threshold in (('bez wyłącznika', 10 ** 9), ('z wyłącznikiem', POLLER_CONFIG['failure_threshold'])):
+        scheduler = PollScheduler(interval=10, jitter=0.1, failure_threshold=threshold)
+        now = 0.0
+        for i in range(devices):
+            scheduler.add(f"dev-{i}", 'default', 10, now)
+            scheduler.add(f"dev-{i}", 'inventory', 3600, now, first_within=10)
+
+        completions, counter = [], 0
+        dead_attempts, dead_seconds = 0, 0.0
+        started = time.perf_counter()
+        while now < horizon:
+            for job in scheduler.due(now):
+                if job.device in dead:
+                    dead_attempts += 1
+                    dead_seconds += timeout_cost
+                    finish, status = now + timeout_cost, 'timeout'
+                else:
+                    finish, status = now + 0.02, 'ok'
+                counter += 1
+                heapq.heappush(completions, (finish, counter, job, status))
+            delay = scheduler.next_delay(now)
+            next_due = now + delay if delay is not None else horizon
+            if completions and completions[0][0] <= next_due:
+                now, _, job, status = heapq.heappop(completions)
+                scheduler.finished(job, status, now)
+            else:
+                now = next_due
+        elapsed = time.perf_counter() - started
+
+        metrics = scheduler.metrics()
+        print(f"{label:<16} zadań {metrics['dispatched']:7d}  prób martwych {dead_attempts:6d}  "
+              f"czas timeoutów {dead_seconds:8.0f} s  otwartych wyłączników {metrics['open_circuits']}  "
+              f"narzut {elapsed / max(1, metrics['dispatched']) * 1e6:5.1f} µs/zadanie")
+
+
+def bench_startup(args):
+    """Czas importu aplikacji i tworzenia SnmpEngine; kończy się błędem po przekroczeniu progów"""
+    import shutil
+    import tempfile
+    from pysnmp.hlapi import SnmpEngine
+    from mib_snapshot import MibSnapshot, create_engine, get_mib_snapshot
+
+    def import_time(code, **env):
+        samples = []
+        for _ in range(min(args.rounds, 5)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=base_dir, env=dict(os.environ, **env),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        MibSnapshot(path=os.path.join(cache_dir, 'mib_snapshot.bin')).build().save()
+        print(f"{'budowa migawki MIB':<28} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    get_mib_snapshot()
+    rounds = max(args.rounds, 10)
+    legacy = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        SnmpEngine()
+        legacy.append(time.perf_counter() - start)
+    report('SnmpEngine() (kompilacja)', legacy)
+    snapshot = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        create_engine()
+        snapshot.append(time.perf_counter() - start)
+    report('create_engine() (migawka)', snapshot)
+
+    # Dawny start: raportowe zależności importowane od razu, bez migawki MIB
+    eager = import_time('import matplotlib.figure, fpdf; import app', MIB_SNAPSHOT_ENABLED='false')
+    report('import app (dawniej)', eager)
+    startup = import_time('import app')
+    report('import app', startup)
+
+    engine_ms = statistics.median(snapshot) * 1000
+    startup_s = statistics.median(startup)
+    failed = []
+    if engine_ms > args.max_engine_ms:
+        failed.append(f"create_engine() {engine_ms:.1f} ms > {args.max_engine_ms} ms")
+    if startup_s > args.max_startup:
+        failed.append(f"import app {startup_s:.2f} s > {args.max_startup} s")
+    if failed:
+        print("REGRESJA: " + "; ".join(failed))
+        sys.exit(1)
+    print(f"OK (progi: create_engine() {args.max_engine_ms} ms, import app {args.max_startup} s)")
+
+
+def bench_recent(args):
+    """Historia z buforów w pamięci: koszt zapisu odczytu, zapytania o ostatnią godzinę i zajęta pamięć"""
+    import random
+    from recent_history import RecentHistoryStore
+    from history import query_history
+
+    interfaces = 8
+    store = RecentHistoryStore(window=3600, interval=10)
+    end = int(time.time()) // 60 * 60
+    store.started_at = end - 3600
+    fleet = []
+    for d in range(args.devices):
+        data = {'sysName': f'dev{d}', 'cpuUsage': '0', 'ramUsage': '0', 'sysUpTime': '0'}
+        for i in range(1, interfaces + 1):
+            data.update({f'if{i}_Status': '1', f'if{i}_In': '0', f'if{i}_Out': '0', f'if{i}_InBps': '0.00'})
+        fleet.append((f'dev{d}', data))
+
+    append_times = []
+    for cycle in range(360):
+        timestamp = store.started_at + cycle * 10
+        for name, data in fleet:
+            data['cpuUsage'] = str(random.randint(0, 100))
+            data['ramUsage'] = f"{random.uniform(20, 80):.2f}"
+        start = time.perf_counter()
+        for name, data in fleet:
+            store.append(name, data, timestamp)
+        append_times.append(time.perf_counter() - start)
+
+    metrics = store.metrics()
+    print(f"{args.devices} urządzeń, {metrics['series']} serii po {metrics['capacity']} próbek: "
+          f"{metrics['bytes_per_series']} B na serię, razem {metrics['memory_bytes'] / 2 ** 20:.1f} MiB")
+    report('append() cyklu odczytów', append_times)
+
+    # Cały zakres w pamięci - klient InfluxDB nie jest używany
+    for label, device, points in (('1 urządzenie, 1 h / 360 pkt', 'dev0', 360),
+                                  ('wszystkie, 1 h / 60 pkt', None, 60)):
+        times = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            history = query_history(None, None, start=end - 3600, end=end, points=points,
+                                    device=device, recent=store)
+            times.append(time.perf_counter() - start)
+        assert history['source'] == 'memory'
+        report(label, times)
+
+
+def bench_retention(args):
+    """Wybór poziomu rollup dla typowych zakresów historii: punkty czytane przez InfluxDB zamiast surowych"""
+    from retention import RetentionManager
+    from history import choose_interval
+
+    manager = RetentionManager(client=None, database='snmp_data')
+    manager.ready = True  # plan zapytań bez połączenia z bazą
+    series = args.devices * 2  # domyślne metryki historii: cpuUsage i ramUsage
+    now = int(time.time())
+    print("Poziomy: " + ", ".join(f"{t['name']} ({t['resolution']} s)" for t in manager.tiers)
+          + f"; {series} serii, 500 punktów na wykres")
+    for label, seconds in (('1 h', 3600), ('24 h', 86400), ('7 d', 7 * 86400),
+                           ('30 d', 30 * 86400), ('365 d', 365 * 86400)):
+        start = now - seconds
+        tier, interval = manager.choose_tier(start, now, choose_interval(start, now, 500), now=now)
+        parts = manager.sources(tier, 'mean', start, now, interval, now=now)
+        resolution = {t['policy']: t['resolution'] for t in manager.tiers}
+        scanned = sum((end - begin) / resolution[policy] for policy, _, begin, end in parts) * series
+        raw = seconds / manager.tiers[0]['resolution'] * series
+        print(f"{label:>6}: poziom {tier['name']:<4} przedział {interval:>6} s  zapytań {len(parts)}  "
+              f"punktów {scanned:>14,.0f} zamiast {raw:>14,.0f}  (x{raw / scanned:,.0f})")
+
+
+def write_inventory(path, entries):
+    import json
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "defaults": {"port": 161, "username": "monitor", "auth_password": "auth-secret", "priv_password": "priv-secret"},
+            "profiles": {"router": [k for k in OIDS if not k.startswith('if2_')], "switch": list(OIDS)},
+            "devices": entries,
+        }, f)
+
+
+def bench_inventory(args):
+    """Inwentarz z plików: wczytanie, przeładowanie bez zmian i ze zmianą 3% wpisów, różnica w pollerze"""
+    import asyncio
+    import logging
+    import tempfile
+    from inventory import Inventory
+    from poller import AsyncPoller
+
+    logging.getLogger("SNMP-Inventory").setLevel(logging.WARNING)
+    count = args.devices
+
+    def entry(i, prefix='dev'):
+        role = 'router' if i % 4 == 0 else 'switch'
+        return {"name": f"{prefix}-{i}", "host": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                "tags": [f"site-{i % 50}", role], "profile": role}
+
+    # Zmiana w pierwszym pliku: po 1% wszystkich wpisów z nowym hasłem, usuniętych i dodanych
+    first = range(max(1, count // 10))
+    changed = {i for i in first if i % 10 == 0}
+    removed = {i for i in first if i % 10 == 1}
+    modified = [dict(entry(i), auth_password="rotated") if i in changed else entry(i)
+                for i in first if i not in removed] + [entry(i, 'new') for i in range(len(changed))]
+
+    for files in (1, 10):
+        path = tempfile.mkdtemp()
+        chunks = [range(count * f // files, count * (f + 1) // files) for f in range(files)]
+        for f, chunk in enumerate(chunks):
+            write_inventory(os.path.join(path, f"inventory-{f}.json"), [entry(i) for i in chunk])
+        target = os.path.join(path, "inventory-0.json")
+        variant = modified + [entry(i) for i in chunks[0] if i >= len(first)]
+
+        load_times, noop_times, reload_times = [], [], []
+        for _ in range(max(2, args.rounds // 5)):
+            inventory = Inventory(path=path)
+            start = time.perf_counter()
+            inventory.load()
+            load_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            inventory.reload()
+            noop_times.append(time.perf_counter() - start)
+
+            write_inventory(target, variant)
+            # Ten sam rozmiar pliku w tej samej chwili - wymuszamy nowy czas modyfikacji
+            mtime = os.stat(target).st_mtime_ns + 10 ** 6
+            os.utime(target, ns=(mtime, mtime))
+            start = time.perf_counter()
+            added, updated, dropped = inventory.reload()
+            reload_times.append(time.perf_counter() - start)
+            write_inventory(target, [entry(i) for i in chunks[0]])
+
+        print(f"{len(inventory)} urządzeń w {files} plikach; zmiana: +{len(added)} ~{len(updated)} -{len(dropped)}")
+        report('  wczytanie', load_times)
+        report('  przeładowanie bez zmian', noop_times)
+        report('  przeładowanie ze zmianą', reload_times)
+
+    async def apply():
+        # Harmonogram bez silnika SNMP - mierzymy tylko koszt zmian w pollerze
+        poller = AsyncPoller(Inventory(path=path).load()[0])
+        poller._loop = asyncio.get_running_loop()
+        poller._wakeup = asyncio.Event()
+        start = time.perf_counter()
+        for device in poller.devices.values():
+            poller._schedule(device)
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        poller._update_devices(added, updated, dropped)
+        diff = time.perf_counter() - start
+        print(f"Poller: zaplanowanie całego inwentarza {full * 1000:.1f} ms, "
+              f"zastosowanie różnicy {diff * 1000:.1f} ms ({len(poller.scheduler)} zadań)")
+
+    asyncio.run(apply())
+
+
+def bench_metrics(args):
+    """Koszt /metrics: aktualizacja bloku urządzenia przy odczycie i sklejenie odpowiedzi przy scrape"""
+    import random
+    from prometheus import MetricsExposition, escape_label, format_value
+
+    fields = 100
+    exposition = MetricsExposition()
+    fleet = {f'dev{d}': {f'if{i}_In': float(random.randint(0, 2 ** 32)) for i in range(fields)}
+             for d in range(args.devices)}
+
+    updates = []
+    for name, values in fleet.items():
+        start = time.perf_counter()
+        exposition.update_device(name, values)
+        updates.append(time.perf_counter() - start)
+    print(f"{args.devices} urządzeń x {fields} pól = {exposition.series()} serii")
+    report('update_device()', updates)
+
+    def naive():
+        # Formatowanie wszystkich serii przy każdym żądaniu
+        return ''.join(f'snmp_value{{device="{escape_label(name)}",metric="{escape_label(key)}"}} {format_value(value)}\n'
+                       for name, values in fleet.items() for key, value in values.items()).encode('utf-8')
+
+    for label, render in (('render() pełne formatowanie', naive), ('render() gotowe bloki', exposition.render)):
+        times = []
+        for _ in range(max(5, args.rounds // 5)):
+            start = time.perf_counter()
+            body = render()
+            times.append(time.perf_counter() - start)
+        report(label, times)
+    print(f"rozmiar odpowiedzi: {len(body) / 2 ** 20:.1f} MiB")
+
+
+def rss_bytes():
+    """Bieżąca pamięć rezydentna procesu z /proc (Linux); 0, gdy niedostępna"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+class FakeHistoryResult:
+    def __init__(self, series):
+        self.series = series
+
+    def items(self):
+        return self.series
+
+
+class FakeHistoryClient:
+    """Atrapa InfluxDBClient.query dla zapytań historii: stałe opóźnienie, liczba zapytań i czytanych odczytów"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.queries = 0
+        self.points = 0
+        self._lock = threading.Lock()
+
+    def query(self, q, database=None, epoch=None):
+        import re
+        start, end = map(int, re.search(r'time >= (\d+)s AND time < (\d+)s', q).groups())
+        interval = int(re.search(r'GROUP BY time\((\d+)s\)', q).group(1))
+        oids = re.findall(r'"oid" = \'([^\']+)\'', q)
+        with self._lock:
+            self.queries += 1
+            self.points += (end - start) // 10 * len(oids)
+        time.sleep(self.latency)
+        buckets = range(start - start % interval, end, interval)
+        return FakeHistoryResult([(('snmp_metrics', {'oid': oid}),
+                                   [{'time': t, 'value': float((t // interval * 7 + i) % 100)} for t in buckets])
+                                  for i, oid in enumerate(oids)])
+
+
+def bench_history_cache(args):
+    """Pamięć podręczna historii: równoczesne dashboardy, przesuwane okno i limit rozmiaru"""
+    from collections import Counter
+    from history import query_history
+    from history_cache import HistoryCache
+
+    metrics = ['cpuUsage', 'ramUsage']
+    viewers = args.concurrency
+
+    def concurrent(query):
+        barrier = threading.Barrier(viewers)
+        statuses = Counter()
+
+        def viewer():
+            barrier.wait()
+            statuses[query()] += 1
+        threads = [threading.Thread(target=viewer) for _ in range(viewers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, statuses
+
+    end = int(time.time())
+    client = FakeHistoryClient()
+    elapsed, _ = concurrent(lambda: query_history(client, 'snmp_data', metrics, end - 86400, end, 500)["source"])
+    print(f"{viewers} równoczesnych dashboardów 24 h bez pamięci: {client.queries} zapytań, "
+          f"{client.points} odczytów, {elapsed * 1000:.0f} ms")
+    client = FakeHistoryClient()
+    cache = HistoryCache(client, 'snmp_data')
+    elapsed, statuses = concurrent(lambda: cache.query(metrics, end - 86400, end, 500)[1])
+    print(f"{viewers} równoczesnych dashboardów 24 h z pamięcią: {client.queries} zapytań, "
+          f"{client.points} odczytów, {elapsed * 1000:.0f} ms, {dict(statuses)}")
+
+    # Okno przesuwane co okres pollera; w każdym oknie odświeża kilku widzów
+    windows, refreshes = 60, 5
+    client, reference = FakeHistoryClient(latency=0), FakeHistoryClient(latency=0)
+    cache = HistoryCache(client, 'snmp_data')
+    statuses, mismatches = Counter(), 0
+    for window in range(windows):
+        for refresh in range(refreshes):
+            now = end + window * 10 + refresh
+            history, status = cache.query(metrics, now - 86400, now, 500)
+            statuses[status] += 1
+        full = query_history(reference, 'snmp_data', metrics, history["start"], history["end"],
+                             interval=history["interval"])
+        mismatches += (full["time"], full["metrics"]) != (history["time"], history["metrics"])
+    full_points = reference.points * refreshes
+    print(f"Przesuwane okno 24 h, {windows} okresów x {refreshes} odświeżeń: {client.queries} zapytań, "
+          f"{client.points} odczytów zamiast {full_points} ({full_points / max(1, client.points):.0f}x mniej), "
+          f"niezgodnych z pełnym zapytaniem: {mismatches}, {dict(statuses)}")
+
+    # Limit rozmiaru: wiele urządzeń, pamięć na kilka wyników
+    client = FakeHistoryClient(latency=0)
+    cache = HistoryCache(client, 'snmp_data', max_bytes=256 * 1024)
+    for device in range(args.devices):
+        cache.query(metrics, end - 86400, end, 500, device=f'sim-{device}')
+    print(f"{args.devices} urządzeń, limit 256 KB: {cache.metrics()}")
+
+
+def bench_export(args):
+    """Strumieniowy eksport CSV/NDJSON z atrapy InfluxDB: przepustowość i pamięć dla rosnącego zakresu"""
+    import zlib
+    from influxdb import InfluxDBClient
+    from bulk_export import BulkExporter
+
+    metrics = ['cpuUsage', 'ramUsage'] + [f'if{i}_{name}' for i in range(1, 5) for name in ('InBps', 'OutBps')]
+    server = start_fake_influx((f'sim-{d}', m) for d in range(args.devices) for m in metrics)
+    client = InfluxDBClient('127.0.0.1', server.server_address[1], database='snmp_data')
+    exporter = BulkExporter(client, 'snmp_data', window='1h')
+    end = 1700000000
+    # Pierwszy przebieg (rozgrzewka buforów i pamięci podręcznych formatowania) nie jest raportowany
+    runs = [('csv', True, 0.25, False)] + [(f, c, 1, True) for f in ('csv', 'ndjson') for c in (False, True)]
+    runs += [('csv', True, hours, True) for hours in (3, 9)]
+    failed = []
+    try:
+        for export_format, compress, hours, shown in runs:
+            peak = [0]
+            baseline = rss_bytes()
+            done = threading.Event()
+
+            def sample():
+                while not done.wait(0.01):
+                    peak[0] = max(peak[0], rss_bytes() - baseline)
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+
+            decompressor = zlib.decompressobj(31) if compress else None
+            lines = size = 0
+            start = time.perf_counter()
+            for chunk in exporter.stream(export_format, compress, start=end - hours * 3600, end=end):
+                size += len(chunk)
+                lines += (decompressor.decompress(chunk) if compress else chunk).count(b'\n')
+            elapsed = time.perf_counter() - start
+            done.set()
+            sampler.join()
+
+            rows = lines - (export_format == 'csv')
+            expected = int(hours * 360) * len(server.series)
+            name = f"{export_format + ('+gzip' if compress else '')} {hours} h"
+            if rows != expected:
+                failed.append(f"{name}: {rows} wierszy, oczekiwano {expected}")
+            if shown and peak[0] > args.max_export_mb * 1e6:
+                failed.append(f"{name}: przyrost pamięci {peak[0] / 1e6:.1f} MB > {args.max_export_mb} MB")
+            if not shown:
+                continue
+            print(f"{export_format + ('+gzip' if compress else ''):<12} {hours:>3} h: {rows} wierszy "
+                  f"({'zgodnie' if rows == expected else f'oczekiwano {expected}'}), {size / 1e6:.1f} MB, "
+                  f"{rows / elapsed:.0f} wierszy/s, przyrost pamięci {peak[0] / 1e6:.1f} MB")
+        print(f"Zapytań do atrapy: {server.queries}, metryki: {exporter.metrics()}")
+    finally:
+        server.shutdown()
+
+    if failed:
+        print("REGRESJA: " + "; ".join(failed))
+        sys.exit(1)
+    print(f"OK (próg przyrostu pamięci {args.max_export_mb} MB)")
+
+
+def process_cpu(pid):
+    """Czas CPU procesu i jego potomków [s] z /proc (Linux); None, gdy niedostępny"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return None
+    total = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total + sum(process_cpu(child) or 0.0 for child in children)
+
+
+def bench_farm(args):
+    """Powtarzalny test obciążeniowy na farmie agentów: przepustowość, opóźnienia i CPU na urządzenie"""
+    import json
+    import asyncio
+    import resource
+    from poller import AsyncPoller
+    from config import POLLER_CONFIG
+
+    agent = start_local_agent(args.port, args.devices, options=[
+        '--seed', str(args.seed), '--processes', str(args.agent_processes)])
+    devices = local_devices(args.port, args.devices)
+    poller = AsyncPoller(devices, concurrency=args.concurrency, timeout=2.0, retries=1)
+    try:
+        async def run():
+            await poller.poll_once()  # rozgrzewka: silnik, wykrywanie engineID, symulatory urządzeń
+            latencies, ok = [], 0
+            next_device = iter(range(sys.maxsize))
+            cpu = (process_cpu(agent.pid), resource.getrusage(resource.RUSAGE_SELF), time.perf_counter())
+            deadline = cpu[2] + args.duration
+
+            async def worker():
+                nonlocal ok
+                while time.perf_counter() < deadline:
+                    device = devices[next(next_device) % len(devices)]
+                    start = time.perf_counter()
+                    data = await poller.poll_device(device)
+                    latencies.append(time.perf_counter() - start)
+                    ok += data.get('sysName') == 'RTR-Main-01'
+
+            await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+            return latencies, ok, cpu
+
+        latencies, ok, (agent_cpu, usage, start) = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        agent_cpu = process_cpu(agent.pid) - agent_cpu if agent_cpu is not None else None
+    finally:
+        agent.terminate()
+        agent.wait()
+
+    polls = len(latencies)
+    poller_cpu = (after.ru_utime + after.ru_stime - usage.ru_utime - usage.ru_stime) / polls
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    result = {
+        'devices': args.devices,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'duration_s': args.duration,
+        'polls': polls,
+        'ok': ok,
+        'polls_per_s': round(polls / elapsed, 1),
+        'latency_p50_ms': round(percentile(0.5), 1),
+        'latency_p95_ms': round(percentile(0.95), 1),
+        'latency_p99_ms': round(percentile(0.99), 1),
+        'poller_cpu_ms_per_poll': round(poller_cpu * 1000, 3),
+        'agent_cpu_ms_per_poll': round(agent_cpu / polls * 1000, 3) if agent_cpu is not None else None,
+        # Ile urządzeń jeden rdzeń pollera obsłuży przy okresie odpytania z konfiguracji
+        'devices_per_core': int(POLLER_CONFIG['interval'] / poller_cpu),
+        'interval_s': POLLER_CONFIG['interval'],
+        'poller_stats': poller.stats.snapshot(),
+    }
+    print(f"{args.devices} urządzeń (ziarno {args.seed}), współbieżność {args.concurrency}, "
+          f"{polls} odpytań w {elapsed:.1f} s, poprawnych {ok}/{polls}")
+    print(f"Przepustowość: {result['polls_per_s']} odpytań/s")
+    print(f"Opóźnienie: p50={result['latency_p50_ms']} ms  p95={result['latency_p95_ms']} ms  "
+          f"p99={result['latency_p99_ms']} ms")
+    print(f"CPU na odpytanie: poller {result['poller_cpu_ms_per_poll']} ms, "
+          f"agent {result['agent_cpu_ms_per_poll']} ms")
+    print(f"Urządzeń na rdzeń pollera przy okresie {POLLER_CONFIG['interval']} s: {result['devices_per_core']}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Wynik zapisany w {args.output}")
+
+
+BENCHMARKS = {
+    'poll': bench_poll,
+    'load': bench_load,
+    'writer': bench_writer,
+    'discovery': bench_discovery,
+    'usm': bench_usm,
+    'report': bench_report,
+    'traps': bench_traps,
+    'alerts': bench_alerts,
+    'startup': bench_startup,
+    'ber': bench_ber,
+    'shards': bench_shards,
+    'scheduler': bench_scheduler,
+    'recent': bench_recent,
+    'metrics': bench_metrics,
+    'farm': bench_farm,
+    'retention': bench_retention,
+    'inventory': bench_inventory,
+    'anomaly': bench_anomaly,
+    'compression': bench_compression,
+    'export': bench_export,
+    'history_cache': bench_history_cache,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarki backendu SNMP')
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('--local', action='store_true', help='uruchom lokalnego agenta snmp_agent.py')
+    parser.add_argument('--port', type=int, default=16161)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--devices', type=int, default=100, help='liczba symulowanych urządzeń')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--rate', type=int, default=5000, help='trapów na sekundę (benchmark traps)')
+    parser.add_argument('--duration', type=int, default=2, help='czas pomiaru (benchmarki traps, shards, farm) [s]')
+    parser.add_argument('--workers', type=int, default=0, help='maks. liczba procesów pollera (benchmark shards; domyślnie liczba CPU)')
+    parser.add_argument('--max-startup', type=float, default=1.5, help='próg czasu importu app.py [s] (benchmark startup)')
+    parser.add_argument('--max-engine-ms', type=float, default=30.0, help='próg tworzenia SnmpEngine [ms] (benchmark startup)')
+    parser.add_argument('--seed', type=int, default=1, help='ziarno przebiegu wartości agentów (benchmarki farm, anomaly, compression)')
+    parser.add_argument('--max-export-mb', type=float, default=32.0, help='próg przyrostu pamięci eksportu [MB] (benchmark export)')
+    parser.add_argument('--agent-processes', type=int, default=1, help='procesy farmy agentów (benchmark farm)')
+    parser.add_argument('--output', help='plik JSON z wynikiem (benchmark farm)')
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == '__main__':
+    main()
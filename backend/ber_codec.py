@@ -0,0 +1,355 @@
+import logging
+
+from pyasn1.codec.ber import decoder as ber_decoder, encoder as ber_encoder
+from pyasn1.error import PyAsn1Error
+from pyasn1.type import base
+from pysnmp.proto.mpmod.rfc3412 import ScopedPDU
+from config import BER_CODEC_CONFIG
+
+logger = logging.getLogger("SNMP-BER")
+
+# Szybki koder BER dla ScopedPDU (SNMPv3) z PDU GET/GETNEXT/GETBULK/Response/Report.
+#
+# Ogólny koder pyasn1 sprawdza przy każdym elemencie schemat, tagi i
+# ograniczenia; dla PDU z kilkudziesięcioma wiązaniami to kilka ms CPU na
+# odpowiedź.  Tutaj BER jest czytany i pisany wprost z bajtów, a drzewo
+# obiektów pyasn1 dla pysnmp jest składane z gotowych wzorców schematu.
+# Wszystko, czego ścieżka nie rozpoznaje, idzie przez koder pyasn1.
+
+TAG_SEQUENCE = 0x30
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OID = 0x06
+TAG_IP_ADDRESS = 0x40
+TAG_COUNTER32 = 0x41
+TAG_GAUGE32 = 0x42
+TAG_TIMETICKS = 0x43
+TAG_OPAQUE = 0x44
+TAG_COUNTER64 = 0x46
+TAG_UNSIGNED = (TAG_COUNTER32, TAG_GAUGE32, TAG_TIMETICKS, TAG_COUNTER64)
+TAG_EXCEPTIONS = (0x80, 0x81, 0x82)           # noSuchObject, noSuchInstance, endOfMibView
+TAG_SNMPV2_TRAP = 0xa7
+
+
+# Elementy BER
+
+def read_tlv(data, pos):
+    """Zwraca (tag, początek wartości, koniec wartości) elementu BER od pozycji pos"""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7f
+        if not size:
+            raise ValueError("Nieokreślona długość BER")
+        length = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    end = pos + length
+    if end > len(data):
+        raise ValueError("Ucięty element BER")
+    return tag, pos, end
+
+
+def decode_oid(data):
+    arcs = []
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    if not arcs or data[-1] & 0x80:
+        raise ValueError("Ucięty identyfikator OID")
+    # Pierwszy identyfikator koduje dwa łuki: 40 * X + Y (dla X = 2 także Y >= 40)
+    first = arcs[0]
+    arcs[:1] = (first // 40, first % 40) if first < 80 else (2, first - 80)
+    return tuple(arcs)
+
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes((length,))
+    size = (length.bit_length() + 7) // 8
+    return bytes((0x80 | size,)) + length.to_bytes(size, 'big')
+
+
+def encode_tlv(tag, content):
+    return bytes((tag,)) + encode_length(len(content)) + content
+
+
+def encode_integer(value):
+    """Treść INTEGER w kodzie uzupełnień do dwóch.
+
+    Długość liczona jak w pyasn1 - ujemne potęgi dwójki (np. -128) dostają
+    bajt więcej niż minimum, dzięki czemu wynik jest identyczny z koderem pyasn1.
+    """
+    size = value.bit_length() // 8 + 1
+    return value.to_bytes(size, 'big', signed=True)
+
+
+def encode_oid(arcs):
+    if len(arcs) < 2:
+        raise ValueError("OID musi mieć co najmniej dwa łuki")
+    out = bytearray()
+    for arc in (arcs[0] * 40 + arcs[1],) + tuple(arcs[2:]):
+        if arc < 0x80:
+            out.append(arc)
+            continue
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7f))
+            arc >>= 7
+        out.extend(reversed(chunk))
+    return bytes(out)
+
+
+# Wzorce schematu - obiekty pyasn1 powstają przez skopiowanie atrybutów
+# wzorca zamiast przez konstruktor i setComponentBy*() z walidacją
+
+def _scalar(template, value):
+    obj = object.__new__(template.__class__)
+    obj.__dict__.update(template.__dict__)
+    obj._value = value
+    return obj
+
+
+def _sequence(template, values):
+    obj = object.__new__(template.__class__)
+    obj.__dict__.update(template.__dict__)
+    obj._componentValues = values
+    return obj
+
+
+def _choice(template, index, value):
+    values = [base.noValue] * template._componentTypeLen
+    values[index] = value
+    obj = _sequence(template, values)
+    obj._currentIdx = index
+    return obj
+
+
+def _component(template, index):
+    return template.componentType.getTypeByPosition(index)
+
+
+_SCOPED_PDU = ScopedPDU()
+_PDUS = _component(_SCOPED_PDU, 2)
+_VAR_BIND_LIST = _component(_component(_PDUS, 0), 3)
+_VAR_BIND = _VAR_BIND_LIST.componentType
+_OBJECT_NAME = _component(_VAR_BIND, 0)
+_BIND_VALUE = _component(_VAR_BIND, 1)
+_OBJECT_SYNTAX = _component(_BIND_VALUE, 0)
+_SYNTAXES = (_component(_OBJECT_SYNTAX, 0), _component(_OBJECT_SYNTAX, 1))
+
+
+def _tag_byte(tag_set):
+    tag = tag_set[-1]
+    return tag.tagClass | tag.tagFormat | tag.tagId
+
+
+# Tag PDU -> (pozycja w PDUs, wzorzec PDU, wzorce pól nagłówka)
+PDU_TYPES = {}
+for _index in range(len(_PDUS.componentType)):
+    _pdu = _component(_PDUS, _index)
+    PDU_TYPES[_tag_byte(_pdu.tagSet)] = (_index, _pdu, [_component(_pdu, i) for i in range(3)])
+
+# Tag wartości -> (pozycja w _BindValue, pozycja w ObjectSyntax, pozycja w Simple/ApplicationSyntax, wzorzec)
+VALUE_TYPES = {}
+for _syntax_index, _syntax in enumerate(_SYNTAXES):
+    for _index in range(len(_syntax.componentType)):
+        _value = _component(_syntax, _index)
+        VALUE_TYPES[_tag_byte(_value.tagSet)] = (0, _syntax_index, _index, _value)
+for _index in range(1, len(_BIND_VALUE.componentType)):
+    _value = _component(_BIND_VALUE, _index)
+    VALUE_TYPES[_tag_byte(_value.tagSet)] = (_index, None, None, _value)
+
+INTEGER_TAGS = (TAG_INTEGER,) + TAG_UNSIGNED
+OCTET_TAGS = (TAG_OCTET_STRING, TAG_IP_ADDRESS, TAG_OPAQUE)
+NULL_TAGS = (TAG_NULL,) + TAG_EXCEPTIONS
+
+
+class FallbackRequired(Exception):
+    """Wiadomość poza kształtem obsługiwanym przez szybką ścieżkę"""
+
+
+def _integer(data, start, end, template):
+    value = int.from_bytes(data[start:end], 'big', signed=True)
+    try:
+        template.subtypeSpec(value)
+    except PyAsn1Error:
+        raise FallbackRequired("Wartość poza zakresem typu")
+    return value
+
+
+def _decode_bind_value(data, tag, start, end):
+    entry = VALUE_TYPES.get(tag)
+    if entry is None:
+        raise FallbackRequired(f"Nieobsługiwany typ wartości 0x{tag:02x}")
+    bind_index, syntax_index, index, template = entry
+    if tag in INTEGER_TAGS:
+        value = _integer(data, start, end, template)
+    elif tag in OCTET_TAGS:
+        value = bytes(data[start:end])
+        try:
+            template.subtypeSpec(value)
+        except PyAsn1Error:
+            raise FallbackRequired("Długość poza zakresem typu")
+    elif tag == TAG_OID:
+        value = decode_oid(data[start:end])
+    elif start == end:
+        value = b''
+    else:
+        raise FallbackRequired("NULL z treścią")
+
+    leaf = _scalar(template, value)
+    if syntax_index is None:
+        return _choice(_BIND_VALUE, bind_index, leaf)
+    syntax = _choice(_SYNTAXES[syntax_index], index, leaf)
+    return _choice(_BIND_VALUE, 0, _choice(_OBJECT_SYNTAX, syntax_index, syntax))
+
+
+def decode_scoped_pdu(substrate):
+    """Dekoduje ScopedPDU do drzewa pyasn1 jak decoder.decode(..., asn1Spec=ScopedPDU()).
+
+    Zwraca (ScopedPDU, reszta bajtów) - po odszyfrowaniu DES za PDU zostaje dopełnienie.
+    """
+    data = memoryview(substrate)
+    tag, pos, end = read_tlv(data, 0)
+    if tag != TAG_SEQUENCE:
+        raise FallbackRequired("To nie jest ScopedPDU")
+    rest = substrate[end:]
+
+    tag, start, pos = read_tlv(data, pos)
+    if tag != TAG_OCTET_STRING:
+        raise FallbackRequired("Brak contextEngineId")
+    engine_id = _scalar(_component(_SCOPED_PDU, 0), bytes(data[start:pos]))
+    tag, start, pos = read_tlv(data, pos)
+    if tag != TAG_OCTET_STRING:
+        raise FallbackRequired("Brak contextName")
+    context_name = _scalar(_component(_SCOPED_PDU, 1), bytes(data[start:pos]))
+
+    tag, pos, pdu_end = read_tlv(data, pos)
+    if tag not in PDU_TYPES or pdu_end != end:
+        raise FallbackRequired(f"Nieobsługiwany PDU 0x{tag:02x}")
+    pdu_index, pdu_template, header = PDU_TYPES[tag]
+    fields = []
+    for template in header:
+        tag, start, pos = read_tlv(data, pos)
+        if tag != TAG_INTEGER:
+            raise FallbackRequired("Nagłówek PDU bez INTEGER")
+        fields.append(_scalar(template, _integer(data, start, pos, template)))
+
+    tag, pos, list_end = read_tlv(data, pos)
+    if tag != TAG_SEQUENCE or list_end != pdu_end:
+        raise FallbackRequired("Brak listy wiązań")
+    var_binds = {}
+    while pos < list_end:
+        tag, pos, bind_end = read_tlv(data, pos)
+        if tag != TAG_SEQUENCE:
+            raise FallbackRequired("Wiązanie nie jest SEQUENCE")
+        tag, start, pos = read_tlv(data, pos)
+        if tag != TAG_OID:
+            raise FallbackRequired("Wiązanie bez OID")
+        name = _scalar(_OBJECT_NAME, decode_oid(data[start:pos]))
+        tag, start, pos = read_tlv(data, pos)
+        if pos != bind_end:
+            raise FallbackRequired("Nadmiarowe pola wiązania")
+        value = _decode_bind_value(data, tag, start, pos)
+        var_binds[len(var_binds)] = _sequence(_VAR_BIND, [name, value])
+
+    fields.append(_sequence(_VAR_BIND_LIST, var_binds))
+    pdu = _choice(_PDUS, pdu_index, _sequence(pdu_template, fields))
+    return _sequence(_SCOPED_PDU, [engine_id, context_name, pdu]), rest
+
+
+def _encode_bind_value(value):
+    tag = _tag_byte(value.tagSet)
+    if tag in INTEGER_TAGS:
+        return encode_tlv(tag, encode_integer(int(value)))
+    if tag in OCTET_TAGS:
+        return encode_tlv(tag, value.asOctets())
+    if tag == TAG_OID:
+        return encode_tlv(tag, encode_oid(value.asTuple()))
+    if tag in NULL_TAGS:
+        return bytes((tag, 0))
+    raise FallbackRequired(f"Nieobsługiwany typ wartości 0x{tag:02x}")
+
+
+def encode_scoped_pdu(scoped_pdu):
+    """Koduje ScopedPDU bajt w bajt tak samo jak encoder.encode() z pyasn1"""
+    pdu = scoped_pdu.getComponentByPosition(2).getComponent()
+    tag = _tag_byte(pdu.tagSet)
+    if tag not in PDU_TYPES:
+        raise FallbackRequired(f"Nieobsługiwany PDU 0x{tag:02x}")
+
+    binds = []
+    for var_bind in pdu.getComponentByPosition(3):
+        name = encode_tlv(TAG_OID, encode_oid(var_bind.getComponentByPosition(0).asTuple()))
+        value = _encode_bind_value(var_bind.getComponentByPosition(1).getComponent(innerFlag=True))
+        binds.append(encode_tlv(TAG_SEQUENCE, name + value))
+
+    header = b''.join(encode_tlv(TAG_INTEGER, encode_integer(int(pdu.getComponentByPosition(i))))
+                      for i in range(3))
+    body = encode_tlv(tag, header + encode_tlv(TAG_SEQUENCE, b''.join(binds)))
+    return encode_tlv(TAG_SEQUENCE,
+                      encode_tlv(TAG_OCTET_STRING, scoped_pdu.getComponentByPosition(0).asOctets()) +
+                      encode_tlv(TAG_OCTET_STRING, scoped_pdu.getComponentByPosition(1).asOctets()) +
+                      body)
+
+
+stats = {"decoded": 0, "encoded": 0, "fallback": 0}
+
+
+def metrics():
+    return dict(stats, enabled=BER_CODEC_CONFIG['enabled'])
+
+
+class Decoder:
+    """Zamiennik pyasn1.codec.ber.decoder: ScopedPDU szybką ścieżką, reszta przez pyasn1"""
+
+    def decode(self, substrate, asn1Spec=None, **options):
+        if type(asn1Spec) is ScopedPDU and not options:
+            try:
+                result = decode_scoped_pdu(bytes(substrate))
+                stats["decoded"] += 1
+                return result
+            except (FallbackRequired, ValueError, IndexError):
+                # Generyczny dekoder przyjmie nietypowe kodowanie albo zgłosi właściwy błąd
+                stats["fallback"] += 1
+        return ber_decoder.decode(substrate, asn1Spec=asn1Spec, **options)
+
+    __call__ = decode
+
+
+class Encoder:
+    """Zamiennik pyasn1.codec.ber.encoder: ScopedPDU szybką ścieżką, reszta przez pyasn1"""
+
+    def encode(self, value, asn1Spec=None, **options):
+        if type(value) is ScopedPDU and asn1Spec is None and not options:
+            try:
+                result = encode_scoped_pdu(value)
+                stats["encoded"] += 1
+                return result
+            except (FallbackRequired, PyAsn1Error, ValueError, TypeError, AttributeError):
+                stats["fallback"] += 1
+        return ber_encoder.encode(value, asn1Spec=asn1Spec, **options)
+
+    __call__ = encode
+
+
+decoder = Decoder()
+encoder = Encoder()
+
+
+def install():
+    """Podmienia koder BER w module USM pysnmp (kodowanie i dekodowanie ScopedPDU)"""
+    if not BER_CODEC_CONFIG['enabled']:
+        return False
+    from pysnmp.proto.secmod.rfc3414 import service
+    if service.encoder is not encoder:
+        service.encoder = encoder
+        service.decoder = decoder
+        logger.debug("Szybki koder BER aktywny dla ScopedPDU")
+    return True
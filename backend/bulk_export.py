@@ -0,0 +1,231 @@
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+from functools import lru_cache
+from datetime import datetime, timezone
+
+from history import parse_duration, quote, identifier, AGGREGATES, MIN_INTERVAL
+from config import BULK_EXPORT_CONFIG
+
+logger = logging.getLogger("SNMP-BulkExport")
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+CSV_HEADER = "time,device,metric,value\n"
+
+_METRIC_RE = re.compile(r'^[\w.\-:*]+$')
+
+
+def metric_filter(metric):
+    """Warunek na tag "oid"; '*' jak w regułach alarmów (if*_InBps - wszystkie interfejsy)"""
+    if '*' not in metric:
+        return f'"oid" = {quote(metric)}'
+    if not _METRIC_RE.match(metric):
+        raise ValueError(f"Niepoprawna nazwa: {metric}")
+    return '"oid" =~ /^' + re.escape(metric).replace(r'\*', r'\d+') + '$/'
+
+
+def build_export_query(metrics, devices, start, end, interval=None, agg='mean', policy=None, field='value'):
+    """Zapytanie jednego okna eksportu.
+
+    Bez 'interval' - zapisane punkty w kolejności czasu (tagi jako kolumny),
+    z 'interval' - agregaty GROUP BY time() osobno dla każdej serii.
+    """
+    conditions = []
+    if metrics:
+        conditions.append("(" + " OR ".join(metric_filter(m) for m in metrics) + ")")
+    if devices:
+        conditions.append("(" + " OR ".join(f'"device" = {quote(d)}' for d in devices) + ")")
+    conditions.append(f"time >= {int(start)}s AND time < {int(end)}s")
+    measurement = f'"{identifier(policy)}"."snmp_metrics"' if policy else '"snmp_metrics"'
+    where = " AND ".join(conditions)
+    if interval is None:
+        return f'SELECT "{identifier(field)}" AS "value", "device", "oid" FROM {measurement} WHERE {where}'
+    if agg not in AGGREGATES:
+        raise ValueError(f"Nieobsługiwana agregacja: {agg}")
+    return (
+        f'SELECT {agg}("{identifier(field)}") AS "value" FROM {measurement} WHERE {where} '
+        f'GROUP BY time({int(interval)}s), "device", "oid" fill(none)'
+    )
+
+
+def parse_export_args(args):
+    """Parametry endpointu /export/metrics z request.args"""
+    end = int(args.get('end') or time.time())
+    if args.get('start'):
+        start = int(args['start'])
+    else:
+        start = end - parse_duration(args.get('range', '24h'))
+    if start >= end:
+        raise ValueError("Początek zakresu musi być przed końcem")
+
+    export_format = args.get('format', 'csv')
+    if export_format not in FORMATS:
+        raise ValueError(f"Nieobsługiwany format: {export_format}")
+    metrics = [m for m in args.get('metrics', '').split(',') if m]
+    devices = [d for d in args.get('device', '').split(',') if d]
+    for name in devices:
+        quote(name)
+    for metric in metrics:
+        metric_filter(metric)
+    interval = None
+    if args.get('interval'):
+        interval = max(MIN_INTERVAL, parse_duration(args['interval']))
+    agg = args.get('agg', 'mean')
+    if agg not in AGGREGATES:
+        raise ValueError(f"Nieobsługiwana agregacja: {agg}")
+    return {
+        "metrics": metrics,
+        "devices": devices,
+        "start": start,
+        "end": end,
+        "interval": interval,
+        "agg": agg,
+        "format": export_format,
+    }
+
+
+# Wiersze kolejnych punktów powtarzają znaczniki czasu i nazwy - formatowanie raz na wartość
+@lru_cache(maxsize=65536)
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@lru_cache(maxsize=65536)
+def _csv_field(value):
+    text = str(value)
+    if any(c in text for c in ',"\n\r'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def encode_csv(row):
+    t, device, metric, value = row
+    return f"{_timestamp(t)},{_csv_field(device)},{_csv_field(metric)},{value}\n"
+
+
+def encode_ndjson(row):
+    t, device, metric, value = row
+    return json.dumps({"time": _timestamp(t), "device": device, "metric": metric, "value": value},
+                      ensure_ascii=False) + "\n"
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson}
+
+
+class BulkExporter:
+    """Strumieniowy eksport historii z InfluxDB do CSV lub NDJSON.
+
+    Zakres jest dzielony na okna 'window', a każde okno czytane z
+    chunked=true - w pamięci jest najwyżej jedna porcja 'chunk_size' punktów
+    i jeden bufor wyjściowy, więc zużycie pamięci nie zależy od długości
+    zakresu.  Z 'interval' eksport korzysta z poziomów rollup
+    (retention.RetentionManager), bo surowe odczyty są przechowywane krócej.
+    """
+
+    def __init__(self, client, database, retention=None, **options):
+        self.options = dict(BULK_EXPORT_CONFIG, **options)
+        self.client = client
+        self.database = database
+        self.retention = retention
+        self._lock = threading.Lock()
+        self.stats = {"exports": 0, "active": 0, "errors": 0, "rows": 0, "bytes": 0, "queries": 0}
+
+    def _parts(self, start, end, interval, agg):
+        """[(polityka, pole, start, end, interval)] - poziom rollup wybrany jak w zapytaniach historii"""
+        if interval is None or self.retention is None:
+            return [(None, 'value', start, end, interval)]
+        tier, interval = self.retention.choose_tier(start, end, interval)
+        start = start - start % interval
+        return [part + (interval,) for part in self.retention.sources(tier, agg, start, end, interval)]
+
+    def _windows(self, start, end, interval):
+        window = parse_duration(self.options['window'])
+        if interval:
+            window = max(interval, window // interval * interval)
+        position = start
+        while position < end:
+            yield position, min(position + window, end)
+            position += window
+
+    def rows(self, metrics=(), devices=(), start=None, end=None, interval=None, agg='mean'):
+        """Wiersze (czas [s], urządzenie, metryka, wartość) kolejnymi oknami czasu"""
+        end = int(time.time() if end is None else end)
+        start = int(end - 86400 if start is None else start)
+        for policy, field, part_start, part_end, part_interval in self._parts(start, end, interval, agg):
+            for window_start, window_end in self._windows(part_start, part_end, part_interval):
+                query = build_export_query(metrics, devices, window_start, window_end, part_interval, agg, policy, field)
+                with self._lock:
+                    self.stats["queries"] += 1
+                for result in self.client.query(query, database=self.database, epoch='s',
+                                                chunked=True, chunk_size=self.options['chunk_size']):
+                    for series in result.raw.get('series', []):
+                        columns = series['columns']
+                        tags = series.get('tags') or {}
+                        t, v = columns.index('time'), columns.index('value')
+                        d = columns.index('device') if 'device' in columns else None
+                        o = columns.index('oid') if 'oid' in columns else None
+                        for values in series['values']:
+                            if values[v] is None:
+                                continue
+                            yield (values[t],
+                                   values[d] if d is not None else tags.get('device'),
+                                   values[o] if o is not None else tags.get('oid'),
+                                   values[v])
+
+    def stream(self, export_format='csv', compress=False, **query):
+        """Kolejne porcje bajtów pliku (opcjonalnie gzip) - do Response Flask"""
+        encode = ENCODERS[export_format]
+        compressor = zlib.compressobj(self.options['gzip_level'], zlib.DEFLATED, 31) if compress else None
+        limit = self.options['buffer_bytes']
+        rows = 0
+        sent = 0
+        with self._lock:
+            self.stats["exports"] += 1
+            self.stats["active"] += 1
+
+        def pack(text, final=False):
+            data = text.encode('utf-8')
+            if compressor is not None:
+                data = compressor.compress(data) + (compressor.flush() if final else b'')
+            return data
+
+        try:
+            buffer = [CSV_HEADER] if export_format == 'csv' else []
+            size = 0
+            for row in self.rows(**query):
+                line = encode(row)
+                buffer.append(line)
+                size += len(line)
+                rows += 1
+                if size >= limit:
+                    chunk = pack(''.join(buffer))
+                    buffer, size = [], 0
+                    if chunk:
+                        sent += len(chunk)
+                        yield chunk
+            chunk = pack(''.join(buffer), final=True)
+            sent += len(chunk)
+        except Exception as e:
+            # Nagłówki są już wysłane - błąd trafia na koniec pliku, żeby niepełny eksport był rozpoznawalny
+            with self._lock:
+                self.stats["errors"] += 1
+            logger.error(f"Eksport przerwany po {rows} wierszach: {e}")
+            trailer = f"# błąd eksportu: {e}\n" if export_format == 'csv' else json.dumps({"error": str(e)}) + "\n"
+            chunk = pack(''.join(buffer) + trailer, final=True)
+            sent += len(chunk)
+        finally:
+            with self._lock:
+                self.stats["active"] -= 1
+                self.stats["rows"] += rows
+                self.stats["bytes"] += sent
+        yield chunk
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,247 @@
+import math
+import time
+import bisect
+import logging
+import threading
+
+from alerts import metric_pattern
+from config import COMPRESSION_CONFIG, COMPRESSION_RULES
+
+logger = logging.getLogger("SNMP-Compression")
+
+MODES = ('change', 'deadband', 'swingdoor')
+
+# Odtwarzanie przebiegu w zapytaniach historii wg trybu reguły
+FILLS = {
+    'change': 'step',
+    'deadband': 'step',
+    'swingdoor': 'linear',
+}
+
+
+def parse_rules(rules):
+    parsed = []
+    for rule in rules:
+        mode = rule.get('mode')
+        if mode not in MODES:
+            raise ValueError(f"Reguła kompresji {rule.get('metric')}: nieznany tryb {mode}")
+        absolute = float(rule.get('absolute', 0))
+        percent = float(rule.get('percent', 0))
+        if absolute < 0 or percent < 0:
+            raise ValueError(f"Reguła kompresji {rule['metric']}: tolerancja nie może być ujemna")
+        if mode == 'deadband' and not absolute and not percent:
+            raise ValueError(f"Reguła kompresji {rule['metric']}: deadband wymaga 'absolute' lub 'percent'")
+        parsed.append(dict(rule, absolute=absolute, percent=percent, pattern=metric_pattern(rule['metric'])))
+    return parsed
+
+
+def _number(value):
+    """Wartość liczbowa pola jak w export.numeric_value; None dla tekstu i błędów"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value)
+    if "Error" in text or not text.replace('.', '', 1).isdigit():
+        return None
+    return float(text)
+
+
+class SeriesState:
+    """Ostatni zapisany punkt serii; dla swingdoor także drzwi i ostatni odczyt jeszcze niezapisany"""
+
+    __slots__ = ('time', 'value', 'upper', 'lower', 'held_time', 'held_value', 'held_raw')
+
+    def __init__(self):
+        self.time = None
+        self.value = None
+        self.upper = math.inf
+        self.lower = -math.inf
+        self.held_time = None
+        self.held_value = None
+        self.held_raw = None
+
+
+class WriteCompressor:
+    """Kompresja odczytów przed zapisem do InfluxDB.
+
+    Dla pól z regułą (COMPRESSION_RULES) zapisywane są tylko punkty niosące
+    informację: zmiana wartości ('change'), zmiana poza tolerancją
+    ('deadband') albo punkty załamania przebiegu ('swingdoor' - algorytm
+    swinging door, odczyty między zapisanymi punktami leżą na łączącym je
+    odcinku z dokładnością 'absolute').  Co 'heartbeat' sekund seria jest
+    zapisywana niezależnie od zmian, więc przerwa dłuższa niż heartbeat
+    oznacza brak odczytów, a nie stałą wartość.  Historia odtwarza przebieg
+    funkcją fill_gaps.
+    """
+
+    def __init__(self, rules=None, **options):
+        self.options = dict(COMPRESSION_CONFIG, **options)
+        self.rules = parse_rules(COMPRESSION_RULES if rules is None else rules)
+        self._rule_cache = {}
+        # {urządzenie: {pole: SeriesState}}
+        self._series = {}
+        self._lock = threading.Lock()
+        self.stats = {"points_in": 0, "points_out": 0, "heartbeats": 0}
+
+    def rule(self, key):
+        """Pierwsza reguła pasująca do pola albo None (pole zapisywane zawsze)"""
+        try:
+            return self._rule_cache[key]
+        except KeyError:
+            rule = next((r for r in self.rules if r['pattern'].match(key)), None)
+            self._rule_cache[key] = rule
+            return rule
+
+    def filter(self, device, data, timestamp=None):
+        """{znacznik czasu: {pole: wartość}} do zapisu z odczytu 'data'.
+
+        Swingdoor zapisuje punkt załamania z opóźnieniem - z czasem
+        poprzedniego odczytu - stąd kilka znaczników czasu w wyniku.
+        """
+        timestamp = timestamp or time.time()
+        heartbeat = self.options['heartbeat']
+        current = {}
+        out = {timestamp: current}
+        heartbeats = passed = 0
+        with self._lock:
+            series = self._series.setdefault(device, {})
+            for key, raw in data.items():
+                rule = self.rule(key)
+                number = _number(raw) if rule is not None else None
+                if number is None:
+                    current[key] = raw
+                    passed += 1
+                    continue
+                state = series.get(key)
+                if state is None:
+                    state = series[key] = SeriesState()
+                if state.time is not None and timestamp - state.time >= heartbeat:
+                    heartbeats += 1
+                    if rule['mode'] == 'swingdoor' and state.held_time is not None and state.held_time > state.time:
+                        out.setdefault(state.held_time, {})[key] = state.held_raw
+                    self._archive(state, timestamp, number)
+                    current[key] = raw
+                elif rule['mode'] == 'swingdoor':
+                    self._swingdoor(state, rule, key, raw, number, timestamp, out)
+                elif state.time is None or self._outside(rule, number, state.value):
+                    self._archive(state, timestamp, number)
+                    current[key] = raw
+                if rule['mode'] == 'swingdoor':
+                    state.held_time, state.held_value, state.held_raw = timestamp, number, raw
+            # Statystyki dotyczą tylko pól z regułą
+            self.stats["points_in"] += len(data) - passed
+            self.stats["points_out"] += sum(len(fields) for fields in out.values()) - passed
+            self.stats["heartbeats"] += heartbeats
+        if not current:
+            del out[timestamp]
+        return out
+
+    @staticmethod
+    def _outside(rule, number, last):
+        return abs(number - last) > rule['absolute'] + rule['percent'] / 100 * abs(last)
+
+    @staticmethod
+    def _archive(state, timestamp, number):
+        state.time, state.value = timestamp, number
+        state.upper, state.lower = math.inf, -math.inf
+
+    def _swingdoor(self, state, rule, key, raw, number, timestamp, out):
+        if state.time is None:
+            self._archive(state, timestamp, number)
+            out[timestamp][key] = raw
+            return
+        elapsed = timestamp - state.time
+        if elapsed <= 0:
+            return
+        deviation = rule['absolute'] + rule['percent'] / 100 * abs(state.value)
+        upper = min(state.upper, (number + deviation - state.value) / elapsed)
+        lower = max(state.lower, (number - deviation - state.value) / elapsed)
+        if lower <= upper:
+            state.upper, state.lower = upper, lower
+            return
+        # Drzwi się rozwarły - poprzedni odczyt jest ostatnim punktem odcinka i początkiem następnego
+        out.setdefault(state.held_time, {})[key] = state.held_raw
+        self._archive(state, state.held_time, state.held_value)
+        elapsed = timestamp - state.time
+        state.upper = (number + deviation - state.value) / elapsed
+        state.lower = (number - deviation - state.value) / elapsed
+
+    def forget(self, device):
+        """Zwalnia stan usuniętego urządzenia"""
+        with self._lock:
+            self._series.pop(device, None)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["series"] = sum(len(series) for series in self._series.values())
+        stats["ratio"] = round(stats["points_out"] / stats["points_in"], 4) if stats["points_in"] else None
+        return stats
+
+
+_compressor = None
+_compressor_lock = threading.Lock()
+
+def get_compressor():
+    """Współdzielony kompresor procesu albo None, gdy kompresja jest wyłączona"""
+    global _compressor
+    if not COMPRESSION_CONFIG['enabled']:
+        return None
+    with _compressor_lock:
+        if _compressor is None:
+            _compressor = WriteCompressor()
+        return _compressor
+
+
+# Odtwarzanie przebiegu w historii
+
+_fill_rules = None
+
+def fill_mode(metric):
+    """'step', 'linear' albo None (pole bez kompresji) wg COMPRESSION_RULES"""
+    global _fill_rules
+    if not COMPRESSION_CONFIG['enabled']:
+        return None
+    if _fill_rules is None:
+        _fill_rules = parse_rules(COMPRESSION_RULES)
+    rule = next((r for r in _fill_rules if r['pattern'].match(metric)), None)
+    return FILLS[rule['mode']] if rule else None
+
+
+def lookback(metrics, interval):
+    """O ile wcześniej zaczynać zapytanie, żeby przedział startowy miał ostatni zapisany punkt (0 bez kompresji)"""
+    if not any(fill_mode(m) for m in metrics):
+        return 0
+    return int(math.ceil((COMPRESSION_CONFIG['heartbeat'] + interval) / interval)) * interval
+
+
+def fill_gaps(timestamps, values, start, end, interval, hold):
+    """Uzupełnia przedziały bez zapisów w historii pól kompresowanych.
+
+    Wartość trwa (step) albo leży na odcinku między sąsiednimi punktami
+    (linear) najwyżej 'hold' sekund od ostatniego punktu - dłuższa przerwa
+    to brak odczytów i zostaje pusta.  Wynik obejmuje przedziały od tego,
+    w którym leży 'start', do 'end'; przedziały bez żadnej wartości są pomijane.
+    """
+    modes = {metric: fill_mode(metric) for metric in values}
+    first = start - start % interval
+    grid = range(first, end, interval)
+    columns = {}
+    for metric, column in values.items():
+        known = [(t, v) for t, v in zip(timestamps, column) if v is not None]
+        times = [t for t, _ in known]
+        mode = modes[metric]
+        filled = []
+        for t in grid:
+            i = bisect.bisect_right(times, t) - 1
+            if i < 0 or (not mode and times[i] != t) or t - times[i] > hold:
+                filled.append(None)
+                continue
+            t0, v0 = known[i]
+            if mode == 'linear' and t > t0 and i + 1 < len(known) and known[i + 1][0] - t0 <= hold:
+                t1, v1 = known[i + 1]
+                v0 += (v1 - v0) * (t - t0) / (t1 - t0)
+            filled.append(v0)
+        columns[metric] = filled
+
+    rows = [i for i in range(len(grid)) if any(column[i] is not None for column in columns.values())]
+    return [grid[i] for i in rows], {metric: [column[i] for i in rows] for metric, column in columns.items()}
@@ -11,6 +11,7 @@ SNMP_CONFIG = {
     'auth_password': os.getenv('SNMP_AUTH_PASSWORD', 'snmpauth123'),
     'priv_password': os.getenv('SNMP_PRIV_PASSWORD', 'snmppriv123'),
     'context_name': os.getenv('SNMP_CONTEXT_NAME', 'router'),
+    'max_oids_per_pdu': int(os.getenv('SNMP_MAX_OIDS_PER_PDU', 30)),
     
     # Aliasy kluczy dla zgodności z biblioteką pysnmp
     'auth_key': os.getenv('SNMP_AUTH_PASSWORD', 'snmpauth123'),
@@ -22,6 +23,207 @@ SNMP_CONFIG = {
     'influx_db': os.getenv('INFLUX_DB', 'snmp_data')
 }
 
+# Buforowany zapis do InfluxDB
+INFLUX_WRITER_CONFIG = {
+    'batch_size': int(os.getenv('INFLUX_BATCH_SIZE', 5000)),            # Maks. liczba punktów w jednym zapisie
+    'flush_interval': float(os.getenv('INFLUX_FLUSH_INTERVAL', 5.0)),   # Maks. czas oczekiwania na zapis [s]
+    'max_buffer': int(os.getenv('INFLUX_MAX_BUFFER', 200000)),          # Limit punktów w pamięci
+    'max_retries': int(os.getenv('INFLUX_MAX_RETRIES', 3)),
+    'retry_backoff': float(os.getenv('INFLUX_RETRY_BACKOFF', 0.5)),     # Początkowe opóźnienie ponowienia [s]
+    'retry_backoff_max': float(os.getenv('INFLUX_RETRY_BACKOFF_MAX', 10.0)),
+    'timeout': float(os.getenv('INFLUX_TIMEOUT', 5.0)),
+    'spool_path': os.getenv('INFLUX_SPOOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool', 'influx.lp')),
+    'spool_max_bytes': int(os.getenv('INFLUX_SPOOL_MAX_BYTES', 512 * 1024 * 1024)),
+}
+
+# Konfiguracja pollera asynchronicznego
+POLLER_CONFIG = {
+    'concurrency': int(os.getenv('POLLER_CONCURRENCY', 100)),   # Maks. liczba urządzeń odpytywanych naraz
+    'timeout': float(os.getenv('POLLER_TIMEOUT', 1.0)),         # Timeout pojedynczego zapytania [s]
+    'retries': int(os.getenv('POLLER_RETRIES', 1)),             # Liczba ponowień zapytania
+    'interval': float(os.getenv('POLLER_INTERVAL', 10)),        # Okres odpytywania urządzenia [s]
+    'jitter': float(os.getenv('POLLER_JITTER', 0.1)),           # Losowe rozrzucenie okresu (ułamek)
+    'max_oids_per_pdu': SNMP_CONFIG['max_oids_per_pdu'],
+    'max_repetitions': int(os.getenv('POLLER_MAX_REPETITIONS', 25)),  # max-repetitions zapytań GETBULK
+    'discovery': os.getenv('POLLER_DISCOVERY', 'false').lower() == 'true',  # Odkrywanie interfejsów z ifTable
+    'repoll_min_interval': float(os.getenv('POLLER_REPOLL_MIN_INTERVAL', 1.0)),  # Min. odstęp odpytań wymuszonych trapem [s]
+    'failure_threshold': int(os.getenv('POLLER_FAILURE_THRESHOLD', 3)),  # Kolejne timeouty otwierające wyłącznik urządzenia
+    'backoff_max': float(os.getenv('POLLER_BACKOFF_MAX', 300)),  # Maks. odstęp prób przy niedostępnym urządzeniu [s]
+    'workers': int(os.getenv('POLLER_WORKERS', 1)),             # Procesy pollera; >1 dzieli inwentarz na shardy
+    'worker_restart_delay': float(os.getenv('POLLER_WORKER_RESTART_DELAY', 1.0)),  # Opóźnienie restartu procesu [s], rośnie x2
+    'worker_max_restarts': int(os.getenv('POLLER_WORKER_MAX_RESTARTS', 5)),  # Restarty w 5 min, potem urządzenia idą do innych shardów
+}
+
+# Grupy OID odpytywane z własnym okresem [s]; klucze OIDS spoza grup (w tym tabela
+# interfejsów przy odkrywaniu) należą do grupy 'default' z okresem POLLER_CONFIG['interval']
+POLL_GROUPS = {
+    'inventory': {
+        'interval': float(os.getenv('POLL_INVENTORY_INTERVAL', 3600)),
+        'keys': ['sysName', 'sysDescr', 'sysContact', 'sysLocation'],
+    },
+}
+
+# Pamięć podręczna kluczy USM i engineID agentów (SNMPv3)
+USM_CACHE_CONFIG = {
+    'path': os.getenv('USM_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'usm.json')),
+    'persist': os.getenv('USM_CACHE_PERSIST', 'false').lower() == 'true',  # Zapis kluczy głównych na dysk (odpowiednik haseł)
+    'persist_engines': os.getenv('USM_CACHE_PERSIST_ENGINES', 'true').lower() == 'true',  # Zapis engineID i czasu agentów
+    'save_interval': float(os.getenv('USM_CACHE_SAVE_INTERVAL', 60)),      # Min. odstęp między zapisami [s]
+    'engine_ttl': float(os.getenv('USM_CACHE_ENGINE_TTL', 86400)),         # Ważność zapamiętanego engineID [s]
+}
+
+# Migawka skompilowanych modułów MIB pysnmp (szybsze tworzenie SnmpEngine)
+MIB_SNAPSHOT_CONFIG = {
+    'enabled': os.getenv('MIB_SNAPSHOT_ENABLED', 'true').lower() == 'true',
+    'path': os.getenv('MIB_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'mib_snapshot.bin')),
+    'persist': os.getenv('MIB_SNAPSHOT_PERSIST', 'true').lower() == 'true',
+}
+
+# Szybki koder BER dla PDU SNMPv3 (ScopedPDU); nietypowe wiadomości idą przez pyasn1
+BER_CODEC_CONFIG = {
+    'enabled': os.getenv('BER_CODEC_ENABLED', 'true').lower() == 'true',
+}
+
+# Ostatnie odczyty w pamięci (bufory cykliczne) - historia z tego okna nie wymaga InfluxDB
+RECENT_HISTORY_CONFIG = {
+    'enabled': os.getenv('RECENT_HISTORY_ENABLED', 'true').lower() == 'true',
+    'window': float(os.getenv('RECENT_HISTORY_WINDOW', 3600)),     # Okno trzymane w pamięci [s]
+    'headroom': float(os.getenv('RECENT_HISTORY_HEADROOM', 0.25)),  # Zapas pojemności na odpytania wymuszone (ułamek)
+}
+
+# Endpoint /metrics (format tekstowy Prometheusa)
+METRICS_CONFIG = {
+    'stage_timing': os.getenv('METRICS_STAGE_TIMING', 'true').lower() == 'true',  # Histogramy etapów odpytania w pysnmp
+}
+
+# Polityki przechowywania w InfluxDB: surowe odczyty i zagregowane poziomy (rollup)
+RETENTION_CONFIG = {
+    'enabled': os.getenv('RETENTION_ENABLED', 'true').lower() == 'true',
+    'raw_policy': os.getenv('RETENTION_RAW_POLICY', 'autogen'),     # Polityka surowych odczytów (domyślna bazy)
+    'raw_duration': os.getenv('RETENTION_RAW', '7d'),               # Czas przechowania surowych odczytów
+    'rollups': os.getenv('RETENTION_ROLLUPS', '1m:90d,1h:730d'),    # rozdzielczość:czas przechowania, od najdrobniejszej
+    'mode': os.getenv('RETENTION_ROLLUP_MODE', 'cq'),               # 'cq' - continuous queries InfluxDB, 'job' - zadanie backendu
+    'interval': float(os.getenv('RETENTION_INTERVAL', 60)),         # Okres zadania zwijania i ponawiania konfiguracji [s]
+    'backfill_chunk': os.getenv('RETENTION_BACKFILL_CHUNK', '1d'),  # Zakres jednego zapytania przy uzupełnianiu poziomu
+}
+
+# Współdzielona pamięć podręczna zapytań historii (/api/history, raporty PDF)
+HISTORY_CACHE_CONFIG = {
+    'enabled': os.getenv('HISTORY_CACHE_ENABLED', 'true').lower() == 'true',
+    'max_bytes': int(os.getenv('HISTORY_CACHE_MAX_BYTES', 64 * 1024 * 1024)),  # Limit przybliżonego rozmiaru wyników [B]
+    'ttl': float(os.getenv('HISTORY_CACHE_TTL', POLLER_CONFIG['interval'])),   # Okno ważności wyniku - domyślnie okres pollera [s]
+    'settle': float(os.getenv('HISTORY_CACHE_SETTLE', 30)),   # Końcówka pobierana ponownie przy przesuwaniu okna (spóźnione zapisy) [s]
+}
+
+# Raporty PDF
+REPORT_CONFIG = {
+    'hours': int(os.getenv('REPORT_HOURS', 1)),                 # Domyślne okno historii raportu [h]
+    'points': int(os.getenv('REPORT_POINTS', 60)),              # Liczba punktów wykresu (agregacja w InfluxDB)
+    'table_rows': int(os.getenv('REPORT_TABLE_ROWS', 20)),      # Wiersze tabeli pomiarów
+    'workers': int(os.getenv('REPORT_WORKERS', os.cpu_count() or 2)),  # Procesy renderujące wykresy
+    'cache_ttl': float(os.getenv('REPORT_CACHE_TTL', 60)),      # Ważność gotowego raportu [s]
+    'cache_size': int(os.getenv('REPORT_CACHE_SIZE', 32)),      # Maks. liczba raportów w pamięci
+}
+
+# Eksport historii do CSV/NDJSON (/export/metrics) - strumieniowo, stała pamięć niezależnie od zakresu
+BULK_EXPORT_CONFIG = {
+    'window': os.getenv('BULK_EXPORT_WINDOW', '1d'),               # Zakres czasu jednego zapytania do InfluxDB
+    'chunk_size': int(os.getenv('BULK_EXPORT_CHUNK_SIZE', 10000)),  # Punktów w jednej porcji odpowiedzi (chunked=true)
+    'buffer_bytes': int(os.getenv('BULK_EXPORT_BUFFER', 65536)),    # Porcja danych wysyłana klientowi [B]
+    'gzip_level': int(os.getenv('BULK_EXPORT_GZIP_LEVEL', 6)),      # Stopień kompresji gzip (gdy klient ją akceptuje)
+}
+
+# Odbiornik powiadomień SNMP (trap v1/v2c, inform v2c/v3)
+TRAP_CONFIG = {
+    'enabled': os.getenv('TRAP_ENABLED', 'false').lower() == 'true',
+    'host': os.getenv('TRAP_HOST', '0.0.0.0'),
+    'port': int(os.getenv('TRAP_PORT', 162)),
+    'community': os.getenv('TRAP_COMMUNITY', 'public'),
+    'workers': int(os.getenv('TRAP_WORKERS', 4)),             # Wątki dekodujące powiadomienia
+    'queue_size': int(os.getenv('TRAP_QUEUE_SIZE', 10000)),   # Limit kolejki; nadmiar jest odrzucany
+    'batch_size': int(os.getenv('TRAP_BATCH_SIZE', 64)),      # Datagramy dekodowane w jednym zadaniu
+    'recent_events': int(os.getenv('TRAP_RECENT_EVENTS', 500)),
+    'socket_buffer': int(os.getenv('TRAP_SOCKET_BUFFER', 4 * 1024 * 1024)),  # SO_RCVBUF gniazda UDP [B]
+}
+
+# Silnik reguł alarmowych
+ALERT_CONFIG = {
+    'interval': float(os.getenv('ALERT_INTERVAL', 1.0)),        # Okres oceny reguł [s]
+    'stale_after': float(os.getenv('ALERT_STALE_AFTER', 3 * POLLER_CONFIG['interval'])),  # Seria bez odczytu nie utrzymuje alarmu [s]
+    'recent_events': int(os.getenv('ALERT_RECENT_EVENTS', 500)),
+}
+
+# Reguły alarmowe; '*' w nazwie pola dopasowuje numer interfejsu (instancja alertu)
+ALERT_RULES = [
+    {'name': 'cpu_high', 'metric': 'cpuUsage', 'type': 'threshold', 'op': '>', 'value': 80,
+     'for': 30, 'severity': 'warning'},
+    {'name': 'link_down', 'metric': 'if*_Status', 'type': 'threshold', 'op': '==', 'value': 2,
+     'severity': 'critical'},
+    {'name': 'link_flapping', 'metric': 'if*_Status', 'type': 'flapping', 'changes': 4, 'window': 300,
+     'severity': 'warning'},
+    {'name': 'if_errors_rising', 'metric': 'if*_ErrIn', 'type': 'rate', 'op': '>', 'value': 10,
+     'for': 60, 'severity': 'warning'},
+]
+
+# Kompresja zapisu do InfluxDB (reguły w COMPRESSION_RULES)
+COMPRESSION_CONFIG = {
+    'enabled': os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true',
+    'heartbeat': float(os.getenv('COMPRESSION_HEARTBEAT', 600)),  # Wymuszony zapis serii co N s - dłuższa przerwa to brak odczytów
+}
+
+# Reguły kompresji wg pola odczytu (pierwsza pasująca; '*' - numer interfejsu); pola bez reguły są zapisywane zawsze
+#   change    - zapis tylko zmienionej wartości,
+#   deadband  - zapis po zmianie większej niż 'absolute' lub 'percent' % ostatniej zapisanej wartości,
+#   swingdoor - zapis punktów załamania przebiegu; odczyty między nimi leżą na odcinku z dokładnością 'absolute'
+COMPRESSION_RULES = [
+    {'metric': 'sysUpTime', 'mode': 'swingdoor', 'absolute': 100},   # setne części sekundy
+    {'metric': 'ramTotal', 'mode': 'change'},
+    {'metric': 'ramFree', 'mode': 'deadband', 'percent': 1},
+    {'metric': 'ramUsage', 'mode': 'deadband', 'absolute': 0.5},
+    {'metric': 'cpuUsage', 'mode': 'deadband', 'absolute': 1},
+    {'metric': 'if*_Status', 'mode': 'change'},
+    {'metric': 'if*_ErrIn', 'mode': 'swingdoor', 'absolute': 0},
+    {'metric': 'if*_ErrOut', 'mode': 'swingdoor', 'absolute': 0},
+]
+
+# Wykrywanie anomalii względem kroczących wzorców serii (EWMA średniej i wariancji)
+ANOMALY_CONFIG = {
+    'enabled': os.getenv('ANOMALY_ENABLED', 'true').lower() == 'true',
+    # Metryki z wzorcem; '*' dopasowuje numer interfejsu, ':rate' - zmiana licznika na sekundę
+    'metrics': os.getenv('ANOMALY_METRICS', 'cpuUsage,ramUsage,if*_InBps,if*_OutBps,if*_ErrIn:rate,if*_ErrOut:rate'),
+    'interval': float(os.getenv('ANOMALY_INTERVAL', POLLER_CONFIG['interval'])),  # Okres oceny - cykl odpytań [s]
+    'halflife': float(os.getenv('ANOMALY_HALFLIFE', 3600)),       # Czas połowicznego zaniku wzorca [s]
+    'threshold': float(os.getenv('ANOMALY_THRESHOLD', 4.0)),      # |z| otwierające anomalię
+    'clear': float(os.getenv('ANOMALY_CLEAR', 3.0)),              # |z| kończące anomalię
+    'warmup': int(os.getenv('ANOMALY_WARMUP', 30)),               # Odczyty serii przed pierwszą oceną
+    'min_std': float(os.getenv('ANOMALY_MIN_STD', 1.0)),          # Dolna granica odchylenia (w jednostkach metryki)
+    'min_std_ratio': float(os.getenv('ANOMALY_MIN_STD_RATIO', 0.05)),  # Dolna granica odchylenia jako ułamek średniej
+    'seasonal': os.getenv('ANOMALY_SEASONAL', 'false').lower() == 'true',  # Osobny wzorzec dla każdej godziny doby
+    'seasonal_halflife': float(os.getenv('ANOMALY_SEASONAL_HALFLIFE', 7 * 86400)),  # Zanik wzorca godzinowego [s]
+    'stale_after': float(os.getenv('ANOMALY_STALE_AFTER', 3 * POLLER_CONFIG['interval'])),  # Seria bez odczytu kończy anomalię [s]
+    'write': os.getenv('ANOMALY_WRITE', 'all'),                   # Zapis do InfluxDB: 'all', 'anomalies' albo 'none'
+    'recent_events': int(os.getenv('ANOMALY_RECENT_EVENTS', 500)),
+}
+
+# Inwentarz urządzeń z pliku JSON lub katalogu plików *.json (format w inventory.py)
+INVENTORY_CONFIG = {
+    'path': os.getenv('INVENTORY_PATH', ''),                          # Pusta ścieżka - urządzenia z DEVICES
+    'watch_interval': float(os.getenv('INVENTORY_WATCH_INTERVAL', 5)),  # Okres sprawdzania zmian plików [s]; 0 wyłącza
+}
+
+# Inwentarz urządzeń - domyślnie jedno urządzenie z SNMP_CONFIG
+DEVICES = [
+    {
+        'name': SNMP_CONFIG['host'],
+        'host': SNMP_CONFIG['host'],
+        'port': SNMP_CONFIG['port'],
+        'username': SNMP_CONFIG['username'],
+        'auth_key': SNMP_CONFIG['auth_key'],
+        'priv_key': SNMP_CONFIG['priv_key'],
+        'context_name': SNMP_CONFIG['context_name'],
+    }
+]
+
 
 # Definicje OID dla urządzeń Cisco
 OIDS = {
@@ -44,6 +246,8 @@ OIDS = {
     "if1_Out": "1.3.6.1.2.1.2.2.1.16.1",
     "if1_ErrIn": "1.3.6.1.2.1.2.2.1.14.1",   # Błędy wejścia 
     "if1_ErrOut": "1.3.6.1.2.1.2.2.1.20.1",  # Błędy wyjścia 
+    "if1_HCIn": "1.3.6.1.2.1.31.1.1.1.6.1",   # Liczniki 64-bit (ifXTable), jeśli agent je udostępnia
+    "if1_HCOut": "1.3.6.1.2.1.31.1.1.1.10.1",
 
     # Interfejs 2 (GigabitEthernet0/1) 
     "if2_Name": "1.3.6.1.2.1.2.2.1.2.2",
@@ -51,5 +255,7 @@ OIDS = {
     "if2_In": "1.3.6.1.2.1.2.2.1.10.2",
     "if2_Out": "1.3.6.1.2.1.2.2.1.16.2",
     "if2_ErrIn": "1.3.6.1.2.1.2.2.1.14.2",   # Błędy wejścia 
-    "if2_ErrOut": "1.3.6.1.2.1.2.2.1.20.2"   # Błędy wyjścia 
+    "if2_ErrOut": "1.3.6.1.2.1.2.2.1.20.2",  # Błędy wyjścia 
+    "if2_HCIn": "1.3.6.1.2.1.31.1.1.1.6.2",
+    "if2_HCOut": "1.3.6.1.2.1.31.1.1.1.10.2"
 }
\ No newline at end of file
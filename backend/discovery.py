@@ -0,0 +1,127 @@
+import re
+import time
+import logging
+
+logger = logging.getLogger("SNMP-Discovery")
+
+SYS_UPTIME = "1.3.6.1.2.1.1.3.0"
+IF_TABLE_LAST_CHANGE = "1.3.6.1.2.1.31.1.5.0"   # IF-MIB::ifTableLastChange
+
+# Kolumny opisujące interfejsy - odczytywane tylko przy odkrywaniu
+NAME_COLUMNS = {
+    "Descr": "1.3.6.1.2.1.2.2.1.2",      # ifDescr
+    "Name": "1.3.6.1.2.1.31.1.1.1.1",    # ifName (ifXTable)
+}
+
+# Kolumny liczników - odczytywane przy każdym odpytaniu
+COUNTER_COLUMNS = {
+    "Status": "1.3.6.1.2.1.2.2.1.8",     # ifOperStatus
+    "In": "1.3.6.1.2.1.2.2.1.10",        # ifInOctets
+    "ErrIn": "1.3.6.1.2.1.2.2.1.14",     # ifInErrors
+    "Out": "1.3.6.1.2.1.2.2.1.16",       # ifOutOctets
+    "ErrOut": "1.3.6.1.2.1.2.2.1.20",    # ifOutErrors
+    "HCIn": "1.3.6.1.2.1.31.1.1.1.6",    # ifHCInOctets
+    "HCOut": "1.3.6.1.2.1.31.1.1.1.10",  # ifHCOutOctets
+}
+
+# ENTITY-MIB::entPhysicalName - fizyczne elementy urządzenia (moduły, porty)
+ENTITY_COLUMNS = {
+    "entName": "1.3.6.1.2.1.47.1.1.1.1.7",
+}
+
+# Klucze interfejsów z config.OIDS zastępowane przez odkrywanie
+INTERFACE_KEY_RE = re.compile(r'^if\d+_')
+
+
+def _clean(value):
+    return str(value).replace('\x00', '').strip()
+
+
+class InterfaceDiscovery:
+    """Odkrywanie interfejsów przez przejście ifTable/ifXTable i cykliczny odczyt kolumn liczników.
+
+    Mapa indeksów jest trzymana per urządzenie i odświeżana tylko po zmianie
+    ifTableLastChange albo restarcie agenta (spadek sysUpTime).
+    """
+
+    def __init__(self, poller, max_repetitions=None):
+        self.poller = poller
+        self.max_repetitions = max_repetitions
+        self._cache = {}
+        self.discoveries = 0
+
+    def scalar_oids(self, oids):
+        """OID skalarne odpytywane przez GET w trybie odkrywania"""
+        scalars = {k: v for k, v in oids.items() if not INTERFACE_KEY_RE.match(k)}
+        scalars.setdefault("sysUpTime", SYS_UPTIME)
+        scalars["ifTableLastChange"] = IF_TABLE_LAST_CHANGE
+        return scalars
+
+    def needs_refresh(self, name, uptime, last_change):
+        entry = self._cache.get(name)
+        if entry is None:
+            return True
+        if uptime is not None and entry["uptime"] is not None and uptime < entry["uptime"]:
+            return True
+        return last_change != entry["last_change"]
+
+    async def discover(self, device, uptime=None, last_change=None):
+        """Pełne przejście tabel opisujących interfejsy i encje"""
+        started = time.perf_counter()
+        columns = await self.poller.walk(device, dict(NAME_COLUMNS, **ENTITY_COLUMNS), self.max_repetitions)
+
+        interfaces = {}
+        for index, descr in columns["Descr"].items():
+            interfaces[index] = _clean(columns["Name"].get(index) or descr)
+        for index, name in columns["Name"].items():
+            interfaces.setdefault(index, _clean(name))
+
+        entry = {
+            "interfaces": dict(sorted(interfaces.items(), key=lambda item: [int(x) for x in item[0].split('.')])),
+            "entities": {index: _clean(v) for index, v in columns["entName"].items()},
+            "uptime": uptime,
+            "last_change": last_change,
+            "discovered_at": time.time(),
+            "duration": time.perf_counter() - started,
+        }
+        self._cache[device["name"]] = entry
+        self.discoveries += 1
+        logger.info(f"Odkryto {len(interfaces)} interfejsów na {device['name']} w {entry['duration'] * 1000:.0f} ms")
+        return entry
+
+    async def poll(self, device, scalars):
+        """Zwraca pola ifN_* dla odkrytych interfejsów na podstawie odczytu kolumn liczników"""
+        uptime = _to_int(scalars.get("sysUpTime"))
+        last_change = scalars.get("ifTableLastChange")
+        if self.needs_refresh(device["name"], uptime, last_change):
+            entry = await self.discover(device, uptime, last_change)
+        else:
+            entry = self._cache[device["name"]]
+            entry["uptime"] = uptime
+
+        interfaces = entry["interfaces"]
+        # Przy znanej liczbie wierszy jedno zapytanie GETBULK zwykle wystarcza
+        repetitions = max(1, min(len(interfaces) or 1, self.max_repetitions or self.poller.options['max_repetitions']))
+        columns = await self.poller.walk(device, COUNTER_COLUMNS, repetitions)
+
+        data = {}
+        for index, name in interfaces.items():
+            data[f"if{index}_Name"] = name
+            for column, values in columns.items():
+                if index in values:
+                    data[f"if{index}_{column}"] = str(values[index])
+        return data
+
+    def interfaces(self, name):
+        entry = self._cache.get(name)
+        return dict(entry["interfaces"]) if entry else {}
+
+    def forget(self, name):
+        self._cache.pop(name, None)
+
+
+def _to_int(value):
+    try:
+        return int(str(value))
+    except (TypeError, ValueError):
+        return None
@@ -1,41 +1,304 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import deque
 from influxdb import InfluxDBClient
-from config import SNMP_CONFIG
+from prometheus import influx_write_seconds
+from compression import get_compressor
+from config import SNMP_CONFIG, INFLUX_WRITER_CONFIG
 
-def export_to_influxdb(data):
-    """Wysyła dane numeryczne do bazy InfluxDB"""
-    if not data:
-        return
+logger = logging.getLogger("SNMP-Export")
+
+
+def escape_tag(value):
+    """Escapowanie wartości tagu w line protocol"""
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def numeric_value(value):
+    """Wartość zapisywana do bazy (liczba nieujemna) albo None dla pól tekstowych i błędów"""
+    # Pomijamy wartości błędne i puste
+    if "Error" in str(value) or value == "":
+        return None
+
+    #sprawdzenie czy wartosc to liczba
+    clean_value = str(value).replace('.', '', 1)
+    return float(value) if clean_value.isdigit() else None
+
+
+def numeric_fields(data):
+    """{pole: liczba} - pola odczytu, które trafiają do bazy"""
+    fields = {}
+    for key, value in data.items():
+        value = numeric_value(value)
+        if value is not None:
+            fields[key] = value
+    return fields
+
+
+def build_lines(data, device=None, timestamp=None, measurement="snmp_metrics"):
+    """Zamienia słownik odczytów na linie line protocol (tylko wartości numeryczne)"""
+    timestamp = int((timestamp or time.time()) * 1000)
+    device_tag = f",device={escape_tag(device)}" if device else ""
+    lines = []
+
+    for oid_key, value in data.items():
+        value = numeric_value(value)
+        if value is not None:
+            lines.append(f"{measurement}{device_tag},oid={escape_tag(oid_key)} value={value} {timestamp}")
+    return lines
 
-    try:
-        client = InfluxDBClient(
-            host=SNMP_CONFIG['influx_host'],
-            port=SNMP_CONFIG['influx_port']
+
+class InfluxWriter:
+    """Buforowany zapis do InfluxDB: jedna pula połączeń, paczki wg rozmiaru lub czasu, spool na dysku"""
+
+    def __init__(self, host=None, port=None, database=None, **options):
+        self.options = dict(INFLUX_WRITER_CONFIG, **options)
+        self.database = database or SNMP_CONFIG['influx_db']
+
+        # Klient trzyma requests.Session - połączenia HTTP są współdzielone między zapisami
+        self.client = InfluxDBClient(
+            host=host or SNMP_CONFIG['influx_host'],
+            port=port or SNMP_CONFIG['influx_port'],
+            database=self.database,
+            timeout=self.options['timeout']
         )
-        client.switch_database(SNMP_CONFIG['influx_db'])
-        
-        points = []
-        
-        for oid_key, value in data.items():
-            # Pomijamy wartości błędne i puste
-            if "Error" in str(value) or value == "":
-                continue
 
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Dopisywanie do spoola i jego przejęcie do powtórki wykluczają się
+        self._spool_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._healthy = True
+
+        self.stats = {
+            "points_written": 0,
+            "points_spooled": 0,
+            "points_replayed": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "last_flush_latency": 0.0,
+            "max_flush_latency": 0.0,
+        }
+
+    # Kolejka
+
+    def write(self, lines):
+        """Dodaje linie do bufora; przy pełnym buforze nadmiar trafia od razu do spoola"""
+        if not lines:
+            return
+        overflow = []
+        with self._lock:
+            free = self.options['max_buffer'] - len(self._buffer)
+            if free < len(lines):
+                overflow = lines[max(free, 0):]
+                lines = lines[:max(free, 0)]
+            self._buffer.extend(lines)
+            if len(self._buffer) >= self.options['batch_size']:
+                self._wakeup.notify()
+        if overflow:
+            self._spool(overflow)
+
+    def write_data(self, data, device=None, timestamp=None):
+        self.write(build_lines(data, device, timestamp))
+
+    def queue_depth(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def _take_batch(self):
+        with self._lock:
+            size = min(len(self._buffer), self.options['batch_size'])
+            return [self._buffer.popleft() for _ in range(size)]
+
+    # Wysyłka
+
+    def _send(self, lines):
+        self.client.write_points(lines, protocol='line', time_precision='ms',
+                                 database=self.database, batch_size=self.options['batch_size'])
+
+    def _send_with_retry(self, lines):
+        # Przy niedostępnej bazie nie ponawiamy wielokrotnie - jedna próba i spool
+        attempts = self.options['max_retries'] + 1 if self._healthy else 1
+        delay = self.options['retry_backoff']
+        for attempt in range(attempts):
             try:
-                #sprawdzenie czy wartosc to liczba
-                clean_value = str(value).replace('.', '', 1)
-                
-                if clean_value.isdigit():
-                    point = {
-                        "measurement": "snmp_metrics",
-                        "tags": { "oid": oid_key },
-                        "fields": { "value": float(value) }
-                    }
-                    points.append(point)
-            except ValueError:
-                continue
-        
-        if points:
-            client.write_points(points)
-            
-    except Exception as e:
-        print(f"InfluxDB Error: {e}")
\ No newline at end of file
+                self._send(lines)
+                self._healthy = True
+                return True
+            except Exception as e:
+                self.stats["flush_failures"] += 1
+                logger.warning(f"InfluxDB Error (próba {attempt + 1}/{attempts}): {e}")
+                if attempt + 1 < attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.options['retry_backoff_max'])
+        self._healthy = False
+        return False
+
+    def flush(self):
+        """Wysyła zawartość bufora paczkami; zwraca liczbę zapisanych punktów"""
+        written = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                break
+            start = time.perf_counter()
+            if self._send_with_retry(batch):
+                latency = time.perf_counter() - start
+                influx_write_seconds.observe(latency)
+                written += len(batch)
+                self.stats["points_written"] += len(batch)
+                self.stats["flushes"] += 1
+                self.stats["last_flush_latency"] = latency
+                self.stats["max_flush_latency"] = max(self.stats["max_flush_latency"], latency)
+            else:
+                self._spool(batch)
+                break
+
+        if written and self._healthy:
+            self._replay_spool()
+        return written
+
+    # Spool na dysku
+
+    def _spool(self, lines):
+        path = self.options['spool_path']
+        if not path:
+            logger.error(f"InfluxDB niedostępna, utracono {len(lines)} punktów")
+            return
+        try:
+            with self._spool_lock:
+                if self.spool_size() > self.options['spool_max_bytes']:
+                    logger.error(f"Spool {path} jest pełny, utracono {len(lines)} punktów")
+                    return
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write('\n'.join(lines) + '\n')
+                self.stats["points_spooled"] += len(lines)
+        except OSError as e:
+            logger.error(f"Błąd zapisu spoola: {e}")
+
+    def spool_size(self):
+        """Rozmiar spoola razem z plikiem w trakcie powtórki [B]"""
+        path = self.options['spool_path']
+        if not path:
+            return 0
+        return sum(os.path.getsize(p) for p in (path, path + '.replay') if os.path.exists(p))
+
+    def _replay_spool(self):
+        """Po powrocie bazy dosyła punkty zapisane w spoolu.
+
+        Spool jest przemianowywany pod blokadą na plik '.replay' - nowe punkty
+        trafiają już do świeżego spoola - i czytany paczkami linia po linii.
+        Plik jest usuwany dopiero po wysłaniu całości; przy błędzie zostaje
+        w nim tylko niewysłana reszta.
+        """
+        path = self.options['spool_path']
+        if not path or not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            replay = path + '.replay'
+            # Niedokończona powtórka (błąd bazy, restart procesu) ma pierwszeństwo przed nowym spoolem
+            if not os.path.exists(replay):
+                with self._spool_lock:
+                    if not os.path.exists(path) or not os.path.getsize(path):
+                        return
+                    os.replace(path, replay)
+
+            replayed = 0
+            with open(replay, encoding='utf-8') as f:
+                for batch in self._spool_batches(f):
+                    if not self._send_with_retry(batch):
+                        self._keep_unsent(replay, batch, f)
+                        return
+                    replayed += len(batch)
+                    self.stats["points_replayed"] += len(batch)
+            os.remove(replay)
+            logger.info(f"Dosłano {replayed} punktów ze spoola")
+        except OSError as e:
+            logger.error(f"Błąd odczytu spoola: {e}")
+        finally:
+            self._replay_lock.release()
+
+    def _spool_batches(self, f):
+        batch = []
+        for line in f:
+            line = line.rstrip('\n')
+            if line.strip():
+                batch.append(line)
+            if len(batch) >= self.options['batch_size']:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _keep_unsent(replay, batch, f):
+        """Podmienia plik powtórki na niewysłaną paczkę i resztę pliku - bez ponownego wysyłania wysłanych"""
+        partial = replay + '.tmp'
+        with open(partial, 'w', encoding='utf-8') as out:
+            out.write('\n'.join(batch) + '\n')
+            for line in f:
+                out.write(line)
+        os.replace(partial, replay)
+
+    # Wątek tła
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True, name="influx-writer")
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                if len(self._buffer) < self.options['batch_size']:
+                    self._wakeup.wait(self.options['flush_interval'])
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Błąd zapisu do InfluxDB: {e}")
+
+    def close(self):
+        self._running = False
+        with self._lock:
+            self._wakeup.notify()
+        if self._thread:
+            self._thread.join(timeout=self.options['timeout'])
+            self._thread = None
+        self.flush()
+
+    def metrics(self):
+        return dict(self.stats, queue_depth=self.queue_depth(), spool_bytes=self.spool_size(),
+                    healthy=self._healthy)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Współdzielony writer procesu, uruchamiany przy pierwszym użyciu"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = InfluxWriter().start()
+            atexit.register(_writer.close)
+        return _writer
+
+def export_to_influxdb(data, device=None):
+    """Wysyła dane numeryczne do bazy InfluxDB (po kompresji, jeśli jest włączona)"""
+    if not data:
+        return
+    compressor = get_compressor()
+    if compressor is None:
+        get_writer().write_data(data, device)
+        return
+    for timestamp, fields in compressor.filter(device, data).items():
+        get_writer().write_data(fields, device, timestamp)
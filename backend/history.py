@@ -0,0 +1,194 @@
+import re
+import math
+import time
+from datetime import datetime, timezone
+
+import compression
+
+AGGREGATES = ('mean', 'max', 'min', 'last')
+DEFAULT_METRICS = ('cpuUsage', 'ramUsage')
+MIN_INTERVAL = 10      # Rozdzielczość odczytów pollera [s]
+MAX_POINTS = 5000
+
+_NAME_RE = re.compile(r'^[\w.\-:]+$')
+_DURATION_RE = re.compile(r'^(\d+)([smhdw])$')
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(text):
+    """'30m', '24h', '7d' -> sekundy"""
+    match = _DURATION_RE.match(str(text).strip())
+    if not match:
+        raise ValueError(f"Niepoprawny zakres czasu: {text}")
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def quote(value):
+    """Literał tekstowy InfluxQL"""
+    if not _NAME_RE.match(str(value)):
+        raise ValueError(f"Niepoprawna nazwa: {value}")
+    return "'" + str(value) + "'"
+
+
+def identifier(value):
+    """Nazwa bazy lub polityki przechowywania w zapytaniu InfluxQL (w cudzysłowie)"""
+    if not _NAME_RE.match(str(value)):
+        raise ValueError(f"Niepoprawna nazwa: {value}")
+    return str(value)
+
+
+def choose_interval(start, end, points):
+    """Szerokość przedziału GROUP BY time() dla zadanej liczby punktów"""
+    points = max(1, min(int(points), MAX_POINTS))
+    return max(MIN_INTERVAL, int(math.ceil((end - start) / points)))
+
+
+def build_query(metrics, start, end, interval, agg='mean', device=None, policy=None, field='value'):
+    """Zapytanie GROUP BY time(); 'policy' i 'field' wskazują poziom rollup (retention.RetentionManager)"""
+    if agg not in AGGREGATES:
+        raise ValueError(f"Nieobsługiwana agregacja: {agg}")
+    oid_filter = " OR ".join(f'"oid" = {quote(m)}' for m in metrics)
+    device_filter = f' AND "device" = {quote(device)}' if device else ""
+    measurement = f'"{identifier(policy)}"."snmp_metrics"' if policy else '"snmp_metrics"'
+    return (
+        f'SELECT {agg}("{identifier(field)}") AS "value" FROM {measurement} '
+        f'WHERE ({oid_filter}){device_filter} '
+        f'AND time >= {int(start)}s AND time < {int(end)}s '
+        f'GROUP BY time({interval}s), "oid" fill(none)'
+    )
+
+
+def join_series(result, metrics):
+    """Łączy serie po znaczniku czasu (a nie po indeksie) w tablice kolumnowe"""
+    columns = {m: {} for m in metrics}
+    for (_, tags), points in result.items():
+        oid = (tags or {}).get('oid')
+        if oid in columns:
+            for point in points:
+                if point.get('value') is not None:
+                    columns[oid][point['time']] = point['value']
+
+    timestamps = sorted(set().union(*[c.keys() for c in columns.values()]))
+    return timestamps, {m: [columns[m].get(t) for t in timestamps] for m in metrics}
+
+
+def query_history(client, database, metrics=DEFAULT_METRICS, start=None, end=None,
+                  points=500, agg='mean', device=None, recent=None, retention=None, interval=None):
+    """Zagregowana historia metryk w formacie kolumnowym.
+
+    Z 'recent' (RecentHistoryStore) zakres pokryty przez pamięć jest liczony
+    lokalnie, a InfluxDB dostaje tylko starszą część - granica leży na
+    krawędzi przedziału agregacji, więc żaden punkt nie łączy obu źródeł.
+    Z 'retention' (RetentionManager) zapytanie idzie do najgrubszego poziomu
+    rollup, który daje żądaną liczbę punktów.  Przedziały bez zapisów pól
+    kompresowanych (compression.WriteCompressor) są odtwarzane z sąsiednich
+    punktów, a przerwy dłuższe niż heartbeat zostają puste.  'interval'
+    narzuca przedział agregacji zamiast wyliczanego z 'points' (dociąganie
+    końcówki zakresu w history_cache.HistoryCache).
+    """
+    end = int(time.time() if end is None else end)
+    start = int(end - 86400 if start is None else start)
+    if agg not in AGGREGATES:
+        raise ValueError(f"Nieobsługiwana agregacja: {agg}")
+    metrics = list(metrics)
+    if interval is None:
+        interval = choose_interval(start, end, points)
+    tier = None
+    if retention is not None:
+        tier, interval = retention.choose_tier(start, end, interval)
+
+    # Zakres [start, split) z InfluxDB, [split, end) z pamięci
+    split = end
+    if recent is not None:
+        split = min(end, max(start, int(math.ceil(recent.covered_from(device) / interval)) * interval))
+    timestamps, values = [], {m: [] for m in metrics}
+    partial = False
+
+    if split > start:
+        # Pola kompresowane mają ostatni punkt nawet heartbeat przed początkiem zakresu
+        lookback = compression.lookback(metrics, interval)
+        parts = [(None, 'value', start - lookback, split)]
+        if tier is not None:
+            parts = retention.sources(tier, agg, start - lookback, split, interval)
+        try:
+            for policy, field, part_start, part_end in parts:
+                result = client.query(build_query(metrics, part_start, part_end, interval, agg, device, policy, field),
+                                      database=database, epoch='s')
+                part_times, part_values = join_series(result, metrics)
+                timestamps = timestamps + part_times
+                values = {m: values[m] + part_values[m] for m in metrics}
+            if lookback:
+                timestamps, values = compression.fill_gaps(timestamps, values, start, split, interval, lookback)
+        except Exception:
+            if split >= end:
+                raise
+            # Baza niedostępna - zostaje ostatni okres z pamięci
+            timestamps, values = [], {m: [] for m in metrics}
+            partial = True
+    if split < end:
+        recent_times, recent_values = recent.query(metrics, split, end, interval, agg, device)
+        timestamps = timestamps + recent_times
+        values = {m: values[m] + recent_values[m] for m in metrics}
+
+    source = "influx" if split >= end else "memory" if split == start else "memory+influx"
+    if recent is not None:
+        recent.record_query(source)
+    history = {
+        "device": device,
+        "start": start,
+        "end": end,
+        "interval": interval,
+        "agg": agg,
+        "source": source,
+        "tier": tier["name"] if tier else None,
+        "time": timestamps,
+        "metrics": values,
+    }
+    if partial:
+        history["partial"] = True
+    return history
+
+
+def parse_history_args(args):
+    """Parametry endpointu /api/history z request.args; bez 'device' - średnia wszystkich urządzeń"""
+    end = int(args.get('end') or time.time())
+    if args.get('start'):
+        start = int(args['start'])
+    else:
+        start = end - parse_duration(args.get('range', '24h'))
+    if start >= end:
+        raise ValueError("Początek zakresu musi być przed końcem")
+
+    metrics = [m for m in args.get('metrics', ','.join(DEFAULT_METRICS)).split(',') if m]
+    if not metrics:
+        raise ValueError("Podaj co najmniej jedną metrykę")
+    for m in metrics:
+        quote(m)
+    agg = args.get('agg', 'mean')
+    if agg not in AGGREGATES:
+        raise ValueError(f"Nieobsługiwana agregacja: {agg}")
+    return {
+        "metrics": metrics,
+        "start": start,
+        "end": end,
+        "points": int(args.get('points', 500)),
+        "agg": agg,
+        "device": args.get('device') or None,
+    }
+
+
+def to_rows(history):
+    """Format wierszowy (timestamp + data) używany przez raport PDF"""
+    rows = []
+    metrics = history["metrics"]
+    cpu = metrics.get('cpuUsage', ())
+    for i, ts in enumerate(history["time"]):
+        # Serie mogą być krótsze niż oś czasu (brak metryki w wyniku) - brakujące wartości jak None
+        if i >= len(cpu) or cpu[i] is None:
+            continue
+        timestamp = datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        rows.append({
+            'timestamp': timestamp,
+            'data': {m: (values[i] if i < len(values) and values[i] is not None else 0) for m, values in metrics.items()}
+        })
+    return rows
@@ -0,0 +1,209 @@
+import math
+import time
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+
+from history import query_history, choose_interval, DEFAULT_METRICS
+from config import HISTORY_CACHE_CONFIG
+
+logger = logging.getLogger("SNMP-HistoryCache")
+
+# Przybliżony koszt jednej wartości wyniku w pamięci (obiekt liczby + wskaźnik listy) [B]
+VALUE_BYTES = 36
+
+
+def history_size(history):
+    return 256 + len(history["time"]) * (1 + len(history["metrics"])) * VALUE_BYTES
+
+
+class _Flight:
+    """Zapytanie w toku - identyczne żądania czekają na jego wynik zamiast pytać bazę"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class HistoryCache:
+    """Współdzielone wyniki query_history dla dashboardów i raportów.
+
+    Koniec zakresu jest wyrównywany w górę do okna 'ttl' (domyślnie okres
+    pollera), a początek do przedziału agregacji, więc wszystkie żądania
+    tego samego kształtu (metryki, urządzenie, agregacja, długość zakresu,
+    liczba punktów) w jednym oknie mają ten sam klucz i wynik ważny do
+    końca okna; każde żądanie dostaje z niego tylko przedziały swojego
+    zakresu.  Równoczesne identyczne żądania czekają na jedno zapytanie
+    (single-flight).  W kolejnym oknie wynik poprzedniego jest przesuwany:
+    z bazy pobierana jest tylko końcówka od 'settle' sekund przed pobraniem
+    poprzedniego wyniku.  Wpisy są usuwane od najdawniej używanych, gdy
+    przybliżony rozmiar przekroczy 'max_bytes'.
+    """
+
+    def __init__(self, client, database, recent=None, retention=None, **options):
+        self.options = dict(HISTORY_CACHE_CONFIG, **options)
+        self.client = client
+        self.database = database
+        self.recent = recent
+        self.retention = retention
+        # {(kształt, koniec): wpis} w kolejności użycia
+        self._entries = OrderedDict()
+        # {kształt: klucz najnowszego wpisu} - podstawa przesuwania okna
+        self._live = {}
+        self._flights = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "extended": 0, "uncached": 0, "evictions": 0}
+
+    def _align(self, start, end, points):
+        """(start, end, interval) wyrównane do okna ważności i przedziału agregacji.
+
+        Zakres obejmuje wszystkie żądania okna: od początku najwcześniejszego
+        (koniec tuż po początku okna) do wyrównanego końca.
+        """
+        ttl = self.options['ttl']
+        duration = end - start
+        first = start
+        if ttl > 0:
+            end = int((math.floor(end / ttl) + 1) * ttl)
+            first = int(end - ttl - duration)
+        interval = choose_interval(end - duration, end, points)
+        if self.retention is not None:
+            _, interval = self.retention.choose_tier(end - duration, end, interval)
+        return first // interval * interval, end, interval
+
+    def _query(self, metrics, start, end, interval, agg, device):
+        return query_history(self.client, self.database, metrics=metrics, start=start, end=end, agg=agg,
+                             device=device, recent=self.recent, retention=self.retention, interval=interval)
+
+    def query(self, metrics=DEFAULT_METRICS, start=None, end=None, points=500, agg='mean', device=None):
+        """(historia, status); status: 'hit', 'coalesced', 'extended', 'miss' albo 'uncached'"""
+        end = int(time.time() if end is None else end)
+        start = int(end - 86400 if start is None else start)
+        metrics = list(metrics)
+        shape = (tuple(sorted(set(metrics))), device, agg, end - start, int(points))
+        requested = (start, end)
+        start, end, interval = self._align(start, end, points)
+        key = (shape, end)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() < entry["expires"]:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._view(entry["history"], metrics, *requested), 'hit'
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                base = self._entries.get(self._live.get(shape))
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._view(flight.result, metrics, *requested), 'coalesced'
+
+        # Przedziały późniejsze niż moment zapytania mogą jeszcze nie mieć zapisów
+        fetched_at = time.time()
+        try:
+            history, status = self._fetch(list(shape[0]), start, end, interval, agg, device, base)
+            flight.result = history
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+        if history.get("partial"):
+            # Baza niedostępna - wynik z samej pamięci nie trafia do współdzielonej kopii
+            status = 'uncached'
+        else:
+            self._store(key, shape, start, interval, history, fetched_at)
+        with self._lock:
+            self.stats["misses" if status == 'miss' else status] += 1
+        return self._view(history, metrics, *requested), status
+
+    def _fetch(self, metrics, start, end, interval, agg, device, base):
+        if base is None or base["interval"] != interval or not start < base["end"] < end:
+            return self._query(metrics, start, end, interval, agg, device), 'miss'
+
+        # Przesunięte okno: poprzedni wynik bez początku + końcówka z bazy od chwili
+        # pobrania poprzedniego wyniku (koniec okna bywa późniejszy niż zapytanie)
+        fresh_until = min(base["end"], base["fetched_at"])
+        tail_start = max(start, int((fresh_until - self.options['settle']) // interval) * interval)
+        tail = self._query(metrics, tail_start, end, interval, agg, device)
+        old = base["history"]
+        first = bisect.bisect_left(old["time"], start)
+        last = bisect.bisect_left(old["time"], tail_start)
+        history = dict(tail, start=start, end=end, time=old["time"][first:last] + tail["time"],
+                       metrics={m: old["metrics"][m][first:last] + tail["metrics"][m] for m in metrics})
+        if old["source"] != tail["source"]:
+            history["source"] = "memory+influx"
+        return history, 'extended'
+
+    @staticmethod
+    def _view(history, metrics, start, end):
+        """Przedziały wspólnego wyniku nachodzące na [start, end), metryki w kolejności żądania.
+
+        Wynik w pamięci sięga wyrównanego końca okna - bez przycięcia żądanie
+        z jawnym 'end' dostałoby punkty spoza swojego zakresu.
+        """
+        times = history["time"]
+        first = bisect.bisect_right(times, start - history["interval"])
+        last = bisect.bisect_left(times, end)
+        if first == 0 and last == len(times):
+            # Typowy dashboard (koniec = teraz) - bez kopiowania list
+            return dict(history, start=start, end=end, metrics={m: history["metrics"][m] for m in metrics})
+        return dict(history, start=start, end=end, time=times[first:last],
+                    metrics={m: history["metrics"][m][first:last] for m in metrics})
+
+    def _store(self, key, shape, start, interval, history, fetched_at):
+        size = history_size(history)
+        if size > self.options['max_bytes']:
+            return
+        ttl = self.options['ttl']
+        expires = (math.floor(time.time() / ttl) + 1) * ttl if ttl > 0 else 0
+        with self._lock:
+            previous = self._live.get(shape)
+            if previous is not None and start < previous[1] < key[1]:
+                # Przesunięte okno zastępuje poprzednie
+                self._drop(previous)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {"history": history, "interval": interval, "end": key[1],
+                                  "fetched_at": fetched_at, "expires": expires, "size": size}
+            if self._live.get(shape, key)[1] <= key[1]:
+                self._live[shape] = key
+            self._bytes += size
+            while self._bytes > self.options['max_bytes']:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+            if self._live.get(key[0]) == key:
+                del self._live[key[0]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._live.clear()
+            self._bytes = 0
+
+    def metrics(self):
+        with self._lock:
+            requests = sum(self.stats[k] for k in ("hits", "misses", "coalesced", "extended", "uncached"))
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes,
+                        max_bytes=self.options['max_bytes'], in_flight=len(self._flights),
+                        hit_ratio=round((self.stats["hits"] + self.stats["coalesced"]) / requests, 4) if requests else None)
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from config import INVENTORY_CONFIG, SNMP_CONFIG, DEVICES, OIDS
+
+logger = logging.getLogger("SNMP-Inventory")
+
+# Nazwy kluczy przyjmowane w plikach obok nazw używanych przez poller
+ALIASES = {
+    'address': 'host',
+    'auth_password': 'auth_key',
+    'priv_password': 'priv_key',
+    'context': 'context_name',
+}
+
+# Wartości urządzenia, których nie podaje wpis ani sekcja "defaults" pliku
+DEFAULTS = {
+    'port': SNMP_CONFIG['port'],
+    'username': SNMP_CONFIG['username'],
+    'auth_key': SNMP_CONFIG['auth_key'],
+    'priv_key': SNMP_CONFIG['priv_key'],
+    'context_name': SNMP_CONFIG['context_name'],
+}
+
+NUMERIC_KEYS = {'port': int, 'retries': int, 'interval': float, 'timeout': float}
+
+
+def _with_aliases(entry):
+    return {ALIASES.get(key, key): value for key, value in entry.items()}
+
+
+def parse_profile(name, spec, source):
+    """Profil OID: lista kluczy z config.OIDS albo słownik {klucz: OID}"""
+    if isinstance(spec, dict):
+        return {str(key): str(oid) for key, oid in spec.items()}
+    if isinstance(spec, list):
+        unknown = [key for key in spec if key not in OIDS]
+        if unknown:
+            raise ValueError(f"{source}: profil {name} - nieznane klucze OID: {', '.join(map(str, unknown))}")
+        return {key: OIDS[key] for key in spec}
+    raise ValueError(f"{source}: profil {name} musi być listą kluczy lub słownikiem OID")
+
+
+def normalize_device(entry, defaults, profiles, source):
+    """Wpis pliku -> słownik urządzenia w formacie pollera (klucze jak w config.DEVICES)"""
+    if not isinstance(entry, dict):
+        raise ValueError(f"{source}: wpis urządzenia musi być obiektem")
+    device = dict(defaults)
+    device.update(_with_aliases(entry))
+    if not device.get('host'):
+        raise ValueError(f"{source}: urządzenie {entry.get('name', '?')} bez adresu (host)")
+    device['name'] = str(device.get('name') or device['host'])
+
+    for key, kind in NUMERIC_KEYS.items():
+        if key in device:
+            try:
+                device[key] = kind(device[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"{source}: {device['name']} - niepoprawna wartość {key}: {device[key]!r}")
+
+    tags = device.get('tags') or []
+    device['tags'] = sorted({str(tag) for tag in ([tags] if isinstance(tags, str) else tags)})
+
+    # Profil współdzielony przez urządzenia pliku - jeden słownik OID w pamięci
+    if device.get('profile') is not None:
+        if device['profile'] not in profiles:
+            raise ValueError(f"{source}: {device['name']} - nieznany profil {device['profile']}")
+        device['oids'] = profiles[device['profile']]
+    elif 'oids' in device:
+        device['oids'] = parse_profile(device['name'], device['oids'], source)
+    return device
+
+
+def load_file(path):
+    """{nazwa: urządzenie} z pliku JSON: lista wpisów albo {"defaults", "profiles", "devices"}.
+
+    Sekcje "defaults" i "profiles" dotyczą tylko urządzeń tego samego pliku,
+    więc zmiana pliku nie wpływa na urządzenia z pozostałych.
+    """
+    with open(path, encoding='utf-8') as f:
+        try:
+            content = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"{path}: niepoprawny JSON ({e})")
+    if isinstance(content, list):
+        content = {"devices": content}
+    if not isinstance(content, dict) or not isinstance(content.get("devices"), list):
+        raise ValueError(f'{path}: oczekiwano listy urządzeń lub obiektu z kluczem "devices"')
+
+    defaults = dict(DEFAULTS, **_with_aliases(content.get("defaults") or {}))
+    profiles = {name: parse_profile(name, spec, path) for name, spec in (content.get("profiles") or {}).items()}
+    devices = {}
+    for entry in content["devices"]:
+        device = normalize_device(entry, defaults, profiles, path)
+        if device['name'] in devices:
+            raise ValueError(f"{path}: powtórzona nazwa urządzenia {device['name']}")
+        devices[device['name']] = device
+    return devices
+
+
+class Inventory:
+    """Inwentarz urządzeń z pliku lub katalogu plików *.json, przeładowywany w locie.
+
+    Przy przeładowaniu czytane są tylko pliki, których czas modyfikacji lub
+    rozmiar się zmienił, a ich urządzenia porównywane z poprzednim stanem.
+    Różnica (dodane, zmienione, usunięte) trafia do on_change(added, changed,
+    removed) - poller dodaje i usuwa tylko te urządzenia, a pozostałe
+    zachowują harmonogram, engineID i stan liczników.  Błędny plik nie
+    zmienia inwentarza.  Urządzenia są indeksowane po nazwie, adresie i tagach.
+    """
+
+    def __init__(self, path=None, on_change=None, **options):
+        self.options = dict(INVENTORY_CONFIG, **options)
+        self.path = self.options['path'] if path is None else path
+        self.on_change = on_change
+        self._devices = {}
+        # {plik: (sygnatura, {nazwa: urządzenie})}
+        self._files = {}
+        self._by_host = {}
+        self._by_tag = {}
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"reloads": 0, "errors": 0, "added": 0, "changed": 0, "removed": 0, "load_ms": 0.0}
+
+    # Wczytywanie
+
+    def _scan(self):
+        """{plik: (mtime_ns, rozmiar)}; bez ścieżki - urządzenia z config.DEVICES"""
+        if not self.path:
+            return {None: ()}
+        if os.path.isdir(self.path):
+            files = sorted(entry.path for entry in os.scandir(self.path)
+                           if entry.name.endswith('.json') and entry.is_file())
+        else:
+            files = [self.path]
+        signatures = {}
+        for path in files:
+            st = os.stat(path)
+            signatures[path] = (st.st_mtime_ns, st.st_size)
+        return signatures
+
+    def _read(self, path):
+        if path is None:
+            return {d['name']: normalize_device(d, DEFAULTS, {}, 'config.DEVICES') for d in DEVICES}
+        return load_file(path)
+
+    def load(self):
+        """Pierwsze wczytanie - błąd jest zgłaszany, bo nie ma poprzedniego stanu do zachowania"""
+        with self._reload_lock:
+            return self._reload(notify=False)
+
+    def reload(self):
+        """Stosuje zmiany plików; zwraca (added, changed, removed) albo None przy błędzie"""
+        with self._reload_lock:
+            try:
+                return self._reload()
+            except (OSError, ValueError) as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                logger.error(f"Inwentarz nie został przeładowany, obowiązuje poprzedni: {e}")
+                return None
+
+    def _reload(self, notify=True):
+        started = time.perf_counter()
+        signatures = self._scan()
+        stale = [path for path in self._files if path not in signatures]
+        changed_files = {path: signature for path, signature in signatures.items()
+                         if path not in self._files or self._files[path][0] != signature}
+        if not stale and not changed_files:
+            return [], [], []
+
+        devices = dict(self._devices)
+        old_names = []
+        for path in stale + list(changed_files):
+            if path in self._files:
+                names = list(self._files[path][1])
+                old_names.extend(names)
+                for name in names:
+                    del devices[name]
+
+        files = {path: entry for path, entry in self._files.items() if path in signatures}
+        new_names = []
+        for path, signature in changed_files.items():
+            loaded = self._read(path)
+            for name, device in loaded.items():
+                if name in devices:
+                    raise ValueError(f"{path}: urządzenie {name} jest już zdefiniowane w innym pliku")
+                devices[name] = device
+            files[path] = (signature, loaded)
+            new_names.extend(loaded)
+
+        previous = self._devices
+        added = [devices[name] for name in new_names if name not in previous]
+        changed = [devices[name] for name in new_names if name in previous and previous[name] != devices[name]]
+        removed = [name for name in old_names if name not in devices]
+
+        with self._lock:
+            for name in removed:
+                self._unindex(previous[name])
+            for device in changed:
+                self._unindex(previous[device['name']])
+            for device in added + changed:
+                self._index(device)
+            self._devices = devices
+            self._files = files
+            self.stats["reloads"] += 1
+            self.stats["added"] += len(added)
+            self.stats["changed"] += len(changed)
+            self.stats["removed"] += len(removed)
+            self.stats["load_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        if added or changed or removed:
+            logger.info(f"Inwentarz: {len(devices)} urządzeń (+{len(added)} ~{len(changed)} -{len(removed)}, "
+                        f"{self.stats['load_ms']} ms)")
+            if self.on_change and notify:
+                try:
+                    self.on_change(added, changed, removed)
+                except Exception as e:
+                    logger.error(f"Błąd stosowania zmian inwentarza: {e}")
+        return added, changed, removed
+
+    # Indeksy
+
+    def _index(self, device):
+        self._by_host.setdefault(device['host'], set()).add(device['name'])
+        for tag in device['tags']:
+            self._by_tag.setdefault(tag, set()).add(device['name'])
+
+    def _unindex(self, device):
+        for index, key in [(self._by_host, device['host'])] + [(self._by_tag, tag) for tag in device['tags']]:
+            names = index.get(key)
+            if names is not None:
+                names.discard(device['name'])
+                if not names:
+                    del index[key]
+
+    # Odczyt
+
+    def __len__(self):
+        return len(self._devices)
+
+    def get(self, name):
+        return self._devices.get(name)
+
+    def devices(self, tag=None):
+        """Lista urządzeń (całość albo z tagiem 'tag')"""
+        with self._lock:
+            if tag is None:
+                return list(self._devices.values())
+            return [self._devices[name] for name in sorted(self._by_tag.get(tag, ()))]
+
+    def find(self, host, port=None):
+        """Urządzenia o danym adresie (i porcie) - jeden agent może mieć kilka kontekstów"""
+        with self._lock:
+            devices = [self._devices[name] for name in sorted(self._by_host.get(host, ()))]
+        return [device for device in devices if port is None or device['port'] == port]
+
+    def tags(self):
+        with self._lock:
+            return {tag: len(names) for tag, names in sorted(self._by_tag.items())}
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, devices=len(self._devices), files=len(self._files), tags=len(self._by_tag))
+
+    # Wątek tła: sprawdzanie zmian plików
+
+    def start(self):
+        if self._thread is None and self.path and self.options['watch_interval'] > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="inventory")
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.options['watch_interval']):
+            self.reload()
+
+    def stop(self):
+        self._stop.set()
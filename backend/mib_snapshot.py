@@ -0,0 +1,204 @@
+import os
+import errno
+import atexit
+import marshal
+import logging
+import threading
+
+from pysnmp import __version__ as pysnmp_version
+from pysnmp.smi import builder, instrum
+from pysnmp.proto.rfc3412 import MsgAndPduDispatcher
+from pysnmp.entity.engine import SnmpEngine
+import ber_codec
+import prometheus
+from config import MIB_SNAPSHOT_CONFIG, METRICS_CONFIG
+
+logger = logging.getLogger("SNMP-MibSnapshot")
+
+# Zmiana formatu pliku unieważnia zapisane migawki
+SNAPSHOT_FORMAT = 1
+
+
+def snapshot_version():
+    """Migawka jest ważna tylko dla tej samej wersji pysnmp i kodu bajtowego Pythona"""
+    return f"{SNAPSHOT_FORMAT}:{pysnmp_version}:{builder.PY_MAGIC_NUMBER.hex()}"
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class MibSnapshot:
+    """Skompilowane moduły MIB pysnmp zapisane jednym plikiem (marshal).
+
+    MibBuilder przy każdym SnmpEngine() czyta i kompiluje (compile()) źródła
+    modułów MIB, co stanowi większość czasu tworzenia silnika.  Migawka
+    przechowuje gotowe obiekty kodu wraz z datą i rozmiarem źródła - moduł
+    zmieniony od czasu budowy jest kompilowany ponownie, a migawka
+    aktualizowana.  Wykonanie modułu (exec) pozostaje po stronie pysnmp, bo
+    klasy MIB są związane z obiektem MibBuilder konkretnego silnika.
+    """
+
+    def __init__(self, path=None, **options):
+        self.options = dict(MIB_SNAPSHOT_CONFIG, **options)
+        self.path = (path or self.options['path']) if self.options['persist'] else None
+        self.version = snapshot_version()
+        self.modules = {}
+        self._checked = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.stats = {"hits": 0, "compiled": 0, "stale": 0, "loaded": 0}
+
+    # Budowa i odczyt
+
+    def _compile(self, name, path):
+        with open(path, encoding='utf-8') as f:
+            code = compile(f.read(), path, 'exec')
+        mtime, size = _source_stat(path)
+        self.modules[name] = (path, mtime, size, code)
+        self._checked.add(name)
+        self._dirty = True
+        self.stats["compiled"] += 1
+        return code
+
+    def build(self, sources=None):
+        """Kompiluje wszystkie moduły ze źródeł MIB (domyślnie wbudowanych w pysnmp)"""
+        sources = sources or builder.MibBuilder().getMibSources()
+        with self._lock:
+            # Kolejność jak w MibBuilder - pierwsze źródło z danym modułem wygrywa
+            for source in sources:
+                if not isinstance(source, builder.DirMibSource):
+                    continue
+                for name in source.listdir():
+                    path = source.fullPath(name, '.py')
+                    if name not in self.modules and os.path.exists(path):
+                        self._compile(name, path)
+        return self
+
+    def get(self, name):
+        """Obiekt kodu modułu albo None, jeśli modułu nie ma w migawce"""
+        with self._lock:
+            entry = self.modules.get(name)
+            if entry is None:
+                return None
+            path, mtime, size, code = entry
+            if name not in self._checked:
+                # Źródło sprawdzane raz na proces
+                try:
+                    current = _source_stat(path)
+                except OSError:
+                    del self.modules[name]
+                    self._dirty = True
+                    return None
+                self._checked.add(name)
+                if current != (mtime, size):
+                    self.stats["stale"] += 1
+                    return self._compile(name, path)
+            self.stats["hits"] += 1
+            return code
+
+    def module_path(self, name):
+        entry = self.modules.get(name)
+        return entry[0] if entry else None
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                state = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logger.warning(f"Nie udało się wczytać migawki MIB {self.path}: {e}")
+            return False
+        if not isinstance(state, dict) or state.get("version") != self.version:
+            logger.info(f"Migawka MIB {self.path} jest z innej wersji - zostanie zbudowana ponownie")
+            return False
+        with self._lock:
+            self.modules.update(state["modules"])
+            self.stats["loaded"] = len(state["modules"])
+        return True
+
+    def save(self):
+        """Zapisuje migawkę atomowo (tymczasowy plik + zamiana)"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {"version": self.version, "modules": dict(self.modules)}
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                marshal.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Błąd zapisu migawki MIB {self.path}: {e}")
+
+    def metrics(self):
+        return dict(self.stats, modules=len(self.modules), version=self.version)
+
+
+class SnapshotMibSource(builder.DirMibSource):
+    """Źródło MIB podawane przed źródłami pysnmp - serwuje kod z migawki.
+
+    Moduły spoza migawki zgłaszają brak pliku, więc MibBuilder szuka ich
+    dalej w zwykłych katalogach (np. MIB skompilowane przez pysmi).
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        builder.DirMibSource.__init__(self, '<snapshot>')
+
+    def _init(self):
+        return self
+
+    def _listdir(self):
+        return tuple(self.snapshot.modules)
+
+    def fullPath(self, f='', sfx=''):
+        # Ścieżka oryginalnego pliku - MibBuilder pomija moduły już wczytane z tej ścieżki
+        return (f and self.snapshot.module_path(f)) or self._srcName
+
+    def read(self, f):
+        code = self.snapshot.get(f)
+        if code is None:
+            raise IOError(errno.ENOENT, 'No such module in MIB snapshot', f)
+        return code, '.py'
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_mib_snapshot():
+    """Współdzielona migawka procesu; budowana i zapisywana przy pierwszym użyciu"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            snapshot = MibSnapshot()
+            if not snapshot.load():
+                snapshot.build()
+                snapshot.save()
+            atexit.register(snapshot.save)
+            _snapshot = snapshot
+        return _snapshot
+
+
+def create_engine(**kwargs):
+    """SnmpEngine, którego MibBuilder wczytuje moduły z migawki zamiast kompilować źródła.
+
+    Przy okazji włącza szybki koder BER dla ScopedPDU (ber_codec.install())
+    i pomiar etapów odpytania dla /metrics.
+    """
+    ber_codec.install()
+    if METRICS_CONFIG['stage_timing']:
+        prometheus.install_snmp_timing()
+    if not MIB_SNAPSHOT_CONFIG['enabled']:
+        return SnmpEngine(**kwargs)
+    mib_builder = builder.MibBuilder()
+    mib_builder.setMibSources(SnapshotMibSource(get_mib_snapshot()), *mib_builder.getMibSources())
+    dispatcher = MsgAndPduDispatcher(instrum.MibInstrumController(mib_builder))
+    return SnmpEngine(msgAndPduDsp=dispatcher, **kwargs)
+
@@ -0,0 +1,525 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import asyncio_compat  # noqa: F401 - musi poprzedzać import pysnmp.hlapi.asyncio
+
+from pysnmp.hlapi.asyncio import (
+    getCmd,
+    bulkCmd,
+    UdpTransportTarget,
+    ContextData,
+    ObjectType,
+    ObjectIdentity,
+    usmHMACMD5AuthProtocol,
+    usmDESPrivProtocol
+)
+from pysnmp.proto import errind, rfc1905
+from pysnmp.entity import config as engine_config
+from discovery import InterfaceDiscovery
+from usm_cache import get_usm_cache
+from mib_snapshot import create_engine
+from scheduler import PollScheduler
+from prometheus import observe_stage
+from config import OIDS, POLLER_CONFIG, POLL_GROUPS
+
+logger = logging.getLogger("SNMP-Poller")
+
+# Grupa OID bez własnego okresu w POLL_GROUPS (liczniki, stany, tabela interfejsów)
+DEFAULT_GROUP = 'default'
+
+# Klucze urządzenia, z których powstaje cel zapytań (_target_for)
+TARGET_KEYS = ('username', 'auth_key', 'priv_key', 'context_name', 'timeout', 'retries')
+CREDENTIAL_KEYS = ('username', 'auth_key', 'priv_key')
+
+
+class PollerStats:
+    """Statystyki przepustowości pollera"""
+
+    def __init__(self, window=60.0, scheduler=None):
+        self.window = window
+        self.scheduler = scheduler
+        self.started_at = time.monotonic()
+        self.in_flight = 0
+        self.queued = 0
+        self.polls = 0
+        self.successes = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._completed = deque()
+        # Liczniki odpytań per urządzenie: {nazwa: {status: liczba}}
+        self._devices = {}
+
+    def poll_started(self):
+        self.in_flight += 1
+
+    def poll_finished(self, status, device=None):
+        now = time.monotonic()
+        self.in_flight -= 1
+        self.polls += 1
+        if status == 'ok':
+            self.successes += 1
+        elif status == 'timeout':
+            self.timeouts += 1
+        else:
+            self.errors += 1
+        if device is not None:
+            counts = self._devices.setdefault(device, {'ok': 0, 'timeout': 0, 'error': 0})
+            counts[status if status in counts else 'error'] += 1
+        self._completed.append(now)
+        while self._completed and self._completed[0] < now - self.window:
+            self._completed.popleft()
+
+    def device_counts(self):
+        return {name: dict(counts) for name, counts in self._devices.items()}
+
+    def forget(self, device):
+        self._devices.pop(device, None)
+
+    def stage_snapshots(self):
+        """Histogramy etapów z innych procesów - poller w tym procesie zapisuje do prometheus.stage_seconds"""
+        return []
+
+    def snapshot(self):
+        now = time.monotonic()
+        span = min(self.window, now - self.started_at) or 1e-9
+        recent = sum(1 for t in self._completed if t >= now - self.window)
+        snapshot = {
+            "devices_per_s": round(recent / span, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "polls": self.polls,
+            "successes": self.successes,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+        if self.scheduler is not None:
+            # Opóźnienie startów i pominięte terminy pokazują przeciążenie pollera
+            snapshot.update(self.scheduler.metrics())
+        return snapshot
+
+
+class AsyncPoller:
+    """Współbieżny poller wielu urządzeń na jednej pętli zdarzeń i jednym silniku SNMP"""
+
+    def __init__(self, devices, oids=None, on_result=None, usm_cache=None, groups=None, **options):
+        self.devices = {d['name']: d for d in devices}
+        self.oids = oids or OIDS
+        self.on_result = on_result
+        self.options = dict(POLLER_CONFIG, **options)
+        self.groups = POLL_GROUPS if groups is None else groups
+        self.scheduler = PollScheduler(**self.options)
+        self.stats = PollerStats(scheduler=self.scheduler)
+        self.usm_cache = usm_cache or get_usm_cache()
+        self.discovery = InterfaceDiscovery(self)
+
+        self.engine = None
+        self._semaphore = None
+        self._targets = {}
+        self._loop = None
+        self._wakeup = None
+        self._running = {}
+        self._last = {}
+        # {urządzenie: {grupa: klucze ostatniego wyniku}}
+        self._group_keys = {}
+
+    def _ensure_engine(self):
+        # Silnik i semafor muszą powstać wewnątrz działającej pętli zdarzeń
+        if self.engine is None:
+            self.engine = create_engine()
+            self._semaphore = asyncio.Semaphore(self.options['concurrency'])
+
+    def _target_for(self, device):
+        """Dane uwierzytelniające i cel transportu tworzone raz na urządzenie.
+
+        Gdy engineID agenta jest znany, użytkownik USM jest konfigurowany dla
+        niego (hlapi.lcd: klucz (nazwa, engineID)), więc urządzenia z tą samą
+        nazwą użytkownika mogą mieć różne hasła.  Do wykrycia engineID
+        zapytania korzystają ze wspólnego szablonu nazwy.
+        """
+        name = device['name']
+        entry = self._targets.get(name)
+        if entry is None:
+            entry = (
+                None,
+                UdpTransportTarget(
+                    (device['host'], device['port']),
+                    timeout=device.get('timeout', self.options['timeout']),
+                    retries=device.get('retries', self.options['retries'])
+                ),
+                ContextData(contextName=device.get('context_name', ''))
+            )
+        auth_data, target, context = entry
+        # engineID zapamiętany z poprzednich odpytań (także sprzed restartu)
+        self.usm_cache.prime(self.engine, target)
+        engine_id = self.usm_cache.peer_engine_id(self.engine, target)
+        if auth_data is None or auth_data.securityEngineId != engine_id:
+            auth_data = self.usm_cache.user_data(
+                device['username'],
+                device['auth_key'],
+                device['priv_key'],
+                usmHMACMD5AuthProtocol,
+                usmDESPrivProtocol,
+                engine_id=engine_id
+            )
+            entry = self._targets[name] = (auth_data, target, context)
+        return entry
+
+    async def _query_chunk(self, device, oids):
+        auth_data, target, context = self._target_for(device)
+        try:
+            error_indication, error_status, error_index, var_binds = await getCmd(
+                self.engine, auth_data, target, context,
+                *[ObjectType(ObjectIdentity(oid)) for oid in oids],
+                lookupMib=False
+            )
+        except Exception as e:
+            return 'error', [f"Exception: {str(e)}"] * len(oids)
+
+        if error_indication:
+            if auth_data.securityEngineId is None and self.usm_cache.peer_engine_id(self.engine, target):
+                # Pierwszy kontakt: szablon nazwy mógł mieć hasła innego urządzenia, a engineID
+                # jest już wykryty - ponawiamy z kluczami urządzenia zlokalizowanymi dla agenta
+                return await self._query_chunk(device, oids)
+            if self.usm_cache.invalidate(self.engine, target):
+                # engineID zapamiętany przed restartem jest nieaktualny - ponawiamy z wykrywaniem
+                return await self._query_chunk(device, oids)
+            status = 'timeout' if isinstance(error_indication, errind.RequestTimedOut) else 'error'
+            return status, [f"Error: {error_indication}"] * len(oids)
+
+        self.usm_cache.learn(self.engine, target)
+        if error_status:
+            if error_status.prettyPrint() == 'tooBig' and len(oids) > 1:
+                half = len(oids) // 2
+                first_status, first = await self._query_chunk(device, oids[:half])
+                second_status, second = await self._query_chunk(device, oids[half:])
+                status = first_status if first_status != 'ok' else second_status
+                return status, first + second
+            return 'error', [f"Error: {error_status.prettyPrint()}"] * len(oids)
+
+        return 'ok', [str(var_bind[1]) for var_bind in var_binds]
+
+    async def walk(self, device, columns, max_repetitions=None):
+        """Przechodzi kolumny tabeli zapytaniami GETBULK.
+
+        columns: {klucz: OID kolumny}; zwraca {klucz: {indeks: wartość}},
+        gdzie indeks to sufiks OID za kolumną (np. '3' lub '1.5').
+        """
+        self._ensure_engine()
+        auth_data, target, context = self._target_for(device)
+        max_repetitions = max_repetitions or self.options['max_repetitions']
+        prefixes = {key: tuple(int(x) for x in oid.split('.')) for key, oid in columns.items()}
+        results = {key: {} for key in columns}
+        cursor = dict(prefixes)
+        active = list(columns)
+
+        while active:
+            error_indication, error_status, error_index, var_bind_table = await bulkCmd(
+                self.engine, auth_data, target, context, 0, max_repetitions,
+                *[ObjectType(ObjectIdentity(cursor[key])) for key in active],
+                lookupMib=False
+            )
+            if error_indication and self.usm_cache.invalidate(self.engine, target):
+                # engineID zapamiętany przed restartem jest nieaktualny - ponawiamy z wykrywaniem
+                continue
+            if error_indication or error_status:
+                raise RuntimeError(f"Błąd GETBULK: {error_indication or error_status.prettyPrint()}")
+            self.usm_cache.learn(self.engine, target)
+
+            finished = set()
+            for row in var_bind_table:
+                for key, (name, value) in zip(active, row):
+                    if key in finished:
+                        continue
+                    oid = tuple(name)
+                    prefix = prefixes[key]
+                    # Koniec kolumny, koniec MIB albo agent nie przesuwa się do przodu
+                    if (value.tagSet == rfc1905.endOfMibView.tagSet or oid[:len(prefix)] != prefix
+                            or oid <= cursor[key]):
+                        finished.add(key)
+                        continue
+                    results[key]['.'.join(map(str, oid[len(prefix):]))] = value
+                    cursor[key] = oid
+            if not var_bind_table:
+                break
+            active = [key for key in active if key not in finished]
+        return results
+
+    async def _get_all(self, device, oids):
+        keys = list(oids)
+        size = max(1, self.options['max_oids_per_pdu'])
+        status, values = 'ok', []
+        for start in range(0, len(keys), size):
+            chunk_status, chunk = await self._query_chunk(
+                device, [oids[key] for key in keys[start:start + size]])
+            values.extend(chunk)
+            if chunk_status != 'ok':
+                status = chunk_status
+                if chunk_status == 'timeout':
+                    # Urządzenie nie odpowiada - nie marnujemy czasu na kolejne paczki
+                    values.extend([chunk[0]] * (len(keys) - len(values)))
+                    break
+        return status, dict(zip(keys, values))
+
+    def _discovery_enabled(self, device):
+        return device.get('discovery', self.options['discovery'])
+
+    async def _poll(self, device, oids, discovery=False):
+        """Odczyt podanych OID (i przy odkrywaniu tabeli interfejsów); zwraca (status, dane)"""
+        if discovery:
+            oids = self.discovery.scalar_oids(oids)
+
+        # Odpytania czekające na wolne miejsce (limit 'concurrency') - głębokość kolejki
+        self.stats.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats.queued -= 1
+        try:
+            self.stats.poll_started()
+            status, data = 'error', {}
+            try:
+                status, data = await self._get_all(device, oids)
+                if discovery and status == 'ok':
+                    started = time.perf_counter()
+                    try:
+                        data.update(await self.discovery.poll(device, data))
+                    except Exception as e:
+                        status = 'error'
+                        logger.warning(f"Błąd odczytu tabeli interfejsów {device['name']}: {e}")
+                    observe_stage('discovery', time.perf_counter() - started)
+            finally:
+                self.stats.poll_finished(status, device['name'])
+        finally:
+            self._semaphore.release()
+
+        return status, data
+
+    async def poll_device(self, device, oids=None):
+        """Odpytuje jedno urządzenie, zwraca słownik w formacie SNMPManager.get_snmp_data()"""
+        self._ensure_engine()
+        discovery = oids is None and self._discovery_enabled(device)
+        status, data = await self._poll(device, oids or device.get('oids') or self.oids, discovery)
+        return data
+
+    async def poll_once(self):
+        """Jednorazowe odpytanie całego inwentarza"""
+        self._ensure_engine()
+        names = list(self.devices)
+        results = await asyncio.gather(*[self.poll_device(self.devices[n]) for n in names])
+        return dict(zip(names, results))
+
+    # Odpytywanie cykliczne według harmonogramu
+
+    def group_oids(self, device):
+        """{grupa: {klucz: OID}} - klucze spoza POLL_GROUPS należą do grupy domyślnej"""
+        # Profil OID urządzenia z inwentarza, inaczej wspólne OIDS pollera
+        oids = device.get('oids') or self.oids
+        groups, assigned = {}, set()
+        for name, group in self.groups.items():
+            keys = {key: oids[key] for key in group['keys'] if key in oids}
+            if keys:
+                groups[name] = keys
+                assigned.update(keys)
+        default = {key: oid for key, oid in oids.items() if key not in assigned}
+        if default or self._discovery_enabled(device):
+            groups[DEFAULT_GROUP] = default
+        return groups
+
+    def _group_interval(self, device, group):
+        if group == DEFAULT_GROUP:
+            return device.get('interval', self.options['interval'])
+        return self.groups[group]['interval']
+
+    def _group_intervals(self, device):
+        return {group: self._group_interval(device, group) for group in self.group_oids(device)}
+
+    def _schedule(self, device, groups=None):
+        now = self._loop.time()
+        # Pierwsze odczyty wszystkich grup w ciągu jednego okresu podstawowego
+        first_within = device.get('interval', self.options['interval'])
+        for group, interval in self._group_intervals(device).items():
+            if groups is None or group in groups:
+                self.scheduler.add(device['name'], group, interval, now, first_within)
+
+    def _merge(self, name, group, data):
+        """Pełny stan urządzenia: wynik grupy na tle ostatnich wartości pozostałych grup.
+
+        Klucze zachowują kolejność, więc niezmienione dane dają ten sam ETag.
+        """
+        merged = self._last.setdefault(name, {})
+        groups = self._group_keys.setdefault(name, {})
+        for key in groups.get(group, set()) - data.keys():
+            merged.pop(key, None)
+        merged.update(data)
+        groups[group] = set(data)
+        return dict(merged)
+
+    async def _run_job(self, job):
+        device = self.devices[job.device]
+        status = 'error'
+        try:
+            oids = self.group_oids(device).get(job.group, {})
+            discovery = job.group == DEFAULT_GROUP and self._discovery_enabled(device)
+            status, data = await self._poll(device, oids, discovery)
+            if self.on_result:
+                # Dalsze etapy dostają tylko świeży wynik grupy, pełny stan - do bieżącej próbki
+                self.on_result(device['name'], data, self._merge(device['name'], job.group, data))
+        except Exception as e:
+            logger.error(f"Błąd odpytywania {device['name']} ({job.group}): {e}")
+        finally:
+            self._running.pop(job, None)
+            self.scheduler.finished(job, status, self._loop.time())
+            self._wakeup.set()
+
+    def trigger(self, name):
+        """Zleca natychmiastowe odpytanie urządzenia (np. po trapie); bezpieczne z innych wątków"""
+        if name not in self.devices or self._loop is None:
+            return False
+        self._loop.call_soon_threadsafe(self._trigger, name)
+        return True
+
+    def _trigger(self, name):
+        # Wymuszone odpytanie grupy podstawowej - seria trapów nie powoduje serii zapytań
+        if self.scheduler.trigger(name, DEFAULT_GROUP, self._loop.time(), self.options['repoll_min_interval']):
+            self._wakeup.set()
+
+    def add_device(self, device):
+        """Dodaje (lub podmienia) urządzenie; w działającym run() od razu trafia do harmonogramu.
+
+        Wywoływane z wątku pętli zdarzeń pollera.
+        """
+        name = device['name']
+        if name in self.devices:
+            self.remove_device(name)
+        self.devices[name] = device
+        if self._loop is not None:
+            self._schedule(device)
+            self._wakeup.set()
+
+    def remove_device(self, name):
+        """Usuwa urządzenie z harmonogramu i przerywa jego trwające odpytania"""
+        self.devices.pop(name, None)
+        self._targets.pop(name, None)
+        self._last.pop(name, None)
+        self._group_keys.pop(name, None)
+        self.discovery.forget(name)
+        self.stats.forget(name)
+        self.scheduler.remove(name)
+        for job, task in list(self._running.items()):
+            if job.device == name:
+                task.cancel()
+
+    def update_device(self, device):
+        """Podmienia konfigurację urządzenia bez przerywania jego harmonogramu.
+
+        Nowe dane uwierzytelniające lub kontekst dają tylko nowy cel zapytań;
+        zmiana okresu lub profilu OID planuje od nowa tylko zmienione grupy.
+        Inny adres to inny agent (engineID, liczniki), więc urządzenie jest
+        usuwane i dodawane.  Wywoływane z wątku pętli zdarzeń pollera.
+        """
+        name = device['name']
+        previous = self.devices.get(name)
+        if previous is None or (previous['host'], previous['port']) != (device['host'], device['port']):
+            self.add_device(device)
+            return
+        self.devices[name] = device
+        old_target = None
+        if any(previous.get(key) != device.get(key) for key in TARGET_KEYS):
+            old_target = self._targets.pop(name, None)
+        if any(previous.get(key) != device.get(key) for key in CREDENTIAL_KEYS):
+            self._rekey(device, old_target)
+        if self._loop is None:
+            return
+
+        before, after = self._group_intervals(previous), self._group_intervals(device)
+        for group in before.keys() - after.keys():
+            self.scheduler.remove(name, group)
+            # Wartości grupy, której urządzenie już nie odpytuje, znikają z pełnego stanu
+            for key in self._group_keys.get(name, {}).pop(group, ()):
+                self._last.get(name, {}).pop(key, None)
+        changed = {group for group, interval in after.items() if before.get(group) != interval}
+        if changed:
+            self._schedule(device, changed)
+            self._wakeup.set()
+
+    def _rekey(self, device, old_target=None):
+        """Nowe hasła użytkownika USM w silniku pollera.
+
+        Wpis użytkownika dla engineID agenta urządzenia jest usuwany -
+        _target_for doda go z nowymi kluczami.  Szablon nazwy (hlapi.lcd,
+        klucz (nazwa, None)), z którego pysnmp kopiuje klucze dla agentów
+        o nieznanym jeszcze engineID, jest usuwany razem z kopiami
+        i dodawany z nowymi kluczami.
+        """
+        if self.engine is None:
+            return
+        cache = self.engine.getUserContext('CommandGeneratorLcdConfigurator')
+        if not cache:
+            return
+        old_auth = old_target[0] if old_target else None
+        if old_auth is not None and old_auth.securityEngineId is not None:
+            cache['auth'].pop((old_auth.userName, old_auth.securityEngineId), None)
+            engine_config.delV3User(self.engine, old_auth.userName, securityEngineId=old_auth.securityEngineId)
+        key = (device['username'], None)
+        if key not in cache['auth']:
+            return
+        auth_data = self.usm_cache.user_data(device['username'], device['auth_key'], device['priv_key'],
+                                             usmHMACMD5AuthProtocol, usmDESPrivProtocol)
+        engine_config.delV3User(self.engine, device['username'])
+        engine_config.addV3User(
+            self.engine, auth_data.userName,
+            auth_data.authProtocol, auth_data.authKey,
+            auth_data.privProtocol, auth_data.privKey,
+            authKeyType=auth_data.authKeyType, privKeyType=auth_data.privKeyType
+        )
+        cache['auth'][key] = auth_data
+        logger.info(f"Nowe klucze użytkownika {device['username']} ({device['name']})")
+
+    def update_devices(self, added=(), changed=(), removed=()):
+        """Stosuje różnicę inwentarza (Inventory.on_change); bezpieczne z innych wątków"""
+        if self._loop is None:
+            self._update_devices(added, changed, removed)
+        else:
+            self._loop.call_soon_threadsafe(self._update_devices, list(added), list(changed), list(removed))
+
+    def _update_devices(self, added, changed, removed):
+        for name in removed:
+            self.remove_device(name)
+        for device in changed:
+            self.update_device(device)
+        for device in added:
+            self.add_device(device)
+
+    async def run(self):
+        """Cykliczne odpytywanie wszystkich urządzeń według harmonogramu aż do anulowania"""
+        self._ensure_engine()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        for device in list(self.devices.values()):
+            self._schedule(device)
+        try:
+            while True:
+                for job in self.scheduler.due(self._loop.time()):
+                    self._running[job] = asyncio.ensure_future(self._run_job(job))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.scheduler.next_delay(self._loop.time()))
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            tasks = list(self._running.values())
+            for task in tasks:
+                task.cancel()
+            # Anulowane zadania rozliczają się w harmonogramie, póki pętla jest jeszcze dostępna
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._running.clear()
+            for name in list(self.devices):
+                self.scheduler.remove(name)
+            self._loop = None
+            self.usm_cache.save()
+
+    def run_forever(self):
+        """Uruchamia poller we własnej pętli zdarzeń (np. w wątku tła)"""
+        asyncio.run(self.run())
@@ -0,0 +1,274 @@
+import time
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger("SNMP-Metrics")
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Granice przedziałów histogramów opóźnień [s]
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Etapy odpytania mierzone histogramem snmp_poll_stage_seconds
+STAGES = ('discovery', 'usm', 'encode', 'rtt', 'decode', 'export')
+
+
+def escape_label(value):
+    """Escapowanie wartości etykiety w formacie tekstowym Prometheusa"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histogram z jedną etykietą; liczniki przedziałów bez kumulacji, kumulowane przy renderowaniu"""
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, label=None):
+        return _Timer(self, label)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self):
+        """{etykieta: [liczniki przedziałów, suma]} - do przesłania z procesu pollera"""
+        with self._lock:
+            return {label: [list(counts), total] for label, (counts, total) in self._series.items()}
+
+    def render(self, *snapshots):
+        """Linie histogramu; 'snapshots' (np. z procesów pollera) są doliczane do serii lokalnych"""
+        merged = self.snapshot()
+        for snapshot in snapshots:
+            for label, (counts, total) in snapshot.items():
+                series = merged.setdefault(label, [[0] * len(counts), 0.0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label in sorted(merged, key=str):
+            counts, total = merged[label]
+            prefix = f'{self.label}="{escape_label(label)}",' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{format_value(bound)}"}} {cumulative}')
+            labels = f'{{{prefix[:-1]}}}' if prefix else ''
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, label):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.label)
+
+
+stage_seconds = Histogram('snmp_poll_stage_seconds', 'Czas etapów odpytania SNMP', label='stage')
+influx_write_seconds = Histogram('snmp_influx_write_seconds', 'Czas zapisu paczki punktów do InfluxDB')
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+
+
+# Pomiar etapów wewnątrz pysnmp
+
+_codec = threading.local()
+
+
+def _codec_elapsed():
+    return getattr(_codec, 'elapsed', 0.0)
+
+
+class TimedCodec:
+    """Opakowanie kodera/dekodera BER sumujące czas wywołań (na wątek)"""
+
+    def __init__(self, codec):
+        self.codec = codec
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.codec(*args, **kwargs)
+        finally:
+            _codec.elapsed = _codec_elapsed() + time.perf_counter() - start
+
+    encode = decode = __call__
+
+
+def _timed_stage(method, codec_stage):
+    """Metoda modelu SNMPv3: czas koderów idzie do 'codec_stage', reszta (kryptografia USM) do 'usm'"""
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        codec_start = _codec_elapsed()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            codec = _codec_elapsed() - codec_start
+            observe_stage(codec_stage, codec)
+            observe_stage('usm', max(0.0, time.perf_counter() - start - codec))
+
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def _timed_send(method):
+    def sendMessage(self, outgoingMessage, transportAddress):
+        # Znacznik wysłania per adres agenta; ponowienie nadpisuje poprzedni
+        self.__dict__.setdefault('_sentAt', {})[tuple(transportAddress)[:2]] = time.perf_counter()
+        return method(self, outgoingMessage, transportAddress)
+
+    sendMessage.__wrapped__ = method
+    return sendMessage
+
+
+def _timed_receive(method):
+    def datagram_received(self, datagram, transportAddress):
+        sent = self.__dict__.get('_sentAt')
+        started = sent.pop(tuple(transportAddress)[:2], None) if sent else None
+        if started is not None:
+            observe_stage('rtt', time.perf_counter() - started)
+        return method(self, datagram, transportAddress)
+
+    datagram_received.__wrapped__ = method
+    return datagram_received
+
+
+def install_snmp_timing():
+    """Mierzy etapy encode/usm/decode (model SNMPv3) i RTT (transport UDP asyncio) w pysnmp.
+
+    Wywoływane po ber_codec.install(), więc opakowuje koder, który jest faktycznie używany.
+    """
+    import asyncio_compat  # noqa: F401 - musi poprzedzać import transportu asyncio z pysnmp
+    from pysnmp.proto.mpmod import rfc3412
+    from pysnmp.proto.secmod.rfc3414 import service
+    from pysnmp.carrier.asyncio.dgram.base import DgramAsyncioProtocol
+
+    if not isinstance(service.encoder, TimedCodec):
+        # ber_codec.install() przy kolejnym silniku przywraca własny koder - opakowujemy go ponownie
+        service.encoder = TimedCodec(service.encoder.encode)
+        service.decoder = TimedCodec(service.decoder.decode)
+    model = rfc3412.SnmpV3MessageProcessingModel
+    if hasattr(model.prepareOutgoingMessage, '__wrapped__'):
+        return
+    rfc3412.decoder = TimedCodec(rfc3412.decoder.decode)
+    model.prepareOutgoingMessage = _timed_stage(model.prepareOutgoingMessage, 'encode')
+    model.prepareDataElements = _timed_stage(model.prepareDataElements, 'decode')
+    DgramAsyncioProtocol.sendMessage = _timed_send(DgramAsyncioProtocol.sendMessage)
+    DgramAsyncioProtocol.datagram_received = _timed_receive(DgramAsyncioProtocol.datagram_received)
+    logger.debug("Pomiar etapów odpytania SNMP aktywny")
+
+
+# Format tekstowy /metrics
+
+_UP_HEADER = ("# HELP snmp_device_up Ostatni odczyt urządzenia bez błędów\n"
+              "# TYPE snmp_device_up gauge\n").encode('utf-8')
+_VALUE_HEADER = ("# HELP snmp_value Wartość numeryczna z ostatniego odczytu urządzenia\n"
+                 "# TYPE snmp_value gauge\n").encode('utf-8')
+
+
+class MetricsExposition:
+    """Treść /metrics składana z gotowych fragmentów.
+
+    Wartości urządzeń (snmp_value) są kodowane do bajtów raz, przy odczycie
+    urządzenia, i przechowywane jako blok na urządzenie; scrape tylko skleja
+    bloki bez formatowania liczb i escapowania etykiet.  Metryki
+    procesu (histogramy, liczniki pollera, sekcje /api/status) są małe
+    i renderowane przy każdym żądaniu.
+    """
+
+    def __init__(self):
+        self._up = {}
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def update_device(self, device, fields, ok=True):
+        """Nowy blok urządzenia z {pole: liczba}"""
+        name = escape_label(device)
+        up = f'snmp_device_up{{device="{name}"}} {1 if ok else 0}\n'.encode('utf-8')
+        block = ''.join(f'snmp_value{{device="{name}",metric="{escape_label(key)}"}} {format_value(value)}\n'
+                        for key, value in fields.items()).encode('utf-8')
+        with self._lock:
+            self._up[device] = up
+            self._blocks[device] = block
+
+    def forget_device(self, device):
+        with self._lock:
+            self._up.pop(device, None)
+            self._blocks.pop(device, None)
+
+    def series(self):
+        with self._lock:
+            return len(self._up) + sum(block.count(b'\n') for block in self._blocks.values())
+
+    def render(self, sections=None, device_counts=None, histograms=()):
+        """Pełna odpowiedź /metrics (bajty).
+
+        sections: {nazwa: słownik metryk} - liczby jako snmp_monitor_<nazwa>_<klucz>;
+        device_counts: {urządzenie: {status: liczba odpytań}};
+        histograms: linie z Histogram.render().
+        """
+        with self._lock:
+            up = list(self._up.values())
+            blocks = list(self._blocks.values())
+
+        tail = []
+        if device_counts:
+            tail += ["# HELP snmp_device_polls_total Zakończone odpytania urządzenia wg wyniku",
+                     "# TYPE snmp_device_polls_total counter"]
+            for device, counts in device_counts.items():
+                name = escape_label(device)
+                tail.extend(f'snmp_device_polls_total{{device="{name}",status="{status}"}} {count}'
+                            for status, count in counts.items())
+        for lines in histograms:
+            tail.extend(lines)
+        for section, metrics in (sections or {}).items():
+            for key, value in metrics.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    name = f"snmp_monitor_{section}_{key}"
+                    tail += [f"# TYPE {name} untyped", f"{name} {format_value(value)}"]
+
+        # Linie jednej metryki muszą tworzyć ciągłą grupę - najpierw wszystkie snmp_device_up, potem snmp_value
+        return b''.join([
+            _UP_HEADER,
+            *up,
+            _VALUE_HEADER,
+            *blocks,
+            ('\n'.join(tail) + '\n').encode('utf-8'),
+        ])
@@ -0,0 +1,108 @@
+import re
+import time
+import threading
+
+COUNTER32_MOD = 2 ** 32
+
+# ifN_In / ifN_Out (Counter32) oraz ifN_HCIn / ifN_HCOut (Counter64)
+_COUNTER_RE = re.compile(r'^if(\d+)_(HC)?(In|Out)$')
+
+
+def _to_int(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+class CounterRateCalculator:
+    """Liczy przepływność (bit/s) z liczników oktetów interfejsów w momencie odpytania.
+
+    Poprzedni odczyt jest trzymany per (urządzenie, klucz) jako krotka
+    (licznik, sysUpTime, czas).  Przekręcenie Counter32 jest korygowane,
+    a restart agenta (spadek sysUpTime) lub skok Counter64 do tyłu
+    traktowany jest jako nieciągłość - wtedy bieżący odczyt staje się nową
+    bazą i nie jest emitowana żadna wartość.
+    """
+
+    def __init__(self, max_rate_bps=400e9):
+        self.max_rate_bps = max_rate_bps
+        self._prev = {}
+        # {urządzenie: przepływności z ostatniego odczytu z licznikami}
+        self._rates = {}
+        self._lock = threading.Lock()
+        self.discontinuities = 0
+
+    def update(self, device, key, value, bits, uptime=None, timestamp=None):
+        """Rejestruje odczyt licznika, zwraca przepływność w bit/s lub None"""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            previous = self._prev.get((device, key))
+            self._prev[(device, key)] = (value, uptime, timestamp)
+
+        if previous is None:
+            return None
+        prev_value, prev_uptime, prev_timestamp = previous
+
+        # Czas liczony po stronie agenta (sysUpTime w setnych sekundy), jeśli dostępny
+        if uptime is not None and prev_uptime is not None:
+            if uptime <= prev_uptime:
+                self.discontinuities += 1
+                return None
+            elapsed = (uptime - prev_uptime) / 100.0
+        else:
+            elapsed = timestamp - prev_timestamp
+        if elapsed <= 0:
+            return None
+
+        delta = value - prev_value
+        if delta < 0:
+            if bits != 32:
+                self.discontinuities += 1
+                return None
+            delta += COUNTER32_MOD
+
+        rate = delta * 8 / elapsed
+        if rate > self.max_rate_bps:
+            # Nierealna wartość - licznik został wyzerowany bez restartu agenta
+            self.discontinuities += 1
+            return None
+        return rate
+
+    def process(self, device, data, timestamp=None):
+        """Zwraca pola ifN_InBps / ifN_OutBps dla liczników obecnych w odczycie"""
+        uptime = _to_int(data.get('sysUpTime'))
+        counters = {}
+        for key, value in data.items():
+            match = _COUNTER_RE.match(key)
+            if not match:
+                continue
+            number = _to_int(value)
+            if number is None:
+                continue
+            index, hc, direction = match.groups()
+            # Counter64 ma pierwszeństwo przed Counter32 tego samego interfejsu
+            if hc or (index, direction) not in counters:
+                counters[(index, direction)] = (key, number, 64 if hc else 32)
+
+        rates = {}
+        for (index, direction), (key, number, bits) in counters.items():
+            rate = self.update(device, key, number, bits, uptime, timestamp)
+            if rate is not None:
+                rates[f"if{index}_{direction}Bps"] = f"{rate:.2f}"
+        if counters:
+            with self._lock:
+                self._rates[device] = rates
+        return rates
+
+    def latest(self, device):
+        """Przepływności z ostatniego odczytu zawierającego liczniki (odczyty innych grup ich nie mają)"""
+        with self._lock:
+            return dict(self._rates.get(device, {}))
+
+    def forget(self, device):
+        """Usuwa stan urządzenia (np. po usunięciu z inwentarza)"""
+        with self._lock:
+            for key in [k for k in self._prev if k[0] == device]:
+                del self._prev[key]
+            self._rates.pop(device, None)
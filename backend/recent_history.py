@@ -0,0 +1,168 @@
+import math
+import time
+import threading
+
+import numpy as np
+
+from export import numeric_fields
+from config import RECENT_HISTORY_CONFIG, POLLER_CONFIG
+
+# Bajty na próbkę: float64 wartości (znaczniki czasu są wspólne dla serii urządzenia)
+VALUE_BYTES = 8
+
+
+class DeviceHistory:
+    """Bufory cykliczne jednego urządzenia: wspólne znaczniki czasu i wartość każdej metryki.
+
+    Tablice są alokowane raz na pełną pojemność; metryka nieobecna w odczycie
+    ma w danym miejscu NaN.  'covered_from' to początek okresu, z którego
+    bufor ma wszystkie odczyty (po zawinięciu - najstarsza zachowana próbka).
+    """
+
+    def __init__(self, capacity, covered_from):
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan)
+        self.values = {}
+        self.head = 0
+        self.count = 0
+        self.covered_from = covered_from
+
+    def append(self, timestamp, values):
+        slot = self.head
+        self.times[slot] = timestamp
+        for metric, series in self.values.items():
+            series[slot] = values.pop(metric, np.nan)
+        for metric, value in values.items():
+            # Nowa metryka - wcześniejsze odczyty jej nie miały
+            series = np.full(self.capacity, np.nan)
+            series[slot] = value
+            self.values[metric] = series
+
+        self.head = (slot + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.covered_from = float(self.times[self.head])
+
+    def select(self, metrics, start, end):
+        """Kopie (czasy, {metryka: wartości}) z zakresu [start, end) w kolejności zapisu"""
+        order = (self.head - self.count + np.arange(self.count)) % self.capacity
+        times = self.times[order]
+        mask = (times >= start) & (times < end)
+        index = order[mask]
+        return times[mask], {m: self.values[m][index] for m in metrics if m in self.values}
+
+
+def downsample(times, values, interval, agg):
+    """Agregacja w przedziałach wyrównanych do wielokrotności 'interval' (jak GROUP BY time() w InfluxDB)"""
+    keep = ~np.isnan(values)
+    times, values = times[keep], values[keep]
+    if not len(times):
+        return np.empty(0, dtype=np.int64), values
+    order = np.argsort(times, kind='stable')
+    times, values = times[order], values[order]
+
+    buckets = (times // interval).astype(np.int64) * interval
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    if agg == 'mean':
+        result = np.add.reduceat(values, starts) / np.diff(np.r_[starts, len(values)])
+    elif agg == 'max':
+        result = np.maximum.reduceat(values, starts)
+    elif agg == 'min':
+        result = np.minimum.reduceat(values, starts)
+    else:
+        result = values[np.r_[starts[1:], len(values)] - 1]
+    return buckets[starts], result
+
+
+class RecentHistoryStore:
+    """Ostatnie okno odczytów wszystkich urządzeń w pamięci procesu.
+
+    Pojemność bufora wynika z okna i okresu pollera (plus zapas na odpytania
+    wymuszone pułapkami), więc pamięć serii jest stała: pojemność x 8 B na
+    wartości i tyle samo na wspólne znaczniki czasu urządzenia.  Zapisywane
+    są te same pola co do InfluxDB (export.numeric_fields), a zapytania
+    agregują tak jak GROUP BY time(), dzięki czemu część zakresu z pamięci
+    i część z bazy dają spójny wynik (history.query_history).
+    """
+
+    def __init__(self, window=None, interval=None, headroom=None):
+        self.window = window or RECENT_HISTORY_CONFIG['window']
+        interval = interval or POLLER_CONFIG['interval']
+        headroom = RECENT_HISTORY_CONFIG['headroom'] if headroom is None else headroom
+        self.capacity = max(1, int(math.ceil(self.window / interval * (1 + headroom))))
+        self.started_at = time.time()
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.stats = {"samples": 0, "queries": 0, "memory_queries": 0, "partial_queries": 0}
+
+    def append(self, device, data, timestamp=None):
+        """Zapisuje numeryczne pola odczytu urządzenia"""
+        timestamp = timestamp or time.time()
+        values = numeric_fields(data)
+        if not values:
+            return
+        with self._lock:
+            history = self._devices.get(device)
+            if history is None:
+                history = self._devices[device] = DeviceHistory(self.capacity, self.started_at)
+            history.append(timestamp, values)
+            self.stats["samples"] += 1
+
+    def forget(self, device):
+        with self._lock:
+            self._devices.pop(device, None)
+
+    def covered_from(self, device=None):
+        """Od kiedy pamięć ma komplet odczytów urządzenia (albo wszystkich urządzeń)"""
+        with self._lock:
+            if device is not None:
+                history = self._devices.get(device)
+                return history.covered_from if history else self.started_at
+            return max((h.covered_from for h in self._devices.values()), default=self.started_at)
+
+    def query(self, metrics, start, end, interval, agg='mean', device=None):
+        """Zagregowane serie z pamięci: (czasy, {metryka: wartości}) jak history.join_series"""
+        with self._lock:
+            histories = [self._devices[device]] if device in self._devices else []
+            if device is None:
+                histories = list(self._devices.values())
+            parts = [h.select(metrics, start, end) for h in histories]
+
+        columns = {}
+        for metric in metrics:
+            times = [t for t, values in parts if metric in values]
+            if not times:
+                columns[metric] = {}
+                continue
+            buckets, result = downsample(np.concatenate(times),
+                                         np.concatenate([values[metric] for _, values in parts if metric in values]),
+                                         interval, agg)
+            columns[metric] = dict(zip(buckets.tolist(), result.tolist()))
+
+        timestamps = sorted(set().union(*[c.keys() for c in columns.values()]))
+        return timestamps, {m: [columns[m].get(t) for t in timestamps] for m in metrics}
+
+    def record_query(self, source):
+        with self._lock:
+            self.stats["queries"] += 1
+            if source == "memory":
+                self.stats["memory_queries"] += 1
+            elif source == "memory+influx":
+                self.stats["partial_queries"] += 1
+
+    def metrics(self):
+        with self._lock:
+            devices = len(self._devices)
+            series = sum(len(h.values) for h in self._devices.values())
+            oldest = min((h.covered_from for h in self._devices.values()), default=None)
+            stats = dict(self.stats)
+        series_bytes = self.capacity * VALUE_BYTES
+        return dict(stats,
+                    window=self.window,
+                    capacity=self.capacity,
+                    devices=devices,
+                    series=series,
+                    bytes_per_series=series_bytes,
+                    memory_bytes=(series + devices) * series_bytes,
+                    covered_seconds=round(time.time() - oldest, 1) if oldest else 0.0)
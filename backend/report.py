@@ -1,13 +1,38 @@
-from fpdf import FPDF
 from datetime import datetime
-import matplotlib
-import matplotlib.pyplot as plt
-import tempfile
-import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import time
+import zlib
+from config import REPORT_CONFIG
 
-matplotlib.use('Agg')
+# fpdf i matplotlib (ok. 0,9 s importu) są wczytywane dopiero przy pierwszym raporcie,
+# żeby nie spowalniać startu aplikacji, która raportu może nigdy nie wygenerować
 
-class NetworkReport(FPDF):
+_report_cls = None
+
+def _report_class():
+    global _report_cls
+    if _report_cls is None:
+        from fpdf import FPDF
+        _report_cls = type('NetworkReport', (_NetworkReportMixin, FPDF), {})
+    return _report_cls
+
+def __getattr__(name):
+    # report.NetworkReport nadal dostępny, choć klasa powstaje dopiero przy użyciu
+    if name == 'NetworkReport':
+        return _report_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def load_plotting():
+    """Importuje matplotlib - inicjalizator procesów puli (zwykle już wczytany przez preload forkservera)"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    return Figure, FigureCanvasAgg
+
+class _NetworkReportMixin:
     def header(self):
         self.set_font('Arial', 'B', 15)
         self.cell(0, 10, 'Raport Monitoringu Sieci LAN', 0, 1, 'C')
@@ -30,6 +55,13 @@ class NetworkReport(FPDF):
         self.cell(0, 8, replace_pl(label), 0, 1, 'L', 1)
         self.ln(4)
 
+    def chart(self, info, x=10, w=190):
+        """Wstawia wykres wyrenderowany w pamięci - bez pliku tymczasowego"""
+        name = f"chart{len(self.images) + 1}"
+        # Kopia, bo FPDF usuwa dane obrazu po zapisaniu dokumentu
+        self.images[name] = dict(info, i=len(self.images) + 1)
+        self.image(name, x=x, w=w)
+
 def replace_pl(text):
     if not text: return ""
     text = str(text)
@@ -47,15 +79,11 @@ def parse_val(val):
     except:
         return 0
 
-def generate_chart(data, metric, title, ylabel, color):
-    if not data or len(data) < 2: 
-        return None
-    
-    data.sort(key=lambda x: x['timestamp'])
-    
+def chart_series(data, metric):
+    """Oś czasu i wartości metryki (CPU w %, RAM w MB) z wierszy historii"""
     x_axis = [x['timestamp'][11:19] for x in data]
     y_axis = []
-    
+
     for item in data:
         try:
             if metric == 'cpu':
@@ -65,38 +93,72 @@ def generate_chart(data, metric, title, ylabel, color):
         except:
             v = 0.0
         y_axis.append(v)
-    
-    plt.figure(figsize=(10, 4))
-    plt.plot(x_axis, y_axis, label=replace_pl(title), color=color, linewidth=2, marker='o', markersize=4)
-    
-    plt.title(replace_pl(title))
-    plt.xlabel('Czas')
-    plt.ylabel(replace_pl(ylabel))
-    plt.grid(True, linestyle='--', alpha=0.5)
-    plt.legend()
-    
+    return x_axis, y_axis
+
+def render_chart(data, metric, title, ylabel, color, dpi=100):
+    """Renderuje wykres obiektowym API matplotlib do obrazu RGB w pamięci.
+
+    Zwraca słownik obrazu w formacie FPDF (dane skompresowane zlib), który
+    można przekazać między procesami i wstawić przez NetworkReport.chart().
+    """
+    if not data or len(data) < 2:
+        return None
+
+    x_axis, y_axis = chart_series(sorted(data, key=lambda x: x['timestamp']), metric)
+
+    import numpy as np
+    Figure, FigureCanvasAgg = load_plotting()
+
+    # Własna figura zamiast globalnego stanu pyplot - bezpieczne przy wielu wątkach
+    fig = Figure(figsize=(10, 4), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    # Stałe marginesy zamiast tight_layout(), które wymaga dodatkowego przebiegu układu
+    fig.subplots_adjust(left=0.08, right=0.98, top=0.9, bottom=0.24)
+    ax = fig.add_subplot()
+    # Oś X numeryczna z etykietami czasu - konwerter kategorii parsuje każdy napis
+    positions = range(len(x_axis))
+    ax.plot(positions, y_axis, label=replace_pl(title), color=color, linewidth=2, marker='o', markersize=4)
+
+    ax.set_title(replace_pl(title))
+    ax.set_xlabel('Czas')
+    ax.set_ylabel(replace_pl(ylabel))
+    ax.grid(True, linestyle='--', alpha=0.5)
+    ax.legend(loc='upper left')
+
     if metric == 'cpu':
-        plt.ylim(0, 100)
-    
-    if len(x_axis) > 8:
-        step = len(x_axis) // 8
-        plt.xticks(ticks=range(0, len(x_axis), step), rotation=45)
-    else:
-        plt.xticks(rotation=45)
-    
-    plt.tight_layout()
-    
-    tmp_fd, tmp_path = tempfile.mkstemp(suffix='.png')
-    os.close(tmp_fd)
-    plt.savefig(tmp_path, format='png', dpi=100)
-    plt.close()
-    
-    return tmp_path
+        ax.set_ylim(0, 100)
 
-def create_report(curr, hist=None):
-    pdf = NetworkReport()
-    pdf.add_page()
-    
+    step = len(x_axis) // 8 if len(x_axis) > 8 else 1
+    ax.set_xticks(positions[::step], [x_axis[i] for i in positions[::step]], rotation=45)
+
+    canvas.draw()
+
+    rgba = np.asarray(canvas.buffer_rgba())
+    height, width = rgba.shape[:2]
+    return {
+        'w': width,
+        'h': height,
+        'cs': 'DeviceRGB',
+        'bpc': 8,
+        'f': 'FlateDecode',
+        'data': zlib.compress(rgba[:, :, :3].tobytes(), 6),
+    }
+
+def recent_rows(hist, limit=None):
+    limit = limit or REPORT_CONFIG['table_rows']
+    rows = sorted(hist or [], key=lambda x: x['timestamp'])
+    return rows, rows[-limit:]
+
+def render_charts(hist):
+    """Wykresy CPU i RAM dla historii urządzenia (uruchamiane także w puli procesów)"""
+    rows, _ = recent_rows(hist)
+    return [
+        render_chart(rows, 'cpu', 'Obciazenie CPU', '%', 'red'),
+        render_chart(rows, 'ram', 'Zuzycie RAM', 'MB', 'blue'),
+    ]
+
+def write_device_report(pdf, curr, hist=None, charts=None):
+    """Sekcje raportu jednego urządzenia; charts - gotowe wykresy z render_charts()"""
     pdf.section_title('1. Informacje o Urzadzeniu')
     pdf.set_font('Arial', '', 10)
     
@@ -123,7 +185,7 @@ def create_report(curr, hist=None):
     
     pdf.cell(35, 6, 'CPU:', 0, 0)
     
-    if float(cpu) > 80:
+    if parse_val(cpu) > 80:
         pdf.set_text_color(200, 0, 0)
     else:
         pdf.set_text_color(0, 128, 0)
@@ -152,8 +214,13 @@ def create_report(curr, hist=None):
         stat = str(curr.get(f'{p}_Status', '2')).strip()
         
         try:
-            in_mb = f"{float(curr.get(f'{p}_In', 0)) / 1048576:.2f} MB"
-            out_mb = f"{float(curr.get(f'{p}_Out', 0)) / 1048576:.2f} MB"
+            if f'{p}_InBps' in curr:
+                # Przepływność wyliczona z przyrostu liczników
+                in_mb = f"{float(curr[f'{p}_InBps']) / 1e6:.2f} Mb/s"
+                out_mb = f"{float(curr.get(f'{p}_OutBps', 0)) / 1e6:.2f} Mb/s"
+            else:
+                in_mb = f"{float(curr.get(f'{p}_In', 0)) / 1048576:.2f} MB"
+                out_mb = f"{float(curr.get(f'{p}_Out', 0)) / 1048576:.2f} MB"
         except:
             in_mb = out_mb = "0 MB"
 
@@ -177,26 +244,20 @@ def create_report(curr, hist=None):
         pdf.set_text_color(0)
         pdf.ln()
 
-    recent_data = []
-    if hist:
-        hist.sort(key=lambda x: x['timestamp'])
-        recent_data = hist[-20:] if len(hist) > 20 else hist
+    rows, recent_data = recent_rows(hist)
         
     if recent_data:
         pdf.add_page()
         
         pdf.section_title('4. Wykresy Historii')
         
-        img_cpu = generate_chart(recent_data, 'cpu', 'Obciazenie CPU', '%', 'red')
+        img_cpu, img_ram = charts if charts is not None else render_charts(rows)
         if img_cpu:
-            pdf.image(img_cpu, x=10, w=190)
-            os.remove(img_cpu)
+            pdf.chart(img_cpu, x=10, w=190)
             pdf.ln(5)
             
-        img_ram = generate_chart(recent_data, 'ram', 'Zuzycie RAM', 'MB', 'blue')
         if img_ram:
-            pdf.image(img_ram, x=10, w=190)
-            os.remove(img_ram)
+            pdf.chart(img_ram, x=10, w=190)
             pdf.ln(10)
 
         pdf.section_title('5. Tabela Pomiary')
@@ -231,5 +292,130 @@ def create_report(curr, hist=None):
         pdf.ln(10)
         pdf.cell(0, 10, replace_pl("Brak danych historycznych."), 0, 1, 'C')
 
+def pdf_bytes(pdf):
     # Wystepowal blad kodowania znakow, jesli ktorys znak nie zostanie rozpoznany zostanie zastapiony "?"
-    return pdf.output(dest='S').encode('latin-1', 'replace')
\ No newline at end of file
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+def create_report(curr, hist=None):
+    pdf = _report_class()()
+    pdf.add_page()
+    write_device_report(pdf, curr, hist)
+    return pdf_bytes(pdf)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Moduły wczytywane raz w procesie forkserver - procesy puli dziedziczą je przy forku
+POOL_PRELOAD = ['report', 'matplotlib.figure', 'matplotlib.backends.backend_agg']
+
+def get_pool():
+    """Pula procesów renderujących wykresy, tworzona przy pierwszym raporcie zbiorczym.
+
+    Procesy powstają z forkserver - czystego procesu bez wątków aplikacji
+    (fork działającej aplikacji mógł zakleszczyć się na blokadach pollera,
+    writera czy odbiornika powiadomień).  Preload bez '__main__', więc
+    moduł główny (app.py z pollerem i połączeniem do bazy) nie jest
+    importowany ponownie, jak przy spawn.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(POOL_PRELOAD)
+            _pool = ProcessPoolExecutor(max_workers=REPORT_CONFIG['workers'], mp_context=context,
+                                        initializer=load_plotting)
+        return _pool
+
+def reset_pool(broken):
+    """Porzuca pulę po awarii procesu (BrokenProcessPool) - kolejny raport tworzy nową"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def create_multi_report(devices, pool=None):
+    """Raport zbiorczy: devices - lista słowników {name, data, history}.
+
+    Wykresy (najdroższa część) renderowane są równolegle w puli procesów,
+    a dokument składany jest w procesie wywołującym.
+    """
+    histories = [recent_rows(d.get('history'))[0] for d in devices]
+    chunksize = max(1, len(devices) // (REPORT_CONFIG['workers'] * 4))
+    if pool is not None:
+        charts = list(pool.map(render_charts, histories, chunksize=chunksize))
+    else:
+        pool = get_pool()
+        try:
+            charts = list(pool.map(render_charts, histories, chunksize=chunksize))
+        except BrokenProcessPool:
+            # Proces puli padł (np. OOM killer) - jedna próba na nowej puli zamiast błędu do restartu
+            reset_pool(pool)
+            charts = list(get_pool().map(render_charts, histories, chunksize=chunksize))
+
+    pdf = _report_class()()
+    pdf.add_page()
+    pdf.section_title(f'Podsumowanie ({len(devices)} urzadzen)')
+    pdf.set_font('Arial', 'B', 9)
+    widths = [60, 50, 30, 40]
+    for i, h in enumerate(['Urzadzenie', 'Host', 'CPU %', 'RAM (MB)']):
+        pdf.cell(widths[i], 7, h, 1, 0, 'C')
+    pdf.ln()
+    pdf.set_font('Arial', '', 9)
+    for device in devices:
+        data = device.get('data') or {}
+        try:
+            ram = f"{float(data.get('ramUsage', 0)) / 1048576:.2f}"
+        except:
+            ram = "0"
+        pdf.cell(widths[0], 7, replace_pl(device['name']), 1)
+        pdf.cell(widths[1], 7, replace_pl(data.get('sysName', 'N/A')), 1)
+        pdf.cell(widths[2], 7, replace_pl(data.get('cpuUsage', 'N/A')), 1, 0, 'C')
+        pdf.cell(widths[3], 7, ram, 1, 0, 'C')
+        pdf.ln()
+
+    for device, device_charts in zip(devices, charts):
+        pdf.add_page()
+        pdf.section_title(f"Urzadzenie: {device['name']}")
+        write_device_report(pdf, device.get('data') or {}, device.get('history'), device_charts)
+    return pdf_bytes(pdf)
+
+
+class ReportCache:
+    """Gotowe raporty wg (urządzenie, okno czasu) - ponowne pobranie nie renderuje PDF"""
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl if ttl is not None else REPORT_CONFIG['cache_ttl']
+        self.max_entries = max_entries or REPORT_CONFIG['cache_size']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, device, hours, now=None):
+        # Okno wyrównane do TTL, żeby kolejne pobrania trafiały w ten sam wpis
+        bucket = int((now or time.time()) // self.ttl) if self.ttl > 0 else 0
+        return (device, hours, bucket)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = (body, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def metrics(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
\ No newline at end of file
@@ -0,0 +1,248 @@
+import math
+import time
+import logging
+import threading
+
+from history import parse_duration, identifier, MIN_INTERVAL
+from config import RETENTION_CONFIG
+
+logger = logging.getLogger("SNMP-Retention")
+
+MEASUREMENT = "snmp_metrics"
+
+# Pola poziomu rollup wg agregacji zapytania; średnia trafia do "value", jak w surowych odczytach
+ROLLUP_FIELDS = {
+    'mean': 'value',
+    'max': 'value_max',
+    'min': 'value_min',
+    'last': 'value_last',
+}
+
+
+def _duration(text):
+    """Czas przechowania w sekundach; 0 = bez limitu ('inf')"""
+    text = str(text).strip().lower()
+    return 0 if text in ('', '0', 'inf') else parse_duration(text)
+
+
+def _influx_duration(seconds):
+    return f"{seconds}s" if seconds else "INF"
+
+
+def parse_tiers(options):
+    """Poziomy od najdrobniejszego: surowe odczyty, potem rollupy z options['rollups'] ('1m:90d,1h:730d')"""
+    tiers = [{"name": "raw", "policy": identifier(options['raw_policy']), "resolution": MIN_INTERVAL,
+              "duration": _duration(options['raw_duration']), "source": None}]
+    for item in options['rollups'].split(','):
+        if not item.strip():
+            continue
+        name, _, duration = item.strip().partition(':')
+        resolution = parse_duration(name)
+        previous = tiers[-1]["resolution"]
+        if resolution <= previous or resolution % previous:
+            raise ValueError(f"Rozdzielczość poziomu {name} musi być wielokrotnością poprzedniego ({previous} s)")
+        tiers.append({"name": name, "policy": f"rollup_{name}", "resolution": resolution,
+                      "duration": _duration(duration), "source": tiers[-1]})
+    return tiers
+
+
+def rollup_query(database, tier, start=None, end=None):
+    """SELECT INTO zwijający poziom źródłowy do 'tier'; bez zakresu - treść continuous query"""
+    source = tier["source"]
+    fields = ', '.join(f'{agg}("{field if source["source"] else "value"}") AS "{field}"'
+                       for agg, field in ROLLUP_FIELDS.items())
+    where = f' WHERE time >= {int(start)}s AND time < {int(end)}s' if start is not None else ''
+    return (
+        f'SELECT {fields} INTO "{database}"."{tier["policy"]}"."{MEASUREMENT}" '
+        f'FROM "{database}"."{source["policy"]}"."{MEASUREMENT}"{where} '
+        f'GROUP BY time({tier["resolution"]}s), *'
+    )
+
+
+class RetentionManager:
+    """Polityki przechowywania i zwijanie historii w InfluxDB.
+
+    Surowe odczyty trafiają do domyślnej polityki bazy (ograniczonej do
+    'raw_duration'), a każdy poziom rollup to osobna polityka z tą samą
+    miarą snmp_metrics, w której przedział 'resolution' ma pola średniej,
+    maksimum, minimum i ostatniej wartości.  Poziom jest liczony z
+    poprzedniego (1h z 1m), przez continuous query InfluxDB albo - w trybie
+    'job' - przez to samo zapytanie SELECT INTO wysyłane cyklicznie przez backend.
+    Zapytania historii wybierają najtańszy poziom (choose_tier, sources).
+    """
+
+    def __init__(self, client, database, **options):
+        self.options = dict(RETENTION_CONFIG, **options)
+        if self.options['mode'] not in ('cq', 'job'):
+            raise ValueError(f"Nieznany tryb zwijania: {self.options['mode']}")
+        self.client = client
+        self.database = identifier(database)
+        self.tiers = parse_tiers(self.options)
+        self.ready = False
+        self._watermarks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"rollup_queries": 0, "errors": 0}
+        self.stats.update({f"queries_{tier['name']}": 0 for tier in self.tiers})
+
+    # Konfiguracja bazy
+
+    def setup(self, now=None):
+        """Tworzy lub aktualizuje polityki i continuous queries (idempotentne)"""
+        now = now or time.time()
+        existing = {p['name'] for p in self.client.get_list_retention_policies(self.database)}
+        created = []
+        for tier in self.tiers[1:]:
+            duration = _influx_duration(tier["duration"])
+            if tier["policy"] in existing:
+                self.client.alter_retention_policy(tier["policy"], self.database, duration=duration)
+            else:
+                self.client.create_retention_policy(tier["policy"], duration, 1, self.database)
+                created.append(tier)
+
+        # Nowy poziom uzupełniamy z istniejących danych, zanim skrócimy przechowywanie surowych odczytów
+        for tier in created:
+            first = self._edge_time(tier["source"], 'first')
+            if first is not None:
+                start = max(first, now - tier["duration"]) if tier["duration"] else first
+                self.backfill(tier, start, self._closed_until(tier, now))
+                logger.info(f"Uzupełniono poziom {tier['name']} od {time.strftime('%Y-%m-%d %H:%M', time.gmtime(start))} UTC")
+
+        queries = {}
+        for entry in self.client.get_list_continuous_queries():
+            queries.update({q['name']: q for q in entry.get(self.database, [])})
+        for tier in self.tiers[1:]:
+            name = f"snmp_rollup_{tier['name']}"
+            # Definicja mogła się zmienić (rozdzielczość, źródło) - continuous query nie da się zmienić, tylko utworzyć ponownie
+            if name in queries:
+                self.client.drop_continuous_query(name, self.database)
+            if self.options['mode'] == 'cq':
+                # Ponowne przeliczenie poprzedniego przedziału obejmuje odczyty czekające w buforze writera
+                resample = f"RESAMPLE EVERY {tier['resolution']}s FOR {2 * tier['resolution']}s"
+                self.client.query(f'CREATE CONTINUOUS QUERY "{name}" ON "{self.database}" {resample} '
+                                  f'BEGIN {rollup_query(self.database, tier)} END')
+
+        raw = self.tiers[0]
+        duration = _influx_duration(raw["duration"])
+        if raw["policy"] in existing:
+            self.client.alter_retention_policy(raw["policy"], self.database, duration=duration, default=True)
+        else:
+            self.client.create_retention_policy(raw["policy"], duration, 1, self.database, default=True)
+        self.ready = True
+        logger.info("Polityki przechowywania gotowe: " + ", ".join(
+            f"{t['name']}={_influx_duration(t['duration'])}" for t in self.tiers) + f" (zwijanie: {self.options['mode']})")
+
+    def _edge_time(self, tier, selector):
+        """Czas najstarszego ('first') albo najnowszego ('last') punktu poziomu"""
+        result = self.client.query(f'SELECT {selector}("value") FROM "{self.database}"."{tier["policy"]}"."{MEASUREMENT}"',
+                                   epoch='s')
+        points = list(result.get_points())
+        return points[0]['time'] if points else None
+
+    # Zwijanie
+
+    def _closed_until(self, tier, now):
+        """Koniec ostatniego zamkniętego przedziału poziomu"""
+        return int(now // tier["resolution"]) * tier["resolution"]
+
+    def backfill(self, tier, start, end):
+        """Przelicza poziom w [start, end) zapytaniami SELECT INTO po 'backfill_chunk'"""
+        resolution = tier["resolution"]
+        chunk = max(resolution, parse_duration(self.options['backfill_chunk']) // resolution * resolution)
+        position = int(start // resolution) * resolution
+        while position < end:
+            self.client.query(rollup_query(self.database, tier, position, min(position + chunk, end)))
+            with self._lock:
+                self.stats["rollup_queries"] += 1
+            position += chunk
+
+    def run_rollups(self, now=None):
+        """Tryb 'job': zwija przedziały zamknięte od poprzedniego przebiegu (ostatni liczony ponownie)"""
+        now = now or time.time()
+        for tier in self.tiers[1:]:
+            resolution = tier["resolution"]
+            end = self._closed_until(tier, now)
+            start = self._watermarks.get(tier["name"])
+            if start is None:
+                # Po restarcie - od ostatniego przedziału zapisanego w poziomie
+                start = self._edge_time(tier, 'last') or end - resolution
+            self.backfill(tier, min(start, end - 2 * resolution), end)
+            self._watermarks[tier["name"]] = end
+
+    # Wybór poziomu dla zapytań historii
+
+    def complete_until(self, tier, now=None):
+        """Do kiedy poziom ma ostateczne wartości - ostatni przedział jest jeszcze przeliczany"""
+        if tier["source"] is None:
+            return math.inf
+        return self._closed_until(tier, now or time.time()) - tier["resolution"]
+
+    def choose_tier(self, start, end, interval, now=None):
+        """(poziom, przedział agregacji): najgrubszy poziom o rozdzielczości nie większej niż 'interval'
+        i przechowaniu obejmującym 'start'; przedział jest zaokrąglany do wielokrotności rozdzielczości
+        """
+        if not self.ready:
+            return self.tiers[0], interval
+        now = now or time.time()
+        covering = [t for t in self.tiers if not t["duration"] or start >= now - t["duration"]]
+        eligible = [t for t in covering if t["resolution"] <= interval]
+        if eligible:
+            tier = eligible[-1]
+        elif covering:
+            tier = covering[0]
+        else:
+            # Zakres starszy niż wszystkie poziomy - najdłużej przechowywany ma go najwięcej
+            tier = max(self.tiers, key=lambda t: t["duration"])
+        if tier["source"] is not None:
+            interval = int(math.ceil(interval / tier["resolution"])) * tier["resolution"]
+        return tier, interval
+
+    def sources(self, tier, agg, start, end, interval, now=None):
+        """Zakresy zapytań [(polityka, pole, start, end)] dla [start, end) na poziomie 'tier'.
+
+        Końcówka, której poziom jeszcze nie zwinął, jest czytana z poziomu
+        źródłowego (1h -> 1m -> surowe odczyty); granice leżą na krawędziach
+        przedziału agregacji.
+        """
+        with self._lock:
+            self.stats[f"queries_{tier['name']}"] += 1
+        return [part for part in self._sources(tier, agg, start, end, interval, now) if part[3] > part[2]]
+
+    def _sources(self, tier, agg, start, end, interval, now):
+        if tier["source"] is None:
+            return [(tier["policy"], 'value', start, end)]
+        boundary = int(self.complete_until(tier, now) // interval) * interval
+        boundary = min(end, max(start, boundary))
+        return ([(tier["policy"], ROLLUP_FIELDS[agg], start, boundary)]
+                + self._sources(tier["source"], agg, boundary, end, interval, now))
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, ready=self.ready, tiers=len(self.tiers),
+                        raw_duration=self.tiers[0]["duration"])
+
+    # Wątek tła: konfiguracja (ponawiana, gdy InfluxDB jest niedostępny) i zwijanie w trybie 'job'
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="retention")
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                if not self.ready:
+                    self.setup()
+                elif self.options['mode'] == 'job':
+                    self.run_rollups()
+            except Exception as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                logger.error(f"Błąd polityk przechowywania: {e}")
+            if self._stop.wait(self.options['interval']):
+                return
+
+    def stop(self):
+        self._stop.set()
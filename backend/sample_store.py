@@ -0,0 +1,121 @@
+import json
+import time
+import hashlib
+import threading
+from collections import namedtuple
+
+# Gotowa do wysłania migawka danych urządzenia
+Sample = namedtuple('Sample', ['data', 'body', 'etag', 'updated_at', 'changed_at', 'ok'])
+
+
+def has_errors(data):
+    return any("Error" in str(val) or "Exception" in str(val) for val in data.values())
+
+
+class Subscription:
+    """Kolejka zmian dla jednego odbiorcy strumienia.
+
+    Kolejne zmiany tego samego urządzenia są scalane, więc wolny odbiorca
+    dostaje tylko najnowsze wartości, a pamięć nie rośnie z jego opóźnieniem.
+    """
+
+    def __init__(self, devices=None):
+        self.devices = set(devices) if devices else None
+        self._pending = {}
+        self._cond = threading.Condition()
+
+    def push(self, device, changes):
+        if self.devices is not None and device not in self.devices:
+            return
+        with self._cond:
+            self._pending.setdefault(device, {}).update(changes)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Czeka na zmiany i zwraca je scalone jako {urządzenie: {pole: wartość}}"""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            pending, self._pending = self._pending, {}
+            return pending
+
+
+class LatestSampleStore:
+    """Przechowuje ostatni odczyt każdego urządzenia publikowany przez poller w tle"""
+
+    def __init__(self, stale_after=30.0):
+        self.stale_after = stale_after
+        self._samples = {}
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, device, data):
+        """Zapisuje nowy odczyt; JSON i ETag są liczone raz, a nie przy każdym żądaniu HTTP"""
+        now = time.time()
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()[:20]
+
+        with self._lock:
+            previous = self._samples.get(device)
+            changed_at = previous.changed_at if previous and previous.etag == etag else now
+            sample = Sample(dict(data), body, etag, now, changed_at, not has_errors(data))
+            self._samples[device] = sample
+            subscribers = list(self._subscribers)
+
+        # Różnica liczona raz i rozsyłana do wszystkich odbiorców
+        if subscribers and (previous is None or previous.etag != etag):
+            old = previous.data if previous else {}
+            changes = {k: v for k, v in data.items() if old.get(k) != v}
+            for subscription in subscribers:
+                subscription.push(device, changes)
+        return sample
+
+    def subscribe(self, devices=None):
+        subscription = Subscription(devices)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def get(self, device):
+        with self._lock:
+            return self._samples.get(device)
+
+    def devices(self):
+        with self._lock:
+            return dict(self._samples)
+
+    def forget(self, device):
+        """Usuwa odczyt urządzenia usuniętego z inwentarza"""
+        with self._lock:
+            self._samples.pop(device, None)
+
+    def age(self, sample):
+        return time.time() - sample.updated_at
+
+    def is_stale(self, sample):
+        return self.age(sample) > self.stale_after
+
+    def status(self, sample):
+        """Status urządzenia na podstawie ostatniego odczytu"""
+        if sample is None:
+            return "unknown"
+        if self.is_stale(sample):
+            return "stale"
+        return "connected" if sample.ok else "failed"
+
+    def metadata(self, sample):
+        return {
+            "status": self.status(sample),
+            "updated_at": sample.updated_at,
+            "changed_at": sample.changed_at,
+            "age": round(self.age(sample), 2),
+            "stale": self.is_stale(sample),
+        }
@@ -0,0 +1,212 @@
+import time
+import zlib
+import heapq
+import random
+import logging
+import itertools
+from collections import deque
+
+from config import POLLER_CONFIG
+
+logger = logging.getLogger("SNMP-Scheduler")
+
+MAX_BACKOFF_EXPONENT = 32
+
+
+class PollJob:
+    """Cykliczne odpytanie jednej grupy OID jednego urządzenia"""
+
+    __slots__ = ('device', 'group', 'interval', 'phase', 'due', 'running', 'started', 'generation')
+
+    def __init__(self, device, group, interval):
+        self.device = device
+        self.group = group
+        self.interval = interval
+        # Stałe przesunięcie w siatce okresu - zadania nie startują wszystkie naraz
+        self.phase = zlib.crc32(f"{device}/{group}".encode('utf-8')) / 2 ** 32 * interval
+        self.due = None
+        self.running = False
+        self.started = None
+        self.generation = 0
+
+
+class DeviceHealth:
+    """Licznik kolejnych timeoutów i stan wyłącznika urządzenia"""
+
+    __slots__ = ('failures', 'open', 'retry_at', 'probing')
+
+    def __init__(self):
+        self.failures = 0
+        self.open = False
+        self.retry_at = 0.0
+        self.probing = False
+
+
+class PollScheduler:
+    """Kolejka priorytetowa (kopiec czasów) zadań odpytania.
+
+    Terminy leżą na siatce okresu grupy (czas ścienny + stałe przesunięcie
+    zadania), więc czas trwania odpytania nie przesuwa kolejnych startów.
+    Zadanie, którego poprzednie wykonanie jeszcze trwa, pomija termin
+    (przepełnienie).  Po 'failure_threshold' kolejnych timeoutach wyłącznik
+    urządzenia się otwiera: kolejne próby idą pojedynczo co coraz dłuższy
+    czas (x2, do 'backoff_max'), a pozostałe grupy czekają na odpowiedź.
+
+    Metody przyjmują bieżący czas 'now' zegara pętli (monotonicznego).
+    """
+
+    def __init__(self, clock=time.monotonic, **options):
+        self.options = dict(POLLER_CONFIG, **options)
+        self._heap = []
+        self._counter = itertools.count()
+        self._jobs = {}
+        # Grupy zadań urządzenia - usuwanie bez przeglądania wszystkich zadań
+        self._groups = {}
+        self._health = {}
+        # Przesunięcie zegara monotonicznego względem ściennego - siatka wyrównana do pełnych okresów
+        self._epoch = time.time() - clock()
+        self._lags = deque(maxlen=1000)
+        self.stats = {"dispatched": 0, "overruns": 0, "suppressed": 0, "circuits_opened": 0}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _push(self, job, due):
+        job.due = due
+        job.generation += 1
+        heapq.heappush(self._heap, (due, next(self._counter), job, job.generation))
+
+    def _next_slot(self, job, after):
+        """Pierwszy termin siatki zadania po chwili 'after' (z losowym rozrzutem)"""
+        if job.interval <= 0:
+            return after
+        wall = after + self._epoch
+        slot = job.phase + (int((wall - job.phase) // job.interval) + 1) * job.interval
+        jitter = random.uniform(0, self.options['jitter']) * job.interval
+        return slot + jitter - self._epoch
+
+    # Zadania
+
+    def add(self, device, group, interval, now, first_within=None):
+        """Dodaje zadanie; pierwsze wykonanie w ciągu 'first_within' s (domyślnie jednego okresu)"""
+        self.remove(device, group)
+        job = PollJob(device, group, interval)
+        self._jobs[(device, group)] = job
+        self._groups.setdefault(device, set()).add(group)
+        self._health.setdefault(device, DeviceHealth())
+        spread = min(interval, interval if first_within is None else first_within)
+        self._push(job, now + (job.phase / interval * spread if interval > 0 else 0.0))
+        return job
+
+    def remove(self, device, group=None):
+        groups = self._groups.get(device, set())
+        for name in ([group] if group is not None else list(groups)):
+            job = self._jobs.pop((device, name), None)
+            if job is not None:
+                # Wpis w kopcu zostaje i jest pomijany po generacji
+                job.generation += 1
+            groups.discard(name)
+        if not groups:
+            self._groups.pop(device, None)
+        if group is None:
+            self._health.pop(device, None)
+
+    def jobs(self, device):
+        return [self._jobs[(device, group)] for group in self._groups.get(device, ())]
+
+    def trigger(self, device, group, now, min_gap=0.0):
+        """Przyspiesza zadanie do chwili obecnej (z zachowaniem min. odstępu od poprzedniego startu)"""
+        job = self._jobs.get((device, group))
+        if job is None or job.running:
+            return False
+        due = now if job.started is None else max(now, job.started + min_gap)
+        health = self._health[device]
+        if health.open:
+            # Sygnał od urządzenia (np. pułapka) - próba bez czekania na koniec backoffu
+            health.retry_at = min(health.retry_at, due)
+        if due < job.due:
+            self._push(job, due)
+        return True
+
+    # Wydawanie zadań
+
+    def next_delay(self, now):
+        """Czas do najbliższego terminu [s] albo None przy pustej kolejce"""
+        while self._heap:
+            due, _, job, generation = self._heap[0]
+            if generation == job.generation:
+                return max(0.0, due - now)
+            heapq.heappop(self._heap)
+        return None
+
+    def due(self, now):
+        """Zadania do uruchomienia teraz; oznaczane jako trwające do finished()"""
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, job, generation = heapq.heappop(self._heap)
+            if generation != job.generation:
+                continue
+            if job.running:
+                # Poprzednie wykonanie wciąż trwa - pomijamy termin zamiast kolejkować zaległości
+                self.stats["overruns"] += 1
+                self._push(job, self._next_slot(job, now))
+                continue
+            health = self._health[job.device]
+            if health.open:
+                if health.probing or now < health.retry_at:
+                    self.stats["suppressed"] += 1
+                    self._push(job, max(health.retry_at, self._next_slot(job, now)))
+                    continue
+                health.probing = True
+            job.running = True
+            job.started = now
+            self._lags.append(now - due)
+            self.stats["dispatched"] += 1
+            ready.append(job)
+        return ready
+
+    def finished(self, job, status, now):
+        """Rozlicza wykonanie i planuje kolejny termin zadania"""
+        job.running = False
+        if self._jobs.get((job.device, job.group)) is not job:
+            return
+        health = self._health[job.device]
+        health.probing = False
+        if status == 'timeout':
+            health.failures += 1
+            if health.failures >= self.options['failure_threshold']:
+                if not health.open:
+                    self.stats["circuits_opened"] += 1
+                    logger.warning(f"{job.device} nie odpowiada ({health.failures} timeoutów) - odpytania wstrzymane")
+                health.open = True
+                base = max(job.interval, self.options['timeout'])
+                # Wykładnik ograniczony - float * 2**1024 to OverflowError, a zadanie wypadłoby z kopca
+                backoff = base * 2 ** min(health.failures - self.options['failure_threshold'], MAX_BACKOFF_EXPONENT)
+                health.retry_at = now + min(backoff, self.options['backoff_max'])
+                self._push(job, health.retry_at)
+                return
+        else:
+            # Każda odpowiedź (także błąd SNMP) oznacza, że urządzenie żyje
+            if health.open:
+                logger.info(f"{job.device} odpowiada ponownie po {health.failures} nieudanych próbach")
+            health.failures = 0
+            health.open = False
+        self._push(job, self._next_slot(job, now))
+
+    def is_open(self, device):
+        health = self._health.get(device)
+        return bool(health and health.open)
+
+    def metrics(self):
+        lags = sorted(self._lags)
+
+        def percentile(q):
+            return round(lags[min(len(lags) - 1, int(len(lags) * q))] * 1000, 1) if lags else 0.0
+
+        return dict(self.stats,
+                    jobs=len(self._jobs),
+                    running=sum(1 for job in self._jobs.values() if job.running),
+                    open_circuits=sum(1 for health in self._health.values() if health.open),
+                    lag_p50_ms=percentile(0.5),
+                    lag_p95_ms=percentile(0.95),
+                    lag_max_ms=round(lags[-1] * 1000, 1) if lags else 0.0)
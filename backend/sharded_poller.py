@@ -0,0 +1,426 @@
+import os
+import time
+import zlib
+import signal
+import asyncio
+import marshal
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+import prometheus
+from poller import AsyncPoller
+from usm_cache import UsmKeyCache
+from config import OIDS, POLLER_CONFIG
+
+logger = logging.getLogger("SNMP-ShardedPoller")
+
+# Okres wysyłania statystyk przez proces pollera [s]
+STATS_INTERVAL = 1.0
+# Okno liczenia restartów procesu [s]
+RESTART_WINDOW = 300.0
+
+
+def shard_for(name, shards):
+    """Shard urządzenia (hashowanie rendezvous) - stały dla danej nazwy i zbioru shardów.
+
+    Po wyłączeniu shardu przenoszone są tylko jego urządzenia, reszta zostaje na miejscu.
+    """
+    return max(shards, key=lambda shard: zlib.crc32(f"{shard}/{name}".encode('utf-8')))
+
+
+# Proces pollera
+
+def _send(conn, *message):
+    conn.send_bytes(marshal.dumps(message))
+
+
+def _worker_main(shard, devices, oids, options, conn):
+    """Pętla procesu pollera: własny silnik SNMP i pętla zdarzeń dla urządzeń shardu"""
+    # Zamykaniem procesów zarządza nadzorca; Ctrl+C w terminalu trafia tylko do niego
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Histogram etapów skopiowany przy fork() należy do nadzorcy
+    prometheus.stage_seconds.reset()
+    parent_pid = os.getppid()
+    interfaces = {}
+
+    def on_result(name, data, state):
+        _send(conn, "result", name, data, state)
+        known = poller.discovery.interfaces(name)
+        if known != interfaces.get(name):
+            interfaces[name] = known
+            _send(conn, "interfaces", name, known)
+
+    # Świeża pamięć USM - stan skopiowany przy fork() mógł mieć zajęte blokady
+    poller = AsyncPoller(devices, oids=oids, on_result=on_result, usm_cache=UsmKeyCache(), **options)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        main = asyncio.ensure_future(poller.run())
+
+        def on_command():
+            try:
+                while conn.poll():
+                    command, *args = marshal.loads(conn.recv_bytes())
+                    if command == "trigger":
+                        poller.trigger(args[0])
+                    elif command == "add":
+                        poller.add_device(args[0])
+                    elif command == "remove":
+                        poller.remove_device(args[0])
+                    elif command == "update":
+                        poller.update_device(args[0])
+                    elif command == "stop":
+                        main.cancel()
+            except (EOFError, OSError):
+                # Proces nadzorcy zniknął
+                main.cancel()
+
+        def report_stats():
+            if os.getppid() != parent_pid:
+                # Nadzorca zginął, a koniec potoku mogą trzymać procesy innych shardów
+                main.cancel()
+                return
+            _send(conn, "stats", poller.stats.snapshot(), poller.usm_cache.metrics(),
+                  poller.stats.device_counts(), prometheus.stage_seconds.snapshot())
+            loop.call_later(STATS_INTERVAL, report_stats)
+
+        loop.add_reader(conn.fileno(), on_command)
+        report_stats()
+        try:
+            await main
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.remove_reader(conn.fileno())
+
+    try:
+        asyncio.run(run())
+    except (BrokenPipeError, EOFError):
+        pass
+    finally:
+        conn.close()
+
+
+# Nadzorca
+
+class Shard:
+    """Stan procesu pollera widziany przez nadzorcę"""
+
+    def __init__(self, index):
+        self.index = index
+        self.devices = {}
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.exits = deque()
+        self.restart_at = None
+        self.failed = False
+        self.stats = {}
+        self.usm = {}
+        self.device_counts = {}
+        self.stages = {}
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def send(self, *message):
+        with self.send_lock:
+            if self.conn is None:
+                return False
+            try:
+                _send(self.conn, *message)
+                return True
+            except (BrokenPipeError, OSError):
+                return False
+
+
+def _sum_metrics(dicts):
+    total = {}
+    for metrics in dicts:
+        for key, value in metrics.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if key.startswith('lag_'):
+                    # Opóźnienia harmonogramu - liczy się najgorszy proces
+                    total[key] = max(total.get(key, 0), value)
+                else:
+                    total[key] = round(total.get(key, 0) + value, 3)
+    return total
+
+
+class ShardedStats:
+    """Sumaryczne statystyki procesów pollera (ten sam format co PollerStats.snapshot())"""
+
+    def __init__(self, poller):
+        self.poller = poller
+
+    def snapshot(self):
+        shards = self.poller.shards
+        snapshot = _sum_metrics(shard.stats for shard in shards)
+        snapshot.update(
+            workers=sum(1 for shard in shards if shard.alive),
+            failed_workers=[shard.index for shard in shards if shard.failed],
+            restarts=self.poller.restarts,
+            shards={shard.index: len(shard.devices) for shard in shards},
+        )
+        return snapshot
+
+    def device_counts(self):
+        # Liczniki procesu, który padł, przepadają razem z nim (reset licznika dla Prometheusa)
+        counts = {}
+        for shard in self.poller.shards:
+            for name, device in shard.device_counts.items():
+                if name in shard.devices:
+                    counts[name] = device
+        return counts
+
+    def stage_snapshots(self):
+        return [shard.stages for shard in self.poller.shards if shard.stages]
+
+
+class ShardedUsmMetrics:
+    """Suma metryk pamięci USM procesów pollera"""
+
+    def __init__(self, poller):
+        self.poller = poller
+
+    def metrics(self):
+        shards = [shard.usm for shard in self.poller.shards if shard.usm]
+        metrics = _sum_metrics(shards)
+        # Każdy proces wczytuje cały plik pamięci - rozmiary się nie sumują
+        for key in ("master_keys", "engines"):
+            metrics[key] = max((usm.get(key, 0) for usm in shards), default=0)
+        for name, hits, misses in (("master_hit_rate", "master_hits", "master_misses"),
+                                   ("engine_hit_rate", "engine_hits", "engine_misses")):
+            total = metrics.get(hits, 0) + metrics.get(misses, 0)
+            metrics[name] = round(metrics[hits] / total, 3) if total else None
+        return metrics
+
+
+class ShardedDiscovery:
+    """Interfejsy odkryte przez procesy pollera (kopia przesyłana razem z wynikami)"""
+
+    def __init__(self):
+        self._interfaces = {}
+
+    def interfaces(self, name):
+        return dict(self._interfaces.get(name) or {})
+
+    def update(self, name, interfaces):
+        self._interfaces[name] = interfaces
+
+    def forget(self, name):
+        self._interfaces.pop(name, None)
+
+
+class ShardedPoller:
+    """Poller dzielący inwentarz między kilka procesów.
+
+    Pojedynczy AsyncPoller jest ograniczony jednym rdzeniem (kryptografia USM,
+    kodowanie BER).  Nadzorca przypisuje urządzenia do shardów hashowaniem
+    rendezvous; każdy shard to osobny proces z własną pętlą zdarzeń i silnikiem
+    SNMP.  Wyniki wracają potokiem (marshal) i trafiają do on_result w wątku
+    nadzorcy.  Proces, który padnie, jest uruchamiany ponownie; po
+    przekroczeniu limitu restartów jego urządzenia przechodzą do pozostałych
+    shardów.  Interfejs (run_forever, trigger, stats, discovery, usm_cache)
+    jest zgodny z AsyncPoller.
+    """
+
+    def __init__(self, devices, oids=None, on_result=None, workers=None, **options):
+        self.options = dict(POLLER_CONFIG, **options)
+        self.oids = oids or OIDS
+        self.on_result = on_result
+        self.devices = {d['name']: d for d in devices}
+        self.shards = [Shard(i) for i in range(max(1, workers or self.options['workers']))]
+        self.stats = ShardedStats(self)
+        self.usm_cache = ShardedUsmMetrics(self)
+        self.discovery = ShardedDiscovery()
+        self.restarts = 0
+        self._context = multiprocessing.get_context('fork')
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        live = [shard.index for shard in self.shards]
+        for name, device in self.devices.items():
+            self.shards[shard_for(name, live)].devices[name] = device
+
+    def _live_shards(self):
+        return [shard.index for shard in self.shards if not shard.failed]
+
+    def _owner(self, name):
+        for shard in self.shards:
+            if name in shard.devices:
+                return shard
+        return None
+
+    # Procesy
+
+    def _spawn(self, shard):
+        parent_conn, child_conn = self._context.Pipe()
+        # Opcje nadzorcy (workers itd.) są w procesie pollera ignorowane
+        shard.process = self._context.Process(
+            target=_worker_main,
+            args=(shard.index, list(shard.devices.values()), self.oids, self.options, child_conn),
+            name=f"poller-shard-{shard.index}",
+            daemon=True
+        )
+        shard.process.start()
+        child_conn.close()
+        with shard.send_lock:
+            shard.conn = parent_conn
+        shard.restart_at = None
+        logger.info(f"Shard {shard.index}: proces {shard.process.pid}, {len(shard.devices)} urządzeń")
+
+    def _on_exit(self, shard):
+        """Proces shardu zakończył się bez polecenia stop - restart albo przeniesienie urządzeń"""
+        code = shard.process.exitcode
+        with shard.send_lock:
+            if shard.conn is not None:
+                shard.conn.close()
+                shard.conn = None
+        shard.process = None
+        shard.stats, shard.usm, shard.device_counts, shard.stages = {}, {}, {}, {}
+
+        now = time.monotonic()
+        shard.exits.append(now)
+        while shard.exits and shard.exits[0] < now - RESTART_WINDOW:
+            shard.exits.popleft()
+
+        live = [index for index in self._live_shards() if index != shard.index]
+        if len(shard.exits) > self.options['worker_max_restarts'] and live:
+            shard.failed = True
+            logger.error(f"Shard {shard.index} padł {len(shard.exits)} razy (kod {code}) - "
+                         f"urządzenia przechodzą do pozostałych shardów")
+            self._reassign(shard, live)
+            return
+
+        delay = min(self.options['worker_restart_delay'] * 2 ** (len(shard.exits) - 1), 60.0)
+        shard.restart_at = now + delay
+        logger.warning(f"Shard {shard.index} zakończył się (kod {code}) - restart za {delay:.1f} s")
+
+    def _reassign(self, shard, live):
+        devices, shard.devices = shard.devices, {}
+        for name, device in devices.items():
+            target = self.shards[shard_for(name, live)]
+            target.devices[name] = device
+            target.send("add", device)
+
+    def _dispatch(self, shard, message):
+        kind = message[0]
+        if kind == "result":
+            _, name, data, state = message
+            if self.on_result:
+                try:
+                    self.on_result(name, data, state)
+                except Exception as e:
+                    logger.error(f"Błąd obsługi wyniku {name}: {e}")
+        elif kind == "interfaces":
+            self.discovery.update(message[1], message[2])
+        elif kind == "stats":
+            shard.stats, shard.usm, shard.device_counts, shard.stages = message[1:]
+
+    def _supervise(self):
+        while not self._stop.is_set():
+            with self._lock:
+                for shard in self.shards:
+                    if shard.restart_at is not None and time.monotonic() >= shard.restart_at:
+                        self.restarts += 1
+                        self._spawn(shard)
+                running = {shard.conn: shard for shard in self.shards if shard.conn is not None}
+                sentinels = {shard.process.sentinel: shard for shard in self.shards if shard.process}
+
+            for ready in wait(list(running) + list(sentinels), timeout=0.5):
+                shard = running.get(ready)
+                if shard is None:
+                    continue
+                try:
+                    while ready.poll():
+                        self._dispatch(shard, marshal.loads(ready.recv_bytes()))
+                except (EOFError, OSError):
+                    pass
+
+            with self._lock:
+                for shard in self.shards:
+                    if shard.process is not None and not shard.process.is_alive() and not self._stop.is_set():
+                        self._on_exit(shard)
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                for shard in self.shards:
+                    self._spawn(shard)
+            self._thread = threading.Thread(target=self._supervise, daemon=True, name="poller-supervisor")
+            self._thread.start()
+        return self
+
+    def run_forever(self):
+        """Uruchamia procesy pollera i nadzoruje je do wywołania stop()"""
+        self.start()
+        self._stop.wait()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        with self._lock:
+            for shard in self.shards:
+                shard.send("stop")
+        for shard in self.shards:
+            if shard.process is not None:
+                shard.process.join(timeout)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Interfejs zgodny z AsyncPoller
+
+    def trigger(self, name):
+        """Zleca natychmiastowe odpytanie urządzenia procesowi, który je obsługuje"""
+        with self._lock:
+            shard = self._owner(name)
+        return shard is not None and shard.send("trigger", name)
+
+    def _add(self, device):
+        previous = self._owner(device['name'])
+        if previous is not None:
+            del previous.devices[device['name']]
+            previous.send("remove", device['name'])
+        shard = self.shards[shard_for(device['name'], self._live_shards())]
+        shard.devices[device['name']] = device
+        self.devices[device['name']] = device
+        shard.send("add", device)
+
+    def _remove(self, name):
+        self.devices.pop(name, None)
+        shard = self._owner(name)
+        if shard is not None:
+            del shard.devices[name]
+            shard.send("remove", name)
+        self.discovery.forget(name)
+
+    def add_device(self, device):
+        with self._lock:
+            self._add(device)
+
+    def remove_device(self, name):
+        with self._lock:
+            self._remove(name)
+
+    def update_devices(self, added=(), changed=(), removed=()):
+        """Różnica inwentarza: zmienione urządzenia zostają w swoim shardzie (AsyncPoller.update_device)"""
+        with self._lock:
+            for name in removed:
+                self._remove(name)
+            for device in changed:
+                shard = self._owner(device['name'])
+                if shard is None:
+                    self._add(device)
+                    continue
+                shard.devices[device['name']] = device
+                self.devices[device['name']] = device
+                shard.send("update", device)
+            for device in added:
+                self._add(device)
@@ -0,0 +1,424 @@
+"""Lokalny agent SNMPv3 serwujący pliki .snmprec (zamiennik snmpsim do testów i benchmarków).
+
+Jeden silnik nasłuchuje na wielu kolejnych portach - każdy port to osobne
+urządzenie z własnym, zmieniającym się w pamięci stanem (liczniki ruchu,
+CPU, RAM, stany łączy).  Wartości początkowe pochodzą z nagrań .snmprec,
+a przebieg zmian z ziarna (--seed) i numeru urządzenia.
+"""
+import os
+import sys
+import math
+import time
+import signal
+import random
+import asyncio
+import argparse
+import bisect
+import resource
+import multiprocessing
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+vendor_dir = os.path.join(base_dir, 'vendor')
+if os.path.exists(vendor_dir) and vendor_dir not in sys.path:
+    sys.path.insert(0, vendor_dir)
+
+import asyncio_compat  # noqa: F401 - musi poprzedzać import pysnmp.carrier.asyncio
+
+from pysnmp.entity import engine, config
+from pysnmp.entity.rfc3413 import cmdrsp, context
+from pysnmp.carrier.asyncio.dgram import udp
+from pysnmp.proto import rfc1902, rfc1905
+from pyasn1.type import univ
+
+import ber_codec
+
+DATA_DIR = os.path.join(base_dir, '..', 'snmpsim', 'data')
+
+# Typy wartości zgodne z formatem snmprec (tag BER -> typ SNMP)
+SNMPREC_TYPES = {
+    '2': rfc1902.Integer32,
+    '4': rfc1902.OctetString,
+    '5': univ.Null,
+    '6': rfc1902.ObjectName,
+    '64': rfc1902.IpAddress,
+    '65': rfc1902.Counter32,
+    '66': rfc1902.Gauge32,
+    '67': rfc1902.TimeTicks,
+    '68': rfc1902.Opaque,
+    '70': rfc1902.Counter64,
+}
+
+# Obiekty, których wartości zmieniają się w czasie
+SYS_UPTIME = '1.3.6.1.2.1.1.3.0'
+CPU_USAGE = '1.3.6.1.4.1.9.9.109.1.1.1.1.6'
+RAM_TOTAL = '1.3.6.1.4.1.9.9.48.1.1.1.6'
+RAM_FREE = '1.3.6.1.4.1.9.9.48.1.1.1.5'
+IF_OPER_STATUS = '1.3.6.1.2.1.2.2.1.8.'
+IF_LAST_CHANGE = '1.3.6.1.2.1.2.2.1.9.'
+IF_OCTETS = ('1.3.6.1.2.1.2.2.1.10.', '1.3.6.1.2.1.2.2.1.16.',
+             '1.3.6.1.2.1.31.1.1.1.6.', '1.3.6.1.2.1.31.1.1.1.10.')
+IF_ERRORS = ('1.3.6.1.2.1.2.2.1.14.', '1.3.6.1.2.1.2.2.1.20.')
+
+# Najkrótszy odstęp przeliczania stanu urządzenia [s] - GETBULK czyta wiele razy w jednym zapytaniu
+REFRESH_INTERVAL = 0.1
+
+
+def parse_snmprec_value(tag, value):
+    """Zamienia pole typu i wartości z pliku snmprec na obiekt pysnmp"""
+    tag, _, variation = tag.partition(':')
+    hexify = tag.endswith('x')
+    tag = tag.rstrip('x')
+    value = value.strip()
+
+    if variation:
+        # Warianty snmpsim (numeric, writecache) - bierzemy wartość początkową
+        params = dict(p.split('=', 1) for p in value.split(',') if '=' in p)
+        value = params.get('initial', params.get('value', '0'))
+
+    syntax = SNMPREC_TYPES.get(tag)
+    if syntax is None:
+        return None
+    if hexify:
+        return syntax(bytes.fromhex(value))
+    if syntax is univ.Null:
+        return syntax('')
+    if tag in ('2', '65', '66', '67', '70'):
+        return syntax(int(float(value)))
+    return syntax(value)
+
+
+def load_snmprec(path):
+    """Wczytuje rekordy OID|typ|wartość do posortowanej listy"""
+    records = {}
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                oid, tag, value = line.split('|', 2)
+                syntax = parse_snmprec_value(tag, value)
+            except (ValueError, TypeError):
+                continue
+            if syntax is not None:
+                records[rfc1902.ObjectName(oid)] = syntax
+    return records
+
+
+class DeviceSimulator:
+    """Zmienny stan jednego symulowanego urządzenia.
+
+    Stan jest przeliczany leniwie przy odczycie, proporcjonalnie do czasu od
+    poprzedniego przeliczenia, więc bezczynne urządzenia nic nie kosztują:
+    liczniki oktetów rosną ze stałą dla interfejsu przepływnością (z losowymi
+    wahaniami, z zawijaniem Counter32), CPU i wolny RAM błądzą wokół wartości
+    z nagrania, a łącza z prawdopodobieństwem 'flap_rate' na godzinę
+    przechodzą w stan down i wracają po średnio 30 s.
+    """
+
+    def __init__(self, records, index, seed=0, flap_rate=1.0, clock=time.monotonic):
+        self.rng = random.Random(f"{seed}/{index}")
+        self.flap_rate = flap_rate / 3600.0
+        self.clock = clock
+        self.started = self.updated = clock()
+        self.values = {}
+        self._counters = []
+        self._walks = []
+        self._links = {}
+        self._last_change = {}
+        self._uptime = None
+
+        ram_total = records.get(rfc1902.ObjectName(RAM_TOTAL))
+        for oid, syntax in records.items():
+            text = str(oid)
+            if text == SYS_UPTIME:
+                self._uptime = (oid, int(syntax))
+            elif text == CPU_USAGE:
+                self._walks.append([oid, float(syntax), float(syntax), 0.0, 100.0, 10.0])
+            elif text == RAM_FREE and ram_total is not None:
+                total = float(ram_total)
+                self._walks.append([oid, float(syntax), float(syntax), 0.05 * total, 0.95 * total, 0.05 * total])
+            elif text.startswith(IF_OPER_STATUS):
+                self._links[text[len(IF_OPER_STATUS):]] = [oid, int(syntax)]
+            elif text.startswith(IF_LAST_CHANGE):
+                self._last_change[text[len(IF_LAST_CHANGE):]] = oid
+            elif isinstance(syntax, (rfc1902.Counter32, rfc1902.Counter64)):
+                bits = 64 if isinstance(syntax, rfc1902.Counter64) else 32
+                prefix = next((p for p in IF_OCTETS + IF_ERRORS if text.startswith(p)), None)
+                if prefix in IF_OCTETS:
+                    rate = self.rng.uniform(1e4, 1.25e7)        # 0,1-100 Mbit/s
+                elif prefix in IF_ERRORS:
+                    rate = self.rng.uniform(0.0, 0.05)
+                else:
+                    rate = self.rng.uniform(0.0, 10.0)
+                interface = text[len(prefix):] if prefix else None
+                self._counters.append([oid, float(int(syntax)), rate, 2 ** bits, interface])
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = self.clock()
+        elapsed = now - self.updated
+        if elapsed < REFRESH_INTERVAL and not force:
+            return
+        self.updated = now
+        values = self.values
+        uptime = None
+        if self._uptime is not None:
+            oid, base = self._uptime
+            uptime = (base + int((now - self.started) * 100)) % 2 ** 32
+            values[oid] = rfc1902.TimeTicks(uptime)
+
+        # Stany łączy: przejście w ciągu 'elapsed' z prawdopodobieństwem 1 - e^(-λt)
+        for interface, link in self._links.items():
+            rate = self.flap_rate if link[1] == 1 else 1 / 30.0
+            if elapsed and rate and self.rng.random() < 1 - math.exp(-rate * elapsed):
+                link[1] = 2 if link[1] == 1 else 1
+                if interface in self._last_change and uptime is not None:
+                    values[self._last_change[interface]] = rfc1902.TimeTicks(uptime)
+            values[link[0]] = rfc1902.Integer32(link[1])
+
+        for counter in self._counters:
+            oid, value, rate, modulo, interface = counter
+            link = self._links.get(interface)
+            if link is None or link[1] == 1:
+                value += rate * elapsed * self.rng.uniform(0.5, 1.5)
+            counter[1] = value
+            syntax = rfc1902.Counter64 if modulo > 2 ** 32 else rfc1902.Counter32
+            values[oid] = syntax(int(value) % modulo)
+
+        # Proces Ornsteina-Uhlenbecka: powrót do wartości z nagrania z losowym szumem
+        for walk in self._walks:
+            oid, value, mean, low, high, sigma = walk
+            if elapsed:
+                value += 0.1 * (mean - value) * min(elapsed, 10.0) + sigma * math.sqrt(min(elapsed, 10.0)) * self.rng.gauss(0, 1)
+                value = min(high, max(low, value))
+            walk[1] = value
+            values[oid] = rfc1902.Integer32(int(round(value)))
+
+
+class SnmprecInstrum:
+    """Minimalny kontroler MIB obsługujący GET, GETNEXT i GETBULK na danych snmprec"""
+
+    def __init__(self, records):
+        self.update(records)
+
+    def update(self, records):
+        self._values = dict(records)
+        self._oids = sorted(self._values)
+
+    def _lookup(self, acInfo):
+        """Funkcja odczytu wartości dla bieżącego zapytania"""
+        return self._values.get
+
+    def readVars(self, varBinds, acInfo=(None, None)):
+        lookup = self._lookup(acInfo)
+        return [(oid, lookup(oid, rfc1905.noSuchObject)) for oid, _ in varBinds]
+
+    def readNextVars(self, varBinds, acInfo=(None, None)):
+        lookup = self._lookup(acInfo)
+        result = []
+        for oid, _ in varBinds:
+            idx = bisect.bisect_right(self._oids, oid)
+            if idx < len(self._oids):
+                next_oid = self._oids[idx]
+                result.append((next_oid, lookup(next_oid)))
+            else:
+                result.append((oid, rfc1905.endOfMibView))
+        return result
+
+    def writeVars(self, varBinds, acInfo=(None, None)):
+        return [(oid, rfc1905.noSuchObject) for oid, _ in varBinds]
+
+
+class FarmInstrum(SnmprecInstrum):
+    """Kontroler MIB farmy: urządzenie wybierane po porcie, na który przyszło zapytanie.
+
+    Symulator urządzenia powstaje przy pierwszym zapytaniu; nagranie jest
+    wspólne, a urządzenie trzyma tylko zmienne wartości.
+    """
+
+    def __init__(self, records, first_index=0, seed=0, flap_rate=1.0):
+        super().__init__(records)
+        self.first_index = first_index
+        self.seed = seed
+        self.flap_rate = flap_rate
+        self._devices = {}
+
+    def device(self, index):
+        simulator = self._devices.get(index)
+        if simulator is None:
+            simulator = self._devices[index] = DeviceSimulator(
+                self._values, self.first_index + index, self.seed, self.flap_rate)
+        return simulator
+
+    def _lookup(self, acInfo):
+        snmp_engine = acInfo[1]
+        if snmp_engine is None:
+            return self._values.get
+        request = snmp_engine.observer.getExecutionContext('rfc3412.receiveMessage:request')
+        # Domena transportu to udp.domainName + (numer portu w farmie,)
+        simulator = self.device(request['transportDomain'][-1] - 1)
+        simulator.refresh()
+        values, static = simulator.values, self._values
+
+        def lookup(oid, default=None):
+            value = values.get(oid)
+            return value if value is not None else static.get(oid, default)
+
+        return lookup
+
+
+def raise_file_limit(sockets):
+    """Podnosi miękki limit deskryptorów - każde urządzenie farmy to osobne gniazdo UDP"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = sockets + 64
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        if limit < needed:
+            raise OSError(f"Limit deskryptorów {hard} nie wystarcza dla {sockets} gniazd (--processes)")
+
+
+def create_agent(port, username='simulator', auth_key='snmpauth123', priv_key='snmppriv123',
+                 data_dir=DATA_DIR, host='127.0.0.1', count=1, first_index=0, seed=0,
+                 flap_rate=1.0, static=False):
+    """Tworzy silnik agenta; każdy plik .snmprec z katalogu jest osobnym kontekstem SNMPv3.
+
+    Przy count > 1 ten sam silnik nasłuchuje na kolejnych portach, symulując wiele urządzeń
+    (numerowanych od 'first_index').  Wywoływane przy ustawionej pętli zdarzeń asyncio;
+    gniazda są otwierane po jej uruchomieniu (zob. wait_for_transports).
+    """
+    raise_file_limit(count)
+    # Kodowanie odpowiedzi zamiast pyasn1 - agent nie powinien zabierać CPU testowanemu pollerowi
+    ber_codec.install()
+    snmp_engine = engine.SnmpEngine()
+    for i in range(count):
+        config.addTransport(snmp_engine, udp.domainName + (i + 1,),
+                            udp.UdpTransport().openServerMode((host, port + i)))
+    config.addV3User(snmp_engine, username,
+                     config.usmHMACMD5AuthProtocol, auth_key,
+                     config.usmDESPrivProtocol, priv_key)
+
+    snmp_context = context.SnmpContext(snmp_engine)
+    for name in sorted(os.listdir(data_dir)):
+        if name.endswith('.snmprec'):
+            records = load_snmprec(os.path.join(data_dir, name))
+            instrum = SnmprecInstrum(records) if static else FarmInstrum(records, first_index, seed, flap_rate)
+            snmp_context.registerContextName(name[:-len('.snmprec')], instrum)
+
+    cmdrsp.GetCommandResponder(snmp_engine, snmp_context)
+    cmdrsp.NextCommandResponder(snmp_engine, snmp_context)
+    cmdrsp.BulkCommandResponder(snmp_engine, snmp_context)
+    return snmp_engine
+
+
+def wait_for_transports(snmp_engine, count):
+    """Czeka, aż wszystkie gniazda agenta będą związane z portami (błąd np. przy zajętym porcie)"""
+    dispatcher = snmp_engine.transportDispatcher
+    transports = [dispatcher.getTransport(udp.domainName + (i + 1,)) for i in range(count)]
+    dispatcher.loop.run_until_complete(asyncio.gather(*[t._lport for t in transports]))
+
+
+def serve(args, port, count, first_index, ready=None):
+    """Pętla jednego procesu agenta (urządzenia first_index .. first_index + count - 1)"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    snmp_engine = create_agent(port, data_dir=args.data_dir, host=args.host, count=count,
+                               first_index=first_index, seed=args.seed, flap_rate=args.flap_rate,
+                               static=args.static, auth_key=args.auth_key, priv_key=args.priv_key)
+    wait_for_transports(snmp_engine, count)
+    if ready is None:
+        print(f"Agent SNMP nasluchuje na {args.host}:{port}-{port + count - 1}", flush=True)
+    else:
+        ready.send(True)
+        ready.close()
+        parent = os.getppid()
+
+        def watch_parent():
+            # Proces farmy zniknął (np. SIGKILL) - nie zostawiamy osieroconych agentów
+            if os.getppid() != parent:
+                loop.stop()
+            else:
+                loop.call_later(1.0, watch_parent)
+
+        watch_parent()
+    snmp_engine.transportDispatcher.jobStarted(1)
+    try:
+        snmp_engine.transportDispatcher.runDispatcher()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        snmp_engine.transportDispatcher.closeDispatcher()
+
+
+def _serve_slice(args, port, count, first_index, ready):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    serve(args, port, count, first_index, ready)
+
+
+def run_farm(args):
+    """Dzieli urządzenia między procesy (po ciągłym zakresie portów) i czeka na ich zakończenie"""
+    processes = max(1, min(args.processes, args.count))
+    context_ = multiprocessing.get_context('fork')
+    children = []
+    per_process = -(-args.count // processes)
+    for first in range(0, args.count, per_process):
+        count = min(per_process, args.count - first)
+        parent_conn, child_conn = context_.Pipe(duplex=False)
+        process = context_.Process(target=_serve_slice, args=(args, args.port + first, count, first, child_conn),
+                                   name=f"snmp-agent-{first}", daemon=True)
+        process.start()
+        child_conn.close()
+        children.append((process, parent_conn))
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process, conn in children:
+            try:
+                conn.recv()
+            except EOFError:
+                raise SystemExit(f"Proces agenta {process.name} nie wystartował")
+        print(f"Agent SNMP nasluchuje na {args.host}:{args.port}-{args.port + args.count - 1} "
+              f"({len(children)} procesów)", flush=True)
+        for process, _ in children:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process, _ in children:
+            if process.is_alive():
+                process.terminate()
+        for process, _ in children:
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lokalny agent SNMPv3 (zamiennik snmpsim)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=16100)
+    parser.add_argument('--count', type=int, default=1, help='liczba symulowanych urządzeń (kolejne porty)')
+    parser.add_argument('--processes', type=int, default=1, help='procesy agenta dzielące urządzenia')
+    parser.add_argument('--seed', type=int, default=0, help='ziarno przebiegu wartości urządzeń')
+    parser.add_argument('--flap-rate', type=float, default=1.0, help='średnia liczba awarii łącza na godzinę')
+    parser.add_argument('--static', action='store_true', help='wartości stałe, jak w plikach .snmprec')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--auth-key', default='snmpauth123', help='hasło uwierzytelniania użytkownika simulator')
+    parser.add_argument('--priv-key', default='snmppriv123', help='hasło szyfrowania użytkownika simulator')
+    args = parser.parse_args()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    if args.processes > 1:
+        run_farm(args)
+    else:
+        signal.signal(signal.SIGTERM, stop)
+        serve(args, args.port, args.count, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,7 @@
 import logging
+import threading
 from pysnmp.hlapi import (
     getCmd,
-    SnmpEngine,
-    UsmUserData,
     UdpTransportTarget,
     ContextData,
     ObjectType,
@@ -11,53 +10,96 @@ from pysnmp.hlapi import (
     usmDESPrivProtocol
 )
 from config import SNMP_CONFIG, OIDS
+from usm_cache import get_usm_cache
+from mib_snapshot import create_engine
 
 logger = logging.getLogger("SNMP-Scan")
 
 class SNMPManager:
     def __init__(self):
         self.config = SNMP_CONFIG
+        self.max_oids_per_pdu = max(1, self.config.get('max_oids_per_pdu', 30))
 
-    def execute_snmp_query(self, oid):
-        """Wykonywanie zapytania SNMP GET"""
-        try:
+        # Jeden silnik na urządzenie - discovery engineID, lokalizacja kluczy USM
+        # i konfiguracja LCD są wykonywane raz, a nie przy każdym zapytaniu
+        self.engine = create_engine()
+        self.usm_cache = get_usm_cache()
+        self.auth_data = self.usm_cache.user_data(
+            self.config['username'],
+            self.config['auth_key'],
+            self.config['priv_key'],
+            usmHMACMD5AuthProtocol,
+            usmDESPrivProtocol
+        )
+        self.target = UdpTransportTarget(
+            (self.config['host'], self.config['port']),
+            timeout=1.0,
+            retries=1
+        )
+        self.context = ContextData(contextName=self.config['context_name'])
+
+        # Synchroniczne hlapi nie jest bezpieczne wątkowo przy współdzielonym silniku
+        self._lock = threading.Lock()
+
+    def _get(self, oids):
+        """Pojedyncze zapytanie GET z wieloma OID w jednym PDU"""
+        with self._lock:
+            self.usm_cache.prime(self.engine, self.target)
             iterator = getCmd(
-                SnmpEngine(),
-                UsmUserData(
-                    self.config['username'],
-                    self.config['auth_key'],
-                    self.config['priv_key'],
-                    authProtocol=usmHMACMD5AuthProtocol,
-                    privProtocol=usmDESPrivProtocol
-                ),
-                UdpTransportTarget(
-                    (self.config['host'], self.config['port']), 
-                    timeout=1.0, 
-                    retries=1
-                ),
-                ContextData(contextName=self.config['context_name']),
-                ObjectType(ObjectIdentity(oid))
+                self.engine,
+                self.auth_data,
+                self.target,
+                self.context,
+                *[ObjectType(ObjectIdentity(oid)) for oid in oids]
             )
+            result = next(iterator)
+            if not result[0]:
+                self.usm_cache.learn(self.engine, self.target)
+            elif self.usm_cache.invalidate(self.engine, self.target):
+                # engineID zapamiętany przed restartem jest nieaktualny - ponawiamy z wykrywaniem
+                result = next(getCmd(
+                    self.engine,
+                    self.auth_data,
+                    self.target,
+                    self.context,
+                    *[ObjectType(ObjectIdentity(oid)) for oid in oids]
+                ))
+            return result
 
-            error_indication, error_status, error_index, var_binds = next(iterator)
+    def query_oids(self, oids):
+        """Odpytuje listę OID w paczkach, zwraca wartości w tej samej kolejności"""
+        results = []
+        for start in range(0, len(oids), self.max_oids_per_pdu):
+            results.extend(self._query_chunk(oids[start:start + self.max_oids_per_pdu]))
+        return results
 
-            if error_indication:
-                return f"Error: {error_indication}"
-            elif error_status:
-                return f"Error: {error_status.prettyPrint()}"
-            else:
-                for var_bind in var_binds:
-                    return str(var_bind[1])
-                    
+    def _query_chunk(self, oids):
+        try:
+            error_indication, error_status, error_index, var_binds = self._get(oids)
         except Exception as e:
-            return f"Exception: {str(e)}"
+            return [f"Exception: {str(e)}"] * len(oids)
+
+        if error_indication:
+            return [f"Error: {error_indication}"] * len(oids)
+
+        if error_status:
+            # Odpowiedź nie mieści się w jednym pakiecie - dzielimy paczkę na pół
+            if error_status.prettyPrint() == 'tooBig' and len(oids) > 1:
+                half = len(oids) // 2
+                return self._query_chunk(oids[:half]) + self._query_chunk(oids[half:])
+            return [f"Error: {error_status.prettyPrint()}"] * len(oids)
+
+        return [str(var_bind[1]) for var_bind in var_binds]
+
+    def execute_snmp_query(self, oid):
+        """Wykonywanie zapytania SNMP GET"""
+        return self.query_oids([oid])[0]
 
     def get_snmp_data(self):
-        results = {}
-        for key, oid in OIDS.items():
-            results[key] = self.execute_snmp_query(oid)
-        return results
-    
+        keys = list(OIDS)
+        values = self.query_oids([OIDS[key] for key in keys])
+        return dict(zip(keys, values))
+
     def test_connection(self):
         if 'sysDescr' in OIDS:
             res = self.execute_snmp_query(OIDS['sysDescr'])
@@ -75,4 +117,4 @@ class SNMPManager:
                 "status": self.test_connection(),
                 "config": safe_config
             }
-        }
\ No newline at end of file
+        }
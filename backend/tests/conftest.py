@@ -0,0 +1,8 @@
+import os
+import sys
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+vendor_dir = os.path.join(base_dir, 'vendor')
+for path in (vendor_dir, base_dir):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,99 @@
+from alerts import AlertEngine
+
+CPU_HIGH = {'name': 'cpu_high', 'metric': 'cpuUsage', 'op': '>', 'value': 80}
+FLAPPING = {'name': 'link_flapping', 'metric': 'if*_Status', 'type': 'flapping', 'changes': 4, 'window': 300}
+
+
+def step(engine, device, data, now):
+    """Odczyt i ocena w tej samej chwili - jak jeden cykl pollera"""
+    engine.update(device, data, timestamp=now)
+    return engine.evaluate(now=now)
+
+
+def test_fire_and_resolve_once_per_series():
+    """Kolejne spełnienia warunku nie powielają aktywnego alertu"""
+    engine = AlertEngine(rules=[CPU_HIGH], stale_after=60)
+    events = []
+    for now, cpu in [(100, '95'), (110, '97'), (120, '90'), (130, '20'), (140, '10')]:
+        events += step(engine, 'rtr-1', {'cpuUsage': cpu}, now)
+        if now == 120:
+            # Aktywny alert zachowuje wartość z chwili wyzwolenia
+            assert [a['value'] for a in engine.active()] == [95.0]
+    assert [(e['state'], e['device']) for e in events] == [('firing', 'rtr-1'), ('resolved', 'rtr-1')]
+    assert events[1]['fired_at'] == 100
+    assert events[1]['resolved_at'] == 130
+    assert engine.active() == []
+    assert (engine.stats['fired'], engine.stats['resolved']) == (1, 1)
+
+
+def test_series_are_separate_per_device_and_instance():
+    engine = AlertEngine(rules=[{'name': 'link_down', 'metric': 'if*_Status', 'op': '==', 'value': 2}],
+                         stale_after=60)
+    engine.update('rtr-1', {'if1_Status': '2', 'if2_Status': '1'}, timestamp=100)
+    engine.update('rtr-2', {'if1_Status': '2', 'sysName': 'RTR-2'}, timestamp=100)
+    events = engine.evaluate(now=100)
+    assert sorted((e['device'], e['metric']) for e in events) == [('rtr-1', 'if1_Status'), ('rtr-2', 'if1_Status')]
+    assert [a['instance'] for a in engine.active(device='rtr-1')] == ['1']
+
+
+def test_for_delays_firing_until_condition_holds():
+    engine = AlertEngine(rules=[dict(CPU_HIGH, **{'for': 30})], stale_after=60)
+    assert step(engine, 'rtr-1', {'cpuUsage': '95'}, 100) == []
+    assert step(engine, 'rtr-1', {'cpuUsage': '95'}, 120) == []
+    events = step(engine, 'rtr-1', {'cpuUsage': '95'}, 130)
+    assert [e['state'] for e in events] == ['firing']
+    assert events[0]['since'] == 100
+
+
+def test_for_restarts_after_condition_breaks():
+    engine = AlertEngine(rules=[dict(CPU_HIGH, **{'for': 30})], stale_after=60)
+    step(engine, 'rtr-1', {'cpuUsage': '95'}, 100)
+    step(engine, 'rtr-1', {'cpuUsage': '50'}, 120)
+    assert step(engine, 'rtr-1', {'cpuUsage': '95'}, 130) == []
+    assert step(engine, 'rtr-1', {'cpuUsage': '95'}, 140) == []
+    assert [e['since'] for e in step(engine, 'rtr-1', {'cpuUsage': '95'}, 160)] == [130]
+
+
+def test_rate_uses_change_per_second():
+    engine = AlertEngine(rules=[{'name': 'errors', 'metric': 'if*_ErrIn', 'type': 'rate', 'op': '>', 'value': 10}],
+                         stale_after=60)
+    assert step(engine, 'rtr-1', {'if3_ErrIn': '1000'}, 100) == []
+    assert step(engine, 'rtr-1', {'if3_ErrIn': '1050'}, 110) == []
+    assert [e['state'] for e in step(engine, 'rtr-1', {'if3_ErrIn': '1200'}, 120)] == ['firing']
+
+
+def test_flapping_fires_on_changes_and_decays_when_quiet():
+    """Licznik zmian wygasa wykładniczo - po uspokojeniu łącza alarm sam się kończy"""
+    engine = AlertEngine(rules=[FLAPPING], stale_after=60)
+    states = []
+    now = 100
+    for status in ['1', '2'] * 3:
+        states += [(now, e['state']) for e in step(engine, 'rtr-1', {'if1_Status': status}, now)]
+        now += 10
+    # Pierwszy odczyt nie jest zmianą, a 4 zmiany z wygaszaniem dają wynik < 4
+    assert states == [(150, 'firing')]
+
+    while now < 400 and len(states) == 1:
+        states += [(now, e['state']) for e in step(engine, 'rtr-1', {'if1_Status': '2'}, now)]
+        now += 10
+    assert states[1][1] == 'resolved'
+    assert 160 < states[1][0] < 250
+
+
+def test_stale_series_clears_alert():
+    """Urządzenie, które przestało odpowiadać, nie utrzymuje alarmu"""
+    engine = AlertEngine(rules=[CPU_HIGH], stale_after=60)
+    step(engine, 'rtr-1', {'cpuUsage': '95'}, 100)
+    assert engine.evaluate(now=150) == []
+    events = engine.evaluate(now=170)
+    assert [(e['state'], e['resolved_at']) for e in events] == [('resolved', 170)]
+    assert engine.active() == []
+
+
+def test_forget_drops_alerts_of_removed_device():
+    engine = AlertEngine(rules=[CPU_HIGH], stale_after=60)
+    step(engine, 'rtr-1', {'cpuUsage': '95'}, 100)
+    step(engine, 'rtr-2', {'cpuUsage': '95'}, 100)
+    engine.forget('rtr-1')
+    assert [a['device'] for a in engine.active()] == ['rtr-2']
+    assert engine.evaluate(now=110) == []
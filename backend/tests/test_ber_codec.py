@@ -0,0 +1,80 @@
+import pytest
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import rfc1902
+from pysnmp.proto.mpmod.rfc3412 import ScopedPDU
+
+import ber_codec
+from benchmark import ber_corpus
+from ber_codec import encode_tlv, encode_oid, encode_integer
+
+
+def response(value):
+    """ScopedPDU z odpowiedzią o jednym wiązaniu; value to gotowy TLV wartości"""
+    bind = encode_tlv(0x30, encode_tlv(0x06, encode_oid((1, 3, 6, 1, 2, 1, 1, 3, 0))) + value)
+    header = b''.join(encode_tlv(0x02, encode_integer(field)) for field in (1, 0, 0))
+    pdu = encode_tlv(0xa2, header + encode_tlv(0x30, bind))
+    return encode_tlv(0x30, encode_tlv(0x04, b'\x80\x00\x4f\xb8') + encode_tlv(0x04, b'') + pdu)
+
+
+@pytest.mark.parametrize('number, scoped_pdu', list(enumerate(ber_corpus())))
+def test_corpus_matches_pyasn1(number, scoped_pdu):
+    """Szybka ścieżka koduje bajt w bajt jak pyasn1 i składa to samo drzewo"""
+    fallback = ber_codec.stats["fallback"]
+    substrate = encoder.encode(scoped_pdu)
+    assert ber_codec.encoder.encode(scoped_pdu) == substrate
+
+    expected, _ = decoder.decode(substrate, asn1Spec=ScopedPDU())
+    decoded, rest = ber_codec.decoder.decode(substrate + b'\x00' * 4, asn1Spec=ScopedPDU())
+    assert rest == b'\x00' * 4
+    assert decoded.prettyPrint() == expected.prettyPrint()
+    assert encoder.encode(decoded) == substrate
+    assert ber_codec.stats["fallback"] == fallback
+
+
+def test_indefinite_length_falls_back_to_pyasn1():
+    """Nieokreślona długość BER jest poprawna, ale obsługuje ją tylko pyasn1"""
+    scoped_pdu = ber_corpus()[4]
+    substrate = encoder.encode(scoped_pdu, defMode=False)
+    fallback = ber_codec.stats["fallback"]
+    decoded, rest = ber_codec.decoder.decode(substrate, asn1Spec=ScopedPDU())
+    assert ber_codec.stats["fallback"] == fallback + 1
+    assert rest == b''
+    assert decoded.prettyPrint() == scoped_pdu.prettyPrint()
+
+
+def test_non_minimal_encodings_stay_on_fast_path():
+    """Nadmiarowy bajt liczby i długa forma długości dają tę samą wartość co w pyasn1"""
+    for value in (bytes.fromhex('0202007f'), bytes.fromhex('4181020005')):
+        substrate = response(value)
+        fallback = ber_codec.stats["fallback"]
+        decoded, _ = ber_codec.decoder.decode(substrate, asn1Spec=ScopedPDU())
+        expected, _ = decoder.decode(substrate, asn1Spec=ScopedPDU())
+        assert ber_codec.stats["fallback"] == fallback
+        assert decoded.prettyPrint() == expected.prettyPrint()
+
+
+@pytest.mark.parametrize('value', [
+    bytes.fromhex('41050100000000'),    # Counter32 = 2**32, poza zakresem typu
+    bytes.fromhex('470101'),            # UInteger32 z SNMPv2 (RFC 1442), nieznany w v2c
+    bytes.fromhex('050101'),            # NULL z treścią
+])
+def test_unusual_values_fall_back_to_pyasn1_error(value):
+    """Nietypowe wartości trafiają do pyasn1, który zgłasza ten sam błąd co bez szybkiej ścieżki"""
+    substrate = response(value)
+    with pytest.raises(PyAsn1Error):
+        decoder.decode(substrate, asn1Spec=ScopedPDU())
+    fallback = ber_codec.stats["fallback"]
+    with pytest.raises(PyAsn1Error):
+        ber_codec.decoder.decode(substrate, asn1Spec=ScopedPDU())
+    assert ber_codec.stats["fallback"] == fallback + 1
+
+
+def test_other_values_and_options_go_through_pyasn1():
+    """Koder zastępuje pyasn1 tylko dla ScopedPDU bez dodatkowych opcji"""
+    value = rfc1902.Counter64(2 ** 64 - 1)
+    assert ber_codec.encoder.encode(value) == encoder.encode(value)
+    scoped_pdu = ber_corpus()[4]
+    encoded = ber_codec.stats["encoded"]
+    assert ber_codec.encoder.encode(scoped_pdu, defMode=False) == encoder.encode(scoped_pdu, defMode=False)
+    assert ber_codec.stats["encoded"] == encoded
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+import zlib
+
+import pytest
+from influxdb import InfluxDBClient
+
+from benchmark import start_fake_influx
+from bulk_export import BulkExporter, CSV_HEADER
+
+SERIES = [('rtr-1', 'cpuUsage'), ('rtr-2', 'if1_InBps')]
+END = 1700000000
+
+
+@pytest.fixture
+def exporter():
+    server = start_fake_influx(SERIES)
+    client = InfluxDBClient('127.0.0.1', server.server_address[1], database='snmp_data')
+    # Małe okna i porcje - eksport składa się z wielu zapytań i wielu porcji chunked
+    yield BulkExporter(client, 'snmp_data', window='10m', chunk_size=25, buffer_bytes=512)
+    server.shutdown()
+
+
+def export(exporter, export_format, compress=False):
+    chunks = list(exporter.stream(export_format, compress, start=END - 3600, end=END))
+    body = b''.join(chunks)
+    if compress:
+        body = zlib.decompress(body, 31)
+    return chunks, body.decode('utf-8')
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_csv_rows_and_framing(exporter, compress):
+    chunks, text = export(exporter, 'csv', compress)
+    assert len(chunks) > 1
+    assert text.startswith(CSV_HEADER)
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == ['time', 'device', 'metric', 'value']
+    assert len(rows) - 1 == 360 * len(SERIES)
+    assert all(len(row) == 4 for row in rows)
+    assert rows[1] == ['2023-11-14T21:13:20Z', 'rtr-1', 'cpuUsage', str((END - 3600) // 10 % 1000)]
+    assert exporter.metrics()["errors"] == 0
+
+
+def test_ndjson_rows_and_framing(exporter):
+    _, text = export(exporter, 'ndjson')
+    assert text.endswith('\n')
+    records = [json.loads(line) for line in text.splitlines()]
+    assert len(records) == 360 * len(SERIES)
+    assert {(r['device'], r['metric']) for r in records} == set(SERIES)
+    assert all(set(r) == {'time', 'device', 'metric', 'value'} for r in records)
@@ -0,0 +1,107 @@
+import pytest
+
+import compression
+from compression import WriteCompressor, fill_gaps, lookback
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setitem(compression.COMPRESSION_CONFIG, 'enabled', True)
+    monkeypatch.setitem(compression.COMPRESSION_CONFIG, 'heartbeat', 600.0)
+
+
+def feed(compressor, key, readings):
+    """Wyniki filter() dla kolejnych odczytów (czas, wartość) jednego pola"""
+    return [compressor.filter('dev', {key: value}, timestamp=t) for t, value in readings]
+
+
+def test_deadband_absolute_and_percent():
+    compressor = WriteCompressor(rules=[{'metric': 'cpuUsage', 'mode': 'deadband', 'absolute': 1},
+                                        {'metric': 'ramFree', 'mode': 'deadband', 'percent': 1}])
+    out = feed(compressor, 'cpuUsage', [(10, '50'), (20, '50.8'), (30, '51.5'), (40, '50.6')])
+    assert out == [{10: {'cpuUsage': '50'}}, {}, {30: {'cpuUsage': '51.5'}}, {}]
+    # Tolerancja liczona od ostatniej zapisanej wartości (1000), a nie od poprzedniego odczytu
+    out = feed(compressor, 'ramFree', [(10, '1000'), (20, '1009'), (30, '1011')])
+    assert out == [{10: {'ramFree': '1000'}}, {}, {30: {'ramFree': '1011'}}]
+
+
+def test_change_and_fields_without_rule():
+    compressor = WriteCompressor(rules=[{'metric': 'ramTotal', 'mode': 'change'}])
+    out = [compressor.filter('dev', {'ramTotal': value, 'sysName': 'RTR'}, timestamp=t)
+           for t, value in [(10, '512'), (20, '512'), (30, '1024'), (40, 'Error: timeout')]]
+    assert out == [{10: {'ramTotal': '512', 'sysName': 'RTR'}}, {20: {'sysName': 'RTR'}},
+                   {30: {'ramTotal': '1024', 'sysName': 'RTR'}},
+                   {40: {'ramTotal': 'Error: timeout', 'sysName': 'RTR'}}]
+    assert compressor.metrics()['points_in'] == 3
+    assert compressor.metrics()['points_out'] == 2
+
+
+def test_swingdoor_writes_turning_point_with_its_own_time():
+    """Odczyty na prostej nie są zapisywane; po załamaniu zapisywany jest poprzedni odczyt"""
+    compressor = WriteCompressor(rules=[{'metric': 'sysUpTime', 'mode': 'swingdoor', 'absolute': 1}])
+    out = feed(compressor, 'sysUpTime', [(100, '0'), (101, '10'), (102, '20'), (103, '30'), (104, '30'), (105, '30')])
+    assert out == [{100: {'sysUpTime': '0'}}, {}, {}, {}, {103: {'sysUpTime': '30'}}, {}]
+
+
+def test_swingdoor_keeps_points_within_tolerance_on_the_line():
+    compressor = WriteCompressor(rules=[{'metric': 'sysUpTime', 'mode': 'swingdoor', 'absolute': 1}])
+    out = feed(compressor, 'sysUpTime', [(100, '0'), (101, '10.5'), (102, '19.5'), (103, '30'), (104, '45')])
+    assert out[1:4] == [{}, {}, {}]
+    assert out[4] == {103: {'sysUpTime': '30'}}
+
+
+def test_heartbeat_writes_unchanged_series():
+    compressor = WriteCompressor(rules=[{'metric': 'cpuUsage', 'mode': 'deadband', 'absolute': 1}], heartbeat=60)
+    out = feed(compressor, 'cpuUsage', [(100, '5'), (130, '5'), (160, '5'), (190, '5'), (220, '5')])
+    assert out == [{100: {'cpuUsage': '5'}}, {}, {160: {'cpuUsage': '5'}}, {}, {220: {'cpuUsage': '5'}}]
+    assert compressor.stats['heartbeats'] == 2
+
+
+def test_swingdoor_heartbeat_flushes_held_reading():
+    """Heartbeat zapisuje też ostatni niezapisany odczyt, żeby odcinek kończył się we właściwym punkcie"""
+    compressor = WriteCompressor(rules=[{'metric': 'sysUpTime', 'mode': 'swingdoor', 'absolute': 1}], heartbeat=60)
+    out = feed(compressor, 'sysUpTime', [(100, '0'), (110, '10'), (160, '60')])
+    assert out[1] == {}
+    assert out[2] == {110: {'sysUpTime': '10'}, 160: {'sysUpTime': '60'}}
+
+
+def test_forget_starts_series_again():
+    compressor = WriteCompressor(rules=[{'metric': 'ramTotal', 'mode': 'change'}])
+    feed(compressor, 'ramTotal', [(100, '512')])
+    compressor.forget('dev')
+    assert feed(compressor, 'ramTotal', [(110, '512')]) == [{110: {'ramTotal': '512'}}]
+
+
+def test_fill_gaps_step_holds_last_value():
+    times, values = fill_gaps([0, 30], {'cpuUsage': [5.0, 7.0]}, 0, 60, 10, hold=25)
+    assert times == [0, 10, 20, 30, 40, 50]
+    assert values == {'cpuUsage': [5.0, 5.0, 5.0, 7.0, 7.0, 7.0]}
+
+
+def test_fill_gaps_leaves_gaps_longer_than_hold_empty():
+    times, values = fill_gaps([0, 30], {'cpuUsage': [5.0, 7.0]}, 0, 60, 10, hold=15)
+    assert times == [0, 10, 30, 40]
+    assert values == {'cpuUsage': [5.0, 5.0, 7.0, 7.0]}
+
+
+def test_fill_gaps_linear_interpolates_between_points():
+    times, values = fill_gaps([0, 40], {'sysUpTime': [0.0, 400.0]}, 5, 50, 10, hold=60)
+    assert times == [0, 10, 20, 30, 40]
+    assert values == {'sysUpTime': [0.0, 100.0, 200.0, 300.0, 400.0]}
+
+
+def test_fill_gaps_does_not_fill_uncompressed_fields():
+    times, values = fill_gaps([0, 30], {'cpuUsage': [5.0, 7.0], 'custom': [1.0, None]}, 0, 40, 10, hold=60)
+    assert times == [0, 10, 20, 30]
+    assert values == {'cpuUsage': [5.0, 5.0, 5.0, 7.0], 'custom': [1.0, None, None, None]}
+
+
+def test_lookback_covers_heartbeat_for_compressed_fields():
+    assert lookback(['cpuUsage'], 60) == 660
+    assert lookback(['custom'], 60) == 0
+
+
+def test_disabled_compression_has_no_fill_or_lookback(monkeypatch):
+    monkeypatch.setitem(compression.COMPRESSION_CONFIG, 'enabled', False)
+    assert compression.fill_mode('cpuUsage') is None
+    assert lookback(['cpuUsage'], 60) == 0
@@ -0,0 +1,126 @@
+import threading
+from collections import Counter
+
+import pytest
+
+from benchmark import start_fake_influx
+from export import InfluxWriter
+
+
+@pytest.fixture
+def server():
+    server = start_fake_influx(keep_lines=True)
+    yield server
+    server.shutdown()
+
+
+def make_writer(server, tmp_path, **options):
+    options = dict(dict(spool_path=str(tmp_path / 'influx.lp'), batch_size=20, retry_backoff=0.0,
+                        max_retries=0, flush_interval=0.05), **options)
+    return InfluxWriter('127.0.0.1', server.server_address[1], 'snmp_data', **options)
+
+
+def lines(prefix, count):
+    return [f"snmp_metrics,device={prefix} value={i}i {i}" for i in range(count)]
+
+
+def drain(writer):
+    """Flush aż do opróżnienia spoola - powtórka rusza po udanym zapisie świeżych punktów"""
+    for _ in range(50):
+        writer.write(lines('heartbeat', 1))
+        writer.flush()
+        if not writer.spool_size():
+            return
+    raise AssertionError("spool nie został opróżniony")
+
+
+def test_all_points_arrive(server, tmp_path):
+    writer = make_writer(server, tmp_path)
+    expected = lines('dev', 95)
+    writer.write(expected)
+    assert writer.flush() == 95
+    assert server.lines == expected
+    assert server.requests == 5
+
+
+def test_outage_spools_and_recovery_drains_without_loss_or_duplicates(server, tmp_path):
+    writer = make_writer(server, tmp_path)
+    server.down = True
+    outage = lines('outage', 70)
+    writer.write(outage)
+    writer.flush()
+    assert server.lines == []
+    assert writer.stats["points_spooled"] == 20
+    assert writer.queue_depth() == 50
+
+    # Kolejne próby przy niedostępnej bazie przenoszą resztę bufora do spoola
+    while writer.queue_depth():
+        writer.flush()
+    assert writer.stats["points_spooled"] == 70
+    assert writer.spool_size() > 0
+
+    server.down = False
+    drain(writer)
+    received = Counter(server.lines)
+    assert all(received[line] == 1 for line in outage)
+    assert writer.stats["points_replayed"] == 70
+
+
+def test_failed_replay_keeps_only_unsent_points(server, tmp_path):
+    writer = make_writer(server, tmp_path)
+    server.down = True
+    outage = lines('outage', 100)
+    for start in range(0, 100, 20):
+        writer.write(outage[start:start + 20])
+        writer.flush()
+    server.down = False
+
+    # Baza pada ponownie po dwóch paczkach powtórki
+    send = writer._send
+    sent = []
+
+    def flaky_send(batch):
+        if len(sent) == 3:
+            server.down = True
+        sent.append(batch)
+        send(batch)
+
+    writer._send = flaky_send
+    writer.write(lines('fresh', 1))
+    writer.flush()
+    assert writer.stats["points_replayed"] == 40
+    assert (tmp_path / 'influx.lp.replay').read_text().splitlines() == outage[40:]
+
+    writer._send = send
+    server.down = False
+    drain(writer)
+    received = Counter(server.lines)
+    assert all(received[line] == 1 for line in outage)
+    assert not (tmp_path / 'influx.lp.replay').exists()
+
+
+def test_concurrent_overflow_during_outage(server, tmp_path):
+    """Wątki piszą do pełnego bufora, gdy writer w tle zapisuje i powtarza spool przy przerywanej awarii bazy"""
+    writer = make_writer(server, tmp_path, max_buffer=50).start()
+    producers = [f"producer-{i}" for i in range(4)]
+
+    def produce(prefix):
+        batch = lines(prefix, 600)
+        for start in range(0, len(batch), 10):
+            writer.write(batch[start:start + 10])
+            if start % 100 == 0:
+                server.down = not server.down
+
+    threads = [threading.Thread(target=produce, args=(prefix,)) for prefix in producers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    server.down = False
+    writer.close()
+    drain(writer)
+    received = Counter(server.lines)
+    expected = [line for prefix in producers for line in lines(prefix, 600)]
+    assert [line for line in expected if received[line] != 1] == []
+    assert writer.stats["points_spooled"] > 0
@@ -0,0 +1,26 @@
+import pytest
+
+from history import parse_history_args, to_rows
+
+
+def test_to_rows_with_short_series():
+    history = {"time": [0, 60, 120], "metrics": {"cpuUsage": [10.0, None, 30.0], "ramUsage": [50.0]}}
+    rows = to_rows(history)
+    assert [row['timestamp'] for row in rows] == ['1970-01-01T00:00:00Z', '1970-01-01T00:02:00Z']
+    assert rows[1]['data'] == {'cpuUsage': 30.0, 'ramUsage': 0}
+
+
+def test_to_rows_without_cpu_series():
+    assert to_rows({"time": [0, 60], "metrics": {"ramUsage": [1.0, 2.0]}}) == []
+
+
+def test_unknown_aggregate_is_rejected():
+    with pytest.raises(ValueError, match="Nieobsługiwana agregacja"):
+        parse_history_args({'start': '0', 'end': '3600', 'agg': 'median'})
+    assert parse_history_args({'start': '0', 'end': '3600', 'agg': 'max'})['agg'] == 'max'
+
+
+@pytest.mark.parametrize('metrics', [',', '', ',,'])
+def test_empty_metric_list_is_rejected(metrics):
+    with pytest.raises(ValueError, match="co najmniej jedną metrykę"):
+        parse_history_args({'start': '0', 'end': '3600', 'metrics': metrics})
@@ -0,0 +1,51 @@
+from history_cache import HistoryCache
+
+
+class FakeCache(HistoryCache):
+    """Wynik z punktem w każdym przedziale zapytania - bez InfluxDB"""
+
+    def _query(self, metrics, start, end, interval, agg, device):
+        times = list(range(start - start % interval, end, interval))
+        return {"device": device, "start": start, "end": end, "interval": interval, "agg": agg,
+                "source": "influx", "tier": None, "time": times, "metrics": {m: list(times) for m in metrics}}
+
+
+def test_explicit_end_gets_no_points_after_it():
+    cache = FakeCache(None, 'snmp_data', ttl=60)
+    history, status = cache.query(['cpuUsage'], start=3600, end=7210, points=60)
+    assert status == 'miss'
+    assert history["interval"] == 61
+    assert history["time"][-1] < 7210
+    assert history["time"][0] + history["interval"] > 3600
+    assert (history["start"], history["end"]) == (3600, 7210)
+
+    # Inny koniec w tym samym oknie - ten sam wpis, przycięty do własnego zakresu
+    history, status = cache.query(['cpuUsage'], start=3590, end=7200, points=60)
+    assert status == 'hit'
+    assert history["time"][-1] < 7200
+    assert history["time"][0] + history["interval"] > 3590
+    assert history["metrics"]["cpuUsage"] == history["time"]
+
+
+class LiveCache(HistoryCache):
+    """Przedział ma zapis dopiero, gdy minie - jak dane z pollera dopisywane na bieżąco"""
+
+    clock = 0.0
+
+    def _query(self, metrics, start, end, interval, agg, device):
+        times = [t for t in range(start - start % interval, end, interval) if t + interval <= self.clock]
+        return {"device": device, "start": start, "end": end, "interval": interval, "agg": agg,
+                "source": "influx", "tier": None, "time": times, "metrics": {m: list(times) for m in metrics}}
+
+
+def test_sliding_window_picks_up_data_written_after_the_base_fetch(monkeypatch):
+    cache = LiveCache(None, 'snmp_data', ttl=60, settle=30)
+    monkeypatch.setattr('history_cache.time.time', lambda: cache.clock)
+    statuses = []
+    for now in range(100025, 100025 + 10 * 60, 60):
+        cache.clock = now
+        history, status = cache.query(['cpuUsage'], start=now - 3600, end=now, points=360)
+        statuses.append(status)
+        full = cache._query(['cpuUsage'], now - 3600, now, history["interval"], 'mean', None)
+        assert history["time"] == full["time"], f"okno {now}"
+    assert statuses == ['miss'] + ['extended'] * 9
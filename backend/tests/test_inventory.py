@@ -0,0 +1,40 @@
+import json
+
+from inventory import Inventory
+
+
+def write_devices(path, second_key):
+    path.write_text(json.dumps({
+        "defaults": {"username": "monitor", "priv_key": "priv-secret"},
+        "devices": [
+            {"name": "rtr-1", "host": "10.0.0.1", "auth_key": "auth-secret"},
+            {"name": "rtr-2", "host": "10.0.0.2", "auth_key": second_key},
+        ],
+    }))
+
+
+def test_shared_username_with_same_keys(tmp_path):
+    path = tmp_path / "devices.json"
+    write_devices(path, "auth-secret")
+    added, _, _ = Inventory(path=str(path)).load()
+    assert sorted(d['name'] for d in added) == ['rtr-1', 'rtr-2']
+
+
+def test_shared_username_with_different_keys(tmp_path):
+    """Poller konfiguruje użytkownika v3 per engineID agenta, więc hasła mogą się różnić"""
+    path = tmp_path / "devices.json"
+    write_devices(path, "other-secret")
+    added, _, _ = Inventory(path=str(path)).load()
+    assert sorted(d['auth_key'] for d in added) == ['auth-secret', 'other-secret']
+
+
+def test_reload_with_changed_keys_of_shared_username(tmp_path):
+    path = tmp_path / "devices.json"
+    write_devices(path, "auth-secret")
+    inventory = Inventory(path=str(path))
+    inventory.load()
+    write_devices(path, "other-secret-changed")
+    added, changed, removed = inventory.reload()
+    assert (added, removed) == ([], [])
+    assert [d['name'] for d in changed] == ['rtr-2']
+    assert inventory.get('rtr-2')['auth_key'] == "other-secret-changed"
@@ -0,0 +1,66 @@
+import asyncio
+
+from poller import AsyncPoller
+
+OIDS = {'sysName': '1.3.6.1.2.1.1.5.0', 'cpuUsage': '1.3.6.1.4.1.2021.11.9.0'}
+GROUPS = {'inventory': {'interval': 3600.0, 'keys': ['sysName']}}
+
+
+def test_result_carries_fresh_group_and_full_state():
+    """Dalsze etapy dostają tylko wynik odpytanej grupy, a pełny stan - wszystkie grupy"""
+    results = []
+    poller = AsyncPoller([{'name': 'dev', 'host': '127.0.0.1', 'port': 161, 'discovery': False}],
+                         oids=OIDS, groups=GROUPS, on_result=lambda *args: results.append(args),
+                         usm_cache=object(), jitter=0.0)
+    values = {'sysName': 'RTR-Main-01', 'cpuUsage': '17'}
+
+    async def fake_poll(device, oids, discovery=False):
+        return 'ok', {key: values[key] for key in oids}
+
+    async def run():
+        poller._loop = asyncio.get_running_loop()
+        poller._wakeup = asyncio.Event()
+        poller._poll = fake_poll
+        poller._schedule(poller.devices['dev'])
+        jobs = {job.group: job for job in poller.scheduler.due(poller._loop.time() + 7200)}
+        await poller._run_job(jobs['inventory'])
+        await poller._run_job(jobs['default'])
+
+    asyncio.run(run())
+
+    (_, inventory, _), (name, data, state) = results
+    assert inventory == {'sysName': 'RTR-Main-01'}
+    assert name == 'dev'
+    assert data == {'cpuUsage': '17'}
+    assert state == {'sysName': 'RTR-Main-01', 'cpuUsage': '17'}
+
+
+def test_shared_username_with_different_keys_per_agent():
+    """Ta sama nazwa użytkownika v3 z innymi hasłami na dwóch agentach - oba odpytania się udają"""
+    from benchmark import start_local_agent
+    from config import SNMP_CONFIG
+    from usm_cache import UsmKeyCache
+
+    keys = {'dev-a': ('authA-secret', 'privA-secret'), 'dev-b': ('authB-secret', 'privB-secret')}
+    ports = {'dev-a': 16261, 'dev-b': 16262}
+    agents = [start_local_agent(ports[name], options=['--static', '--auth-key', auth, '--priv-key', priv])
+              for name, (auth, priv) in keys.items()]
+    devices = [{'name': name, 'host': '127.0.0.1', 'port': ports[name], 'username': 'simulator',
+                'auth_key': auth, 'priv_key': priv, 'context_name': SNMP_CONFIG['context_name'],
+                'timeout': 1.0, 'retries': 1, 'discovery': False}
+               for name, (auth, priv) in keys.items()]
+    poller = AsyncPoller(devices, oids=OIDS, groups={}, usm_cache=UsmKeyCache(persist=False, persist_engines=False), jitter=0.0)
+
+    async def run():
+        poller._ensure_engine()
+        return [await poller._poll(device, OIDS) for device in devices]
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        for agent in agents:
+            agent.kill()
+            agent.wait()
+
+    assert [status for status, _ in results] == ['ok', 'ok']
+    assert all(data['sysName'] for _, data in results)
@@ -0,0 +1,17 @@
+import os
+import signal
+
+import report
+from benchmark import synthetic_report_devices
+
+
+def test_report_pool_is_rebuilt_after_worker_crash():
+    devices = synthetic_report_devices(2, 60)
+    assert report.create_multi_report(devices).startswith(b'%PDF')
+
+    pool = report.get_pool()
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+    body = report.create_multi_report(devices)
+    assert body.startswith(b'%PDF')
+    assert report.get_pool() is not pool
@@ -0,0 +1,21 @@
+from scheduler import PollScheduler
+
+
+def test_backoff_survives_long_outage():
+    """Urządzenie niedostępne przez ponad 1100 prób nadal jest odpytywane, co najwyżej co backoff_max"""
+    scheduler = PollScheduler(clock=lambda: 0.0, failure_threshold=3, backoff_max=300.0, timeout=1.0, jitter=0.0)
+    scheduler.add('dev', 'fast', 10.0, now=0.0)
+    now = 0.0
+    for attempt in range(1100):
+        now += scheduler.next_delay(now)
+        ready = scheduler.due(now)
+        assert [job.device for job in ready] == ['dev'], f"próba {attempt}"
+        scheduler.finished(ready[0], 'timeout', now)
+        assert scheduler.next_delay(now) <= 300.0
+
+    assert scheduler.is_open('dev')
+    now += scheduler.next_delay(now)
+    job, = scheduler.due(now)
+    scheduler.finished(job, 'ok', now)
+    assert not scheduler.is_open('dev')
+    assert scheduler.next_delay(now) <= 10.0
@@ -0,0 +1,39 @@
+import json
+
+from pysnmp.hlapi import usmHMACMD5AuthProtocol
+
+from usm_cache import UsmKeyCache
+
+
+def seed(cache):
+    cache.master_key(usmHMACMD5AuthProtocol, 'auth-secret')
+    cache._engines['10.0.0.1:161'] = {"engine_id": "80004fb805", "updated_at": 1.0}
+    cache._dirty = True
+    cache.save()
+
+
+def test_master_keys_are_not_written_by_default(tmp_path):
+    """Domyślnie plik zawiera tylko engineID - klucz główny jest odpowiednikiem hasła"""
+    path = tmp_path / "usm.json"
+    seed(UsmKeyCache(path=str(path), persist=False, persist_engines=True))
+    state = json.loads(path.read_text())
+    assert state["master"] == {}
+    assert list(state["engines"]) == ['10.0.0.1:161']
+
+
+def test_master_keys_written_and_loaded_with_persist(tmp_path):
+    path = tmp_path / "usm.json"
+    seed(UsmKeyCache(path=str(path), persist=True, persist_engines=True))
+    cache = UsmKeyCache(path=str(path), persist=True, persist_engines=True)
+    cache.master_key(usmHMACMD5AuthProtocol, 'auth-secret')
+    assert cache.stats["master_hits"] == 1
+
+
+def test_keys_left_by_earlier_persist_are_dropped(tmp_path):
+    """Po wyłączeniu 'persist' klucze zapisane wcześniej znikają z pliku przy następnym zapisie"""
+    path = tmp_path / "usm.json"
+    seed(UsmKeyCache(path=str(path), persist=True, persist_engines=True))
+    cache = UsmKeyCache(path=str(path), persist=False, persist_engines=True)
+    assert cache._master == {}
+    seed(cache)
+    assert json.loads(path.read_text())["master"] == {}
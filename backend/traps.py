@@ -0,0 +1,461 @@
+import time
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio_compat  # noqa: F401 - musi poprzedzać import transportu asyncio z pysnmp
+
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.type import univ
+from pysnmp.carrier.asyncio.dgram import udp
+from pysnmp.entity import config as engine_config
+from pysnmp.entity.rfc3413 import ntfrcv
+from pysnmp.proto import api
+from pysnmp.proto.api import v2c
+from pysnmp.proto import rfc1902
+from pysnmp.proto.proxy import rfc2576
+from pysnmp.hlapi import usmHMACMD5AuthProtocol, usmDESPrivProtocol, usmKeyTypeMaster
+from ber_codec import (TAG_SEQUENCE, TAG_INTEGER, TAG_OCTET_STRING, TAG_NULL, TAG_OID, TAG_IP_ADDRESS,
+                       TAG_UNSIGNED, TAG_EXCEPTIONS, TAG_SNMPV2_TRAP, read_tlv, decode_oid)
+from usm_cache import get_usm_cache
+from mib_snapshot import create_engine
+from config import TRAP_CONFIG
+
+logger = logging.getLogger("SNMP-Traps")
+
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+SNMP_TRAP_ADDRESS = (1, 3, 6, 1, 6, 3, 18, 1, 3, 0)   # Adres agenta, gdy powiadomienie idzie przez proxy
+IF_INDEX = (1, 3, 6, 1, 2, 1, 2, 2, 1, 1)
+IF_OPER_STATUS = (1, 3, 6, 1, 2, 1, 2, 2, 1, 8)
+
+LINK_DOWN = (1, 3, 6, 1, 6, 3, 1, 1, 5, 3)
+LINK_UP = (1, 3, 6, 1, 6, 3, 1, 1, 5, 4)
+TRAP_NAMES = {
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 1): 'coldStart',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 2): 'warmStart',
+    LINK_DOWN: 'linkDown',
+    LINK_UP: 'linkUp',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 5): 'authenticationFailure',
+}
+
+
+def message_version(datagram):
+    """Wersja SNMP z nagłówka BER (SEQUENCE { INTEGER version, ... }) bez dekodowania całości"""
+    try:
+        if datagram[0] != 0x30:
+            return None
+        offset = 2 + (datagram[1] & 0x7f if datagram[1] & 0x80 else 0)
+        if datagram[offset] != 0x02:
+            return None
+        length = datagram[offset + 1]
+        return int.from_bytes(datagram[offset + 2:offset + 2 + length], 'big')
+    except IndexError:
+        return None
+
+
+# Szybka ścieżka dla trapów v2c: ręczne przejście BER zamiast drzewa obiektów pyasn1
+# (ok. 1 ms na trap).  Nietypowe wiadomości zwracają None i idą przez pyasn1.
+
+def _octets_text(octets):
+    try:
+        text = octets.decode('utf-8')
+        if text.isprintable():
+            return text
+    except UnicodeDecodeError:
+        pass
+    return '0x' + octets.hex()
+
+
+def _decode_value(tag, data):
+    if tag == TAG_INTEGER:
+        return int.from_bytes(data, 'big', signed=True)
+    if tag in TAG_UNSIGNED:
+        return int.from_bytes(data, 'big')
+    if tag == TAG_OID:
+        return decode_oid(data)
+    if tag == TAG_OCTET_STRING:
+        return _octets_text(bytes(data))
+    if tag == TAG_IP_ADDRESS:
+        return '.'.join(map(str, data))
+    if tag == TAG_NULL or tag in TAG_EXCEPTIONS:
+        return None
+    raise ValueError(f"Nieobsługiwany typ BER 0x{tag:02x}")
+
+
+def decode_v2c_trap(datagram):
+    """Dekoduje trap SNMPv2c do (community, [(oid, wartość)]) albo None dla innych wiadomości"""
+    try:
+        data = memoryview(datagram)
+        tag, pos, end = read_tlv(data, 0)
+        if tag != TAG_SEQUENCE:
+            return None
+        tag, start, pos = read_tlv(data, pos)
+        if tag != TAG_INTEGER or int.from_bytes(data[start:pos], 'big') != api.protoVersion2c:
+            return None
+        tag, start, pos = read_tlv(data, pos)
+        if tag != TAG_OCTET_STRING:
+            return None
+        community = bytes(data[start:pos]).decode('utf-8', 'replace')
+        tag, pos, end = read_tlv(data, pos)
+        if tag != TAG_SNMPV2_TRAP:
+            return None
+        for _ in range(3):  # request-id, error-status, error-index
+            tag, start, pos = read_tlv(data, pos)
+        tag, pos, end = read_tlv(data, pos)
+        if tag != TAG_SEQUENCE:
+            return None
+
+        var_binds = []
+        while pos < end:
+            tag, pos, bind_end = read_tlv(data, pos)
+            tag, start, pos = read_tlv(data, pos)
+            if tag != TAG_OID:
+                return None
+            oid = decode_oid(data[start:pos])
+            tag, start, pos = read_tlv(data, pos)
+            var_binds.append((oid, _decode_value(tag, data[start:pos])))
+            pos = bind_end
+        return community, var_binds
+    except (IndexError, ValueError):
+        return None
+
+
+def native_value(value):
+    """Wartość pyasn1 jako typ Pythona, w tej samej postaci co z decode_v2c_trap()"""
+    if value is None or isinstance(value, (int, str, tuple)):
+        return value
+    if isinstance(value, univ.Null):
+        return None
+    if isinstance(value, univ.ObjectIdentifier):
+        return tuple(value)
+    if isinstance(value, univ.Integer):
+        return int(value)
+    if value.tagSet == rfc1902.IpAddress.tagSet:
+        return '.'.join(map(str, value.asNumbers()))
+    if isinstance(value, univ.OctetString):
+        return _octets_text(value.asOctets())
+    return value.prettyPrint()
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, tuple):
+        return '.'.join(map(str, value))
+    return str(value)
+
+
+def notification_fields(var_binds):
+    """Zamienia zmienne powiadomienia na pola w formacie odczytu pollera (ifN_Status)"""
+    trap_oid = None
+    if_index = None
+    agent_address = None
+    fields = {}
+    values = {}
+
+    for name, value in var_binds:
+        oid = tuple(name)
+        value = native_value(value)
+        values['.'.join(map(str, oid))] = _text(value)
+        if oid == SNMP_TRAP_OID:
+            trap_oid = value
+        elif oid == SNMP_TRAP_ADDRESS:
+            agent_address = value
+        elif oid[:len(IF_OPER_STATUS)] == IF_OPER_STATUS and len(oid) > len(IF_OPER_STATUS):
+            fields[f"if{oid[len(IF_OPER_STATUS)]}_Status"] = _text(value)
+        elif oid[:len(IF_INDEX)] == IF_INDEX:
+            if_index = value
+
+    # linkDown/linkUp bez ifOperStatus - status wynika z rodzaju powiadomienia
+    if trap_oid in (LINK_DOWN, LINK_UP) and if_index is not None:
+        fields.setdefault(f"if{if_index}_Status", '2' if trap_oid == LINK_DOWN else '1')
+
+    trap = TRAP_NAMES.get(trap_oid) or (_text(trap_oid) if trap_oid else None)
+    return trap, fields, values, agent_address
+
+
+class NotificationTransport(udp.UdpAsyncioTransport):
+    """Transport UDP pysnmp, który v1/v2c przekazuje do kolejki odbiornika, a v3 do silnika"""
+    receiver = None
+
+    def datagram_received(self, datagram, transportAddress):
+        if not self.receiver.accept(datagram, transportAddress):
+            super().datagram_received(datagram, transportAddress)
+
+
+class TrapReceiver:
+    """Odbiornik powiadomień SNMP na własnej pętli asyncio w wątku tła.
+
+    Trapy v1/v2c (i informy v2c) trafiają do ograniczonej kolejki i są
+    dekodowane paczkami w puli wątków - przy przeciążeniu nadmiar jest
+    odrzucany, a odbiór nie blokuje się.  Informy v3 obsługuje silnik pysnmp
+    (USM, odpowiedź do nadawcy).  Każde zdarzenie z rozpoznanym urządzeniem
+    jest przekazywane do on_event(event).
+    """
+
+    def __init__(self, devices, on_event=None, **options):
+        self.options = dict(TRAP_CONFIG, **options)
+        self.on_event = on_event
+        self.recent = deque(maxlen=self.options['recent_events'])
+        self.loop = None
+        self.transport = None
+        self._queue = None
+        self._workers = []
+        self._executor = ThreadPoolExecutor(max_workers=self.options['workers'],
+                                            thread_name_prefix="trap-decoder")
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "received": 0,
+            "dropped": 0,
+            "events": 0,
+            "informs": 0,
+            "decode_errors": 0,
+            "bad_community": 0,
+            "unknown_source": 0,
+            "max_latency": 0.0,
+        }
+
+        # Użytkownicy v3 dodani do silnika odbiornika: {nazwa: (auth_key, priv_key)}
+        self._users = {}
+        self._conflicts = {}
+        self.set_devices(devices)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    # Wątek i pętla zdarzeń
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="trap-receiver")
+            self._thread.start()
+            self._ready.wait()
+            if self._error:
+                self._thread = None
+                raise self._error
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._setup())
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        logger.info(f"Odbiornik powiadomień SNMP nasłuchuje na {self.options['host']}:{self.options['port']}")
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.transport.closeTransport()
+            self.loop.close()
+
+    async def _setup(self):
+        self._queue = asyncio.Queue(maxsize=self.options['queue_size'])
+        self.snmp_engine = create_engine()
+
+        self.transport = NotificationTransport(loop=self.loop)
+        self.transport.receiver = self
+        self.transport.openServerMode((self.options['host'], self.options['port']))
+        engine_config.addTransport(self.snmp_engine, udp.domainName, self.transport)
+        await self.transport._lport
+        # Większy bufor gniazda wyrównuje krótkie serie trapów (np. burza linkDown)
+        sock = self.transport.transport.get_extra_info('socket')
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.options['socket_buffer'])
+        except OSError as e:
+            logger.warning(f"Nie udało się ustawić bufora gniazda: {e}")
+
+        self._configure_users()
+        ntfrcv.NotificationReceiver(self.snmp_engine, self._on_engine_notification)
+
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.options['workers'])]
+
+    def set_devices(self, devices):
+        """Nowy inwentarz: mapa adresów od razu, użytkownicy v3 w pętli odbiornika"""
+        devices = list(devices)
+        # Urządzenie rozpoznawane po adresie IP nadawcy (pierwsze o danym adresie)
+        hosts = {}
+        for device in devices:
+            hosts.setdefault(device['host'], device['name'])
+        self.devices, self.hosts = devices, hosts
+        if self.loop is not None and self._ready.is_set() and self._error is None:
+            self.loop.call_soon_threadsafe(self._configure_users)
+
+    def _configure_users(self):
+        """Informy v3: odbiornik jest silnikiem autorytatywnym, klucze lokalizowane jego engineID.
+
+        Odbiornik rozpoznaje użytkownika tylko po nazwie (jego własny engineID
+        jest wspólny dla wszystkich nadawców), więc na nazwę przypada jeden
+        zestaw haseł - z pierwszego urządzenia.  Informy v3 urządzeń z innymi
+        hasłami tej nazwy nie przejdą uwierzytelnienia; pułapki v1/v2c
+        i odpytywanie działają normalnie.
+        """
+        usm_cache = get_usm_cache()
+        users, conflicts = {}, {}
+        for device in sorted(self.devices, key=lambda d: d['name']):
+            keys = (device['auth_key'], device['priv_key'])
+            if users.setdefault(device['username'], keys) != keys:
+                conflicts.setdefault(device['username'], []).append(device['name'])
+        for username, names in conflicts.items():
+            if self._conflicts.get(username) != names:
+                logger.warning(f"Użytkownik SNMPv3 {username} ma różne hasła na kilku urządzeniach - "
+                               f"informy v3 od {', '.join(names)} nie zostaną uwierzytelnione")
+        self._conflicts = conflicts
+        for username, (auth_key, priv_key) in users.items():
+            if self._users.get(username) == (auth_key, priv_key):
+                continue
+            # addV3User zastępuje istniejący wpis użytkownika
+            engine_config.addV3User(
+                self.snmp_engine, username,
+                usmHMACMD5AuthProtocol, usm_cache.master_key(usmHMACMD5AuthProtocol, auth_key),
+                usmDESPrivProtocol,
+                usm_cache.master_key(usmDESPrivProtocol, priv_key, usmHMACMD5AuthProtocol),
+                authKeyType=usmKeyTypeMaster, privKeyType=usmKeyTypeMaster
+            )
+            self._users[username] = (auth_key, priv_key)
+
+    def stop(self):
+        if self.loop and self._thread:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._executor.shutdown(wait=False)
+
+    # Odbiór
+
+    def accept(self, datagram, address):
+        """Wywoływane dla każdego datagramu; False oznacza przekazanie do silnika pysnmp"""
+        version = message_version(datagram)
+        if version not in (api.protoVersion1, api.protoVersion2c):
+            return False
+        self.stats["received"] += 1
+        try:
+            self._queue.put_nowait((version, datagram, address, time.time()))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+        return True
+
+    async def _worker(self):
+        batch_size = self.options['batch_size']
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                results = await self.loop.run_in_executor(self._executor, self._decode_batch, batch)
+            except Exception as e:
+                logger.error(f"Błąd dekodowania powiadomień: {e}")
+                continue
+            for event, response, address in results:
+                if response is not None:
+                    self.transport.sendMessage(response, address)
+                self._handle(event)
+
+    def _decode_batch(self, batch):
+        results = []
+        for version, datagram, address, received_at in batch:
+            try:
+                fast = decode_v2c_trap(datagram) if version == api.protoVersion2c else None
+                if fast is not None:
+                    community, var_binds = fast
+                    if community != self.options['community']:
+                        self._count("bad_community")
+                        continue
+                    results.append((self._event(address, var_binds, 'v2c', received_at), None, address))
+                    continue
+
+                p_mod = api.protoModules[version]
+                msg, _ = decoder.decode(datagram, asn1Spec=p_mod.Message())
+                if str(p_mod.apiMessage.getCommunity(msg)) != self.options['community']:
+                    self._count("bad_community")
+                    continue
+                pdu = p_mod.apiMessage.getPDU(msg)
+
+                response = None
+                if version == api.protoVersion1:
+                    if not pdu.isSameTypeWith(p_mod.TrapPDU()):
+                        continue
+                    var_binds = v2c.apiPDU.getVarBinds(rfc2576.v1ToV2(pdu))
+                elif pdu.isSameTypeWith(p_mod.InformRequestPDU()):
+                    var_binds = p_mod.apiPDU.getVarBinds(pdu)
+                    response_msg = p_mod.apiMessage.getResponse(msg)
+                    p_mod.apiPDU.setVarBinds(p_mod.apiMessage.getPDU(response_msg), var_binds)
+                    response = encoder.encode(response_msg)
+                    self._count("informs")
+                elif pdu.isSameTypeWith(p_mod.SNMPv2TrapPDU()):
+                    var_binds = p_mod.apiPDU.getVarBinds(pdu)
+                else:
+                    continue
+
+                version_name = 'v1' if version == api.protoVersion1 else 'v2c'
+                results.append((self._event(address, var_binds, version_name, received_at), response, address))
+            except Exception as e:
+                self._count("decode_errors")
+                logger.debug(f"Niepoprawne powiadomienie od {address}: {e}")
+        return results
+
+    def _on_engine_notification(self, snmp_engine, state_reference, context_engine_id, context_name,
+                                var_binds, cb_ctx):
+        # Informy v3 - zdekodowane i potwierdzone przez silnik pysnmp
+        _, address = snmp_engine.msgAndPduDsp.getTransportInfo(state_reference)
+        self.stats["received"] += 1
+        self._count("informs")
+        self._handle(self._event(address, var_binds, 'v3', time.time()))
+
+    # Zdarzenia
+
+    def _event(self, address, var_binds, version, received_at):
+        trap, fields, values, agent_address = notification_fields(var_binds)
+        # Trapy v1 z pustym agent-addr (0.0.0.0) przypisujemy nadawcy
+        source = agent_address if agent_address not in (None, '0.0.0.0') else address[0]
+        return {
+            "device": self.hosts.get(source),
+            "source": source,
+            "version": version,
+            "trap": trap,
+            "fields": fields,
+            "varbinds": values,
+            "received_at": received_at,
+        }
+
+    def _handle(self, event):
+        latency = time.time() - event["received_at"]
+        with self._lock:
+            self.stats["events"] += 1
+            self.stats["max_latency"] = max(self.stats["max_latency"], latency)
+        self.recent.append(event)
+
+        if event["device"] is None:
+            self._count("unknown_source")
+            return
+        if self.on_event:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error(f"Błąd obsługi powiadomienia od {event['device']}: {e}")
+
+    def events(self, limit=100, device=None):
+        events = [e for e in list(self.recent) if device is None or e["device"] == device]
+        return events[-limit:]
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self._queue.qsize() if self._queue else 0
+        stats["max_latency"] = round(stats["max_latency"], 4)
+        return stats
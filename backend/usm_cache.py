@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from pyasn1.type import univ
+from pysnmp.entity import config as engine_config
+from pysnmp.hlapi import UsmUserData, usmKeyTypeMaster
+from config import USM_CACHE_CONFIG
+
+logger = logging.getLogger("SNMP-UsmCache")
+
+
+def _fingerprint(*parts):
+    """Indeks wpisu bez przechowywania hasła w jawnej postaci"""
+    return hashlib.sha256('\x00'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def _oid(protocol):
+    return '.'.join(str(x) for x in protocol)
+
+
+def target_key(transport_addr):
+    return f"{transport_addr[0]}:{transport_addr[1]}"
+
+
+class UsmKeyCache:
+    """Pamięć podręczna kluczy USM i engineID agentów, opcjonalnie zapisywana na dysk.
+
+    Klucze główne (hashPassphrase - 1 MB haszowania na hasło) są trzymane wg
+    (hasło, protokół), więc urządzenia o wspólnych danych uwierzytelniających
+    liczą je raz.  Dla każdego celu (host:port) zapamiętywany jest engineID
+    oraz snmpEngineBoots/Time agenta, którymi zasilany jest silnik przed
+    zapytaniem - pierwsze zapytanie po restarcie nie wymaga wtedy wykrywania
+    engineID ani synchronizacji czasu.  Na dysk trafiają domyślnie tylko
+    engineID ('persist_engines'); klucz główny wystarcza do podszycia się
+    pod użytkownika, więc zapisywany jest tylko z 'persist'.
+    """
+
+    def __init__(self, path=None, **options):
+        self.options = dict(USM_CACHE_CONFIG, **options)
+        persist = self.options['persist'] or self.options['persist_engines']
+        self.path = (path or self.options['path']) if persist else None
+        self._master = {}
+        self._engines = {}
+        self._unconfirmed = set()
+        self._forgotten = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.time()
+
+        self.stats = {
+            "master_hits": 0,
+            "master_misses": 0,
+            "engine_hits": 0,
+            "engine_misses": 0,
+            "engines_learned": 0,
+            "engine_stale": 0,
+        }
+        self.load()
+
+    # Klucze główne
+
+    def master_key(self, protocol, passphrase, auth_protocol=None):
+        """Klucz główny dla protokołu uwierzytelniania lub (z auth_protocol) szyfrowania"""
+        key = _fingerprint(_oid(protocol), _oid(auth_protocol or ()), passphrase)
+        with self._lock:
+            cached = self._master.get(key)
+            if cached is not None:
+                self.stats["master_hits"] += 1
+                return univ.OctetString(hexValue=cached)
+            self.stats["master_misses"] += 1
+
+        if auth_protocol is None:
+            master = engine_config.authServices[protocol].hashPassphrase(passphrase)
+        else:
+            master = engine_config.privServices[protocol].hashPassphrase(auth_protocol, passphrase)
+
+        with self._lock:
+            self._master[key] = master.asOctets().hex()
+            self._dirty = True
+        return master
+
+    def user_data(self, username, auth_key, priv_key, auth_protocol, priv_protocol, engine_id=None):
+        """UsmUserData z kluczami głównymi - pysnmp tylko je lokalizuje (jeden skrót).
+
+        Z 'engine_id' użytkownik jest konfigurowany dla tego agenta, a nie
+        jako wspólny szablon nazwy - urządzenia z tą samą nazwą użytkownika
+        mogą wtedy mieć różne hasła.
+        """
+        return UsmUserData(
+            username,
+            self.master_key(auth_protocol, auth_key),
+            self.master_key(priv_protocol, priv_key, auth_protocol),
+            authProtocol=auth_protocol,
+            privProtocol=priv_protocol,
+            securityEngineId=engine_id,
+            authKeyType=usmKeyTypeMaster,
+            privKeyType=usmKeyTypeMaster
+        )
+
+    # engineID i czas agentów
+
+    # Wewnętrzne tablice pysnmp 4.4 (vendor): engineID celów w modelu przetwarzania v3
+    # (wpisy wygasają po 300 s) oraz snmpEngineBoots/Time agentów w USM
+    ENGINE_ID_LIFETIME = 300
+
+    def _peer_key(self, target):
+        return (tuple(target.transportDomain), target.transportAddr)
+
+    def _mp_model(self, snmp_engine):
+        return snmp_engine.messageProcessingSubsystems[3]
+
+    def _timeline(self, snmp_engine):
+        return snmp_engine.securityModels[3]._SnmpUSMSecurityModel__timeline
+
+    def prime(self, snmp_engine, target):
+        """Zasila silnik zapamiętanym engineID celu, jeśli go jeszcze nie zna"""
+        mp_model = self._mp_model(snmp_engine)
+        engine_ids = mp_model._SnmpV3MessageProcessingModel__engineIdCache
+        k = self._peer_key(target)
+        if k in engine_ids:
+            return True
+
+        with self._lock:
+            entry = self._engines.get(target_key(target.transportAddr))
+        if entry is None or time.time() - entry["updated_at"] > self.options['engine_ttl']:
+            self.stats["engine_misses"] += 1
+            return False
+
+        engine_id = univ.OctetString(hexValue=entry["engine_id"])
+        engine_ids[k] = {
+            'securityEngineId': engine_id,
+            'contextEngineId': engine_id,
+            'contextName': univ.OctetString(''),
+        }
+        # Wpis wygasa tak samo jak wykryty przez pysnmp
+        dispatcher = snmp_engine.transportDispatcher
+        resolution = dispatcher.getTimerResolution() if dispatcher else 0.5
+        queue = mp_model._SnmpV3MessageProcessingModel__engineIdCacheExpQueue
+        expire_at = int(mp_model._SnmpV3MessageProcessingModel__expirationTimer + self.ENGINE_ID_LIFETIME / resolution)
+        queue.setdefault(expire_at, []).append(k)
+
+        timeline = self._timeline(snmp_engine)
+        if engine_id not in timeline:
+            # Czas agenta szacowany od ostatniego odczytu; po restarcie agenta
+            # odpowie on notInTimeWindow, a pysnmp zsynchronizuje się i ponowi zapytanie
+            now = int(time.time())
+            estimate = entry["time"] + max(0, now - int(entry["updated_at"]))
+            timeline[engine_id] = (univ.Integer(entry["boots"]), univ.Integer(estimate),
+                                   univ.Integer(estimate), now)
+        with self._lock:
+            self._unconfirmed.add(k)
+        self.stats["engine_hits"] += 1
+        return True
+
+    def peer_engine_id(self, snmp_engine, target):
+        """engineID celu znany silnikowi (wykryty albo z prime) jako bajty; None, gdy nieznany"""
+        peer = self._mp_model(snmp_engine)._SnmpV3MessageProcessingModel__engineIdCache.get(self._peer_key(target))
+        return peer['securityEngineId'].asOctets() if peer else None
+
+    def invalidate(self, snmp_engine, target):
+        """Usuwa engineID celu po nieudanym zapytaniu (np. wymieniony agent).
+
+        Zwraca True, jeśli był to niepotwierdzony jeszcze wpis z pamięci -
+        zapytanie warto wtedy od razu ponowić ze zwykłym wykrywaniem engineID.
+        """
+        mp_model = self._mp_model(snmp_engine)
+        engine_ids = mp_model._SnmpV3MessageProcessingModel__engineIdCache
+        k = self._peer_key(target)
+        if engine_ids.pop(k, None) is not None:
+            # pysnmp usuwa wygasłe wpisy bez sprawdzania, więc czyścimy też kolejkę
+            for keys in mp_model._SnmpV3MessageProcessingModel__engineIdCacheExpQueue.values():
+                while k in keys:
+                    keys.remove(k)
+
+        with self._lock:
+            seeded = k in self._unconfirmed
+            self._unconfirmed.discard(k)
+            self._forgotten.add(target_key(target.transportAddr))
+            if self._engines.pop(target_key(target.transportAddr), None):
+                self._dirty = True
+        if seeded:
+            self.stats["engine_stale"] += 1
+        return seeded
+
+    def learn(self, snmp_engine, target):
+        """Zapamiętuje engineID i czas agenta po udanym zapytaniu"""
+        k = self._peer_key(target)
+        peer = self._mp_model(snmp_engine)._SnmpV3MessageProcessingModel__engineIdCache.get(k)
+        timeline = self._timeline(snmp_engine)
+        if not peer or peer['securityEngineId'] not in timeline:
+            return
+        engine_id = peer['securityEngineId']
+        boots, engine_time, _, updated_at = timeline[engine_id]
+
+        key = target_key(target.transportAddr)
+        entry = {
+            "engine_id": engine_id.asOctets().hex(),
+            "boots": int(boots),
+            "time": int(engine_time),
+            "updated_at": updated_at,
+        }
+        with self._lock:
+            self._unconfirmed.discard(k)
+            previous = self._engines.get(key)
+            if previous == entry:
+                return
+            if previous is None or previous["engine_id"] != entry["engine_id"]:
+                self.stats["engines_learned"] += 1
+            self._engines[key] = entry
+            self._forgotten.discard(key)
+            self._dirty = True
+
+        if self.path and time.time() - self._saved_at > self.options['save_interval']:
+            self.save()
+
+    def engine_id(self, transport_addr):
+        with self._lock:
+            entry = self._engines.get(target_key(transport_addr))
+        return entry["engine_id"] if entry else None
+
+    def forget(self, transport_addr):
+        with self._lock:
+            self._forgotten.add(target_key(transport_addr))
+            if self._engines.pop(target_key(transport_addr), None):
+                self._dirty = True
+
+    # Zapis na dysk
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+            with self._lock:
+                if self.options['persist']:
+                    self._master.update(state.get("master", {}))
+                if self.options['persist_engines']:
+                    self._engines.update(state.get("engines", {}))
+            logger.info(f"Wczytano {len(self._master)} kluczy i {len(self._engines)} engineID z {self.path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Nie udało się wczytać pamięci USM {self.path}: {e}")
+
+    def _merge_saved(self, state, forgotten):
+        """Dołącza wpisy zapisane w międzyczasie przez inne procesy (np. shardy pollera)"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if self.options['persist']:
+            for key, value in saved.get("master", {}).items():
+                state["master"].setdefault(key, value)
+        if not self.options['persist_engines']:
+            return
+        for key, entry in saved.get("engines", {}).items():
+            if key in forgotten:
+                continue
+            current = state["engines"].get(key)
+            if current is None or entry.get("updated_at", 0) > current.get("updated_at", 0):
+                state["engines"][key] = entry
+
+    def save(self):
+        """Zapisuje stan atomowo; plik może zawierać klucze główne, więc jest czytelny tylko dla właściciela"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {"master": dict(self._master) if self.options['persist'] else {},
+                     "engines": dict(self._engines) if self.options['persist_engines'] else {}}
+            forgotten = set(self._forgotten)
+            self._dirty = False
+            self._saved_at = time.time()
+        self._merge_saved(state, forgotten)
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Błąd zapisu pamięci USM {self.path}: {e}")
+
+    def metrics(self):
+        def rate(hits, misses):
+            total = self.stats[hits] + self.stats[misses]
+            return round(self.stats[hits] / total, 3) if total else None
+
+        with self._lock:
+            sizes = {"master_keys": len(self._master), "engines": len(self._engines)}
+        return dict(self.stats, **sizes,
+                    master_hit_rate=rate("master_hits", "master_misses"),
+                    engine_hit_rate=rate("engine_hits", "engine_misses"))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_usm_cache():
+    """Współdzielona pamięć USM procesu, zapisywana przy zamknięciu"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UsmKeyCache()
+            atexit.register(_cache.save)
+        return _cache
@@ -30,6 +30,14 @@ function App() {
       return `${parseFloat((bytes / Math.pow(k, i)).toFixed(dm))} ${sizes[i]}`;
   };
 
+  const formatBits = (bps) => {
+      const value = parseFloat(bps);
+      if (!value) return '0 b/s';
+      const units = ['b/s', 'kb/s', 'Mb/s', 'Gb/s', 'Tb/s'];
+      const i = Math.max(0, Math.min(Math.floor(Math.log(value) / Math.log(1000)), units.length - 1));
+      return `${(value / Math.pow(1000, i)).toFixed(2)} ${units[i]}`;
+  };
+
   const formatUptime = (ticks) => {
       if (!ticks) return 'N/A';
       const seconds = parseInt(ticks, 10) / 100;
@@ -104,14 +112,57 @@ function App() {
     }
   }, []); // API_URL jest stałe, więc pusta tablica jest ok
 
-  // Uruchomienie interwału
-  useEffect(() => {
+  const applyData = useCallback((data) => {
+    setCurrentData(data);
+    checkAlerts(data);
+    setError(null);
+    setLoading(false);
+  }, []);
+
+  const startPolling = useCallback(() => {
+    if (intervalRef.current) return;
     fetchData();
     intervalRef.current = setInterval(fetchData, 5000);
+  }, [fetchData]);
+
+  // Strumień SSE z backendu (pełna migawka, potem tylko zmienione pola);
+  // przy braku obsługi EventSource lub błędzie wracamy do odpytywania co 5 s
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') {
+      startPolling();
+      return () => clearInterval(intervalRef.current);
+    }
+
+    const source = new EventSource(`${API_URL}/stream`);
+    let latest = null;
+
+    source.addEventListener('snapshot', (e) => {
+      latest = JSON.parse(e.data);
+      setDebugInfo(`Strumień: migawka ${e.data.substring(0, 50)}...`);
+      applyData(latest);
+    });
+
+    source.addEventListener('update', (e) => {
+      latest = { ...(latest || {}), ...JSON.parse(e.data) };
+      setDebugInfo(`Strumień: zmiany ${e.data.substring(0, 50)}...`);
+      applyData(latest);
+    });
+
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        setDebugInfo('Strumień niedostępny, przełączam na odpytywanie');
+        startPolling();
+      }
+    };
+
     return () => {
-      if (intervalRef.current) clearInterval(intervalRef.current);
+      source.close();
+      if (intervalRef.current) {
+        clearInterval(intervalRef.current);
+        intervalRef.current = null;
+      }
     };
-  }, [fetchData]); // dodatnie fetchData do zależności
+  }, [applyData, startPolling]);
 
   // Aktualizacja historii wykresów
   useEffect(() => {
@@ -245,8 +296,14 @@ function App() {
                                     {currentData?.[`if${id}_Status`] === '1' ? '● UP' : '● DOWN'}
                                 </span>
                             </td>
-                            <td>{formatBytes(currentData?.[`if${id}_In`] || 0)}</td>
-                            <td>{formatBytes(currentData?.[`if${id}_Out`] || 0)}</td>
+                            <td>
+                                {formatBytes(currentData?.[`if${id}_In`] || 0)}
+                                {currentData?.[`if${id}_InBps`] && <small> ({formatBits(currentData[`if${id}_InBps`])})</small>}
+                            </td>
+                            <td>
+                                {formatBytes(currentData?.[`if${id}_Out`] || 0)}
+                                {currentData?.[`if${id}_OutBps`] && <small> ({formatBits(currentData[`if${id}_OutBps`])})</small>}
+                            </td>
                             
                             <td style={{
                                 color: (parseInt(currentData?.[`if${id}_ErrIn`], 10) > 0 || parseInt(currentData?.[`if${id}_ErrOut`], 10) > 0) ? '#c0392b' : '#7f8c8d',